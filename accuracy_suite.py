@@ -0,0 +1,405 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Accuracy and latency regression suite over a folder of images.
+
+Every model runs in a worker process of a pool (Edge TPU models in a pool
+of their own, one at a time) and builds its engine once for all images.
+Outputs are cached in cache_dir keyed by the SHA-256 of the model and of the
+image, so after changing one model only that model is run again. Latency is
+measured afterwards in a separate pass, one model at a time with nothing
+else running, and never cached, so it always describes this host as it is
+now.
+
+Poses are compared in image coordinates against ground truth: a labels file
+next to the image (<image>.json, with "keypoints" [N, 17, 2] and optional
+"visible" [N, 17]) or else the output of a reference model. Reported
+metrics, per model over all images:
+
+  oks: Mean object keypoint similarity of every true pose with its match,
+    0 for missed people.
+  pck: Fraction of visible true keypoints within pck_alpha times the size
+    of the person's bounding box.
+  error_px: Mean distance of matched visible keypoints, per KeypointType.
+  latency_ms: Median run_inference time of the serial latency pass.
+
+With --baseline, results are compared with an earlier --output file and the
+suite fails if OKS or PCK dropped by more than --tolerance.
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from pose_engine import KeypointType, PoseEngine, oks_matrix, poses_to_arrays
+
+CACHE_VERSION = 2
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def file_hash(path):
+    """Returns the hex SHA-256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_images(directory):
+    """Returns the sorted image paths in a directory."""
+    return sorted(path for path in glob.glob(os.path.join(directory, '*'))
+                  if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def load_labels(image_path):
+    """Returns (keypoints, visible) from <image>.json, None if there is none."""
+    label_path = os.path.splitext(image_path)[0] + '.json'
+    if not os.path.exists(label_path):
+        return None
+    with open(label_path) as f:
+        labels = json.load(f)
+    keypoints = np.asarray(labels['keypoints'], dtype=np.float32).reshape(-1, len(KeypointType), 2)
+    visible = np.asarray(labels.get('visible', np.ones(keypoints.shape[:2])), dtype=bool)
+    return keypoints, visible.reshape(keypoints.shape[:2])
+
+
+def match_poses(keypoints, keypoint_scores, truth, truth_visible, threshold=0.2):
+    """Matches detected to true poses one to one, best OKS first.
+
+    Returns:
+      (matches, oks) where matches is a list of (detection, truth) index
+      pairs and oks the [N, M] OKS matrix.
+    """
+    truth_scores = truth_visible.astype(np.float32)
+    scores = np.where(keypoint_scores >= threshold, 1.0, 0.0).astype(np.float32)
+    # Keypoints the model missed count as far away, not as unknown.
+    keypoints = np.where(scores[..., np.newaxis] > 0, keypoints, np.float32(1e6))
+    oks = oks_matrix(keypoints, np.ones_like(scores), truth, truth_scores, threshold=0.5)
+    matches = []
+    used_detections = set()
+    used_truths = set()
+    for flat in np.argsort(-oks, axis=None, kind='stable'):
+        detection, true_pose = divmod(int(flat), oks.shape[1])
+        if oks[detection, true_pose] <= 0:
+            break
+        if detection not in used_detections and true_pose not in used_truths:
+            matches.append((detection, true_pose))
+            used_detections.add(detection)
+            used_truths.add(true_pose)
+    return matches, oks
+
+
+def evaluate_poses(keypoints, keypoint_scores, truth, truth_visible, threshold=0.2,
+                   pck_alpha=0.1):
+    """Compares the poses of one image with the ground truth.
+
+    Args:
+      keypoints: [N, 17, 2] detected keypoints, in image coordinates.
+      keypoint_scores: [N, 17] keypoint scores.
+      truth: [M, 17, 2] true keypoints.
+      truth_visible: [M, 17] visibility of the true keypoints.
+      threshold: Detected keypoints scoring below this are missing.
+      pck_alpha: PCK distance threshold, relative to the bounding box size.
+
+    Returns:
+      Dict of per image sums: 'oks' (sum over true poses), 'poses',
+      'pck_hits', 'pck_total', 'error_sum' and 'error_count' ([17] each).
+    """
+    num_keypoints = len(KeypointType)
+    result = {'oks': 0.0, 'poses': len(truth), 'pck_hits': 0, 'pck_total': 0,
+              'error_sum': np.zeros(num_keypoints), 'error_count': np.zeros(num_keypoints)}
+    result['pck_total'] = int(truth_visible.sum())
+    if not len(truth) or not len(keypoints):
+        return result
+    matches, oks = match_poses(keypoints, keypoint_scores, truth, truth_visible, threshold)
+    for detection, true_pose in matches:
+        result['oks'] += float(oks[detection, true_pose])
+        visible = truth_visible[true_pose]
+        found = visible & (keypoint_scores[detection] >= threshold)
+        points = truth[true_pose][visible]
+        size = float((points.max(axis=0) - points.min(axis=0)).max()) if len(points) else 0.0
+        distances = np.linalg.norm(keypoints[detection] - truth[true_pose], axis=1)
+        result['pck_hits'] += int((found & (distances <= pck_alpha * size)).sum())
+        result['error_sum'][found] += distances[found]
+        result['error_count'][found] += 1
+    return result
+
+
+def summarize(results):
+    """Sums evaluate_poses results over images into the reported metrics."""
+    poses = sum(r['poses'] for r in results)
+    pck_total = sum(r['pck_total'] for r in results)
+    error_sum = sum(r['error_sum'] for r in results)
+    error_count = sum(r['error_count'] for r in results)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        per_keypoint = error_sum / error_count
+    return {'oks': sum(r['oks'] for r in results) / poses if poses else float('nan'),
+            'pck': sum(r['pck_hits'] for r in results) / pck_total if pck_total else float('nan'),
+            'error_px': {k.name: float(e) for k, e in zip(KeypointType, per_keypoint)},
+            'mean_error_px': float(error_sum.sum() / error_count.sum())
+                             if error_count.sum() else float('nan')}
+
+
+def _cache_path(cache_dir, model_hash, image_hash):
+    return os.path.join(cache_dir, '%s_%s_%s_v%d.npz' % (
+        model_hash[:16], image_hash[:16], platform.machine(), CACHE_VERSION))
+
+
+def run_model(model_path, image_paths, cache_dir):
+    """Returns the outputs of a model for every image, using the cache.
+
+    The engine is only created if an image is missing from the cache.
+
+    Returns:
+      Dict of image path to (keypoints, keypoint_scores, pose_scores,
+      cached), keypoints in image coordinates.
+    """
+    model_hash = file_hash(model_path)
+    engine = None
+    outputs = {}
+    for image_path in image_paths:
+        cache_path = _cache_path(cache_dir, model_hash, file_hash(image_path)) if cache_dir else None
+        if cache_path and os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                outputs[image_path] = (cached['keypoints'], cached['keypoint_scores'],
+                                       cached['pose_scores'], True)
+            continue
+        if engine is None:
+            engine = PoseEngine(model_path)
+            _, input_height, input_width, _ = engine.get_input_tensor_shape()
+        image = Image.open(image_path).convert('RGB')
+        poses, _ = engine.DetectPosesInImage(image)
+        keypoints, keypoint_scores, pose_scores = poses_to_arrays(poses)
+        keypoints *= np.array([image.width / input_width, image.height / input_height],
+                              dtype=np.float32)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(cache_path, keypoints=keypoints, keypoint_scores=keypoint_scores,
+                     pose_scores=pose_scores)
+        outputs[image_path] = (keypoints, keypoint_scores, pose_scores, False)
+    return outputs
+
+
+def measure_latency(model_path, image_path, repeat=10):
+    """Returns the median run_inference time of a model on an image in ms.
+
+    The first inference, which loads the model onto the Edge TPU, is not
+    counted.
+    """
+    engine = PoseEngine(model_path)
+    _, input_height, input_width, _ = engine.get_input_tensor_shape()
+    image = Image.open(image_path).convert('RGB')
+    input_data = np.asarray(image.resize((input_width, input_height), Image.NEAREST)).flatten()
+    engine.run_inference(input_data)
+    return float(np.median([engine.run_inference(input_data) for _ in range(repeat)]))
+
+
+def measure_latencies(model_paths, image_path, repeat=10):
+    """Runs measure_latency for one model after another in a worker process.
+
+    Unlike the outputs, latency is measured with nothing else running.
+
+    Returns:
+      Dict of model path to latency in ms, NaN if the model failed.
+    """
+    context = multiprocessing.get_context('spawn')
+    latencies = {}
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+        for model_path in model_paths:
+            try:
+                latencies[model_path] = pool.submit(measure_latency, model_path, image_path,
+                                                    repeat).result()
+            except (OSError, ValueError, RuntimeError):
+                latencies[model_path] = float('nan')
+    return latencies
+
+
+def run_models(model_paths, image_paths, cache_dir, jobs=None):
+    """Runs run_model for every model in process pools.
+
+    CPU models share a pool of `jobs` processes, Edge TPU models run one at
+    a time in a pool of their own, concurrently with the CPU pool.
+
+    Returns:
+      Dict of model path to the outputs of run_model, or to the exception
+      if the model failed, e.g. an Edge TPU model without Edge TPU.
+    """
+    context = multiprocessing.get_context('spawn')
+    cpu_models = [m for m in model_paths if 'edgetpu' not in os.path.basename(m)]
+    edgetpu_models = [m for m in model_paths if 'edgetpu' in os.path.basename(m)]
+    futures = {}
+    with concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context) as cpu_pool, \
+            concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as edgetpu_pool:
+        for models, pool in ((cpu_models, cpu_pool), (edgetpu_models, edgetpu_pool)):
+            for model_path in models:
+                futures[model_path] = pool.submit(run_model, model_path, image_paths,
+                                                  cache_dir)
+        outputs = {}
+        for model_path, future in futures.items():
+            try:
+                outputs[model_path] = future.result()
+            except (OSError, ValueError, RuntimeError) as e:
+                outputs[model_path] = e
+        return outputs
+
+
+def evaluate(model_paths, image_paths, reference_model=None, cache_dir=None, jobs=None,
+             repeat=10, pose_threshold=0.5, threshold=0.2, pck_alpha=0.1):
+    """Runs and scores models over images.
+
+    Args:
+      model_paths: Models to evaluate.
+      image_paths: Images to evaluate on.
+      reference_model: Model whose confident poses are the ground truth for
+        images without labels file.
+      cache_dir: Directory for cached outputs, None to always run the models.
+      jobs: Number of CPU worker processes, one per core by default.
+      repeat: Inferences on the first image for the latency measurement,
+        0 to skip it.
+      pose_threshold: Detected (and reference) poses scoring below this are
+        ignored.
+      threshold: Keypoints scoring below this are missing.
+      pck_alpha: PCK distance threshold, relative to the bounding box size.
+
+    Returns:
+      Dict of model path to summarize() metrics plus 'latency_ms', NaN if
+      not measured, and 'cached', the number of images whose outputs came
+      from the cache, or
+      to {'error': message} for models that failed to run.
+
+    Raises:
+      ValueError: If an image has no labels file and there's no reference model.
+    """
+    labels = {path: load_labels(path) for path in image_paths}
+    for path, label in labels.items():
+        if label is None and not reference_model:
+            raise ValueError('{} has no labels and no reference model is given.'.format(path))
+    models = list(model_paths)
+    if reference_model and reference_model not in models:
+        models.append(reference_model)
+    outputs = run_models(models, image_paths, cache_dir, jobs)
+    if reference_model and isinstance(outputs[reference_model], Exception):
+        raise outputs[reference_model]
+    latencies = {}
+    if repeat and image_paths:
+        latencies = measure_latencies(
+            [m for m in model_paths if not isinstance(outputs[m], Exception)],
+            image_paths[0], repeat)
+
+    truth = {}
+    for path, label in labels.items():
+        if label is not None:
+            truth[path] = label
+        else:
+            keypoints, keypoint_scores, pose_scores, _ = outputs[reference_model][path]
+            confident = pose_scores >= pose_threshold
+            truth[path] = (keypoints[confident], keypoint_scores[confident] >= threshold)
+
+    report = {}
+    for model_path in model_paths:
+        if isinstance(outputs[model_path], Exception):
+            report[model_path] = {'error': str(outputs[model_path])}
+            continue
+        per_image = []
+        for path in image_paths:
+            keypoints, keypoint_scores, pose_scores, _ = outputs[model_path][path]
+            confident = pose_scores >= pose_threshold
+            per_image.append(evaluate_poses(keypoints[confident], keypoint_scores[confident],
+                                            *truth[path], threshold=threshold,
+                                            pck_alpha=pck_alpha))
+        metrics = summarize(per_image)
+        metrics['latency_ms'] = latencies.get(model_path, float('nan'))
+        metrics['cached'] = sum(o[3] for o in outputs[model_path].values())
+        report[model_path] = metrics
+    return report
+
+
+def regressions(report, baseline, tolerance=0.01):
+    """Returns messages for every metric that got worse than the baseline."""
+    messages = []
+    for model_path, metrics in report.items():
+        previous = baseline.get(model_path)
+        if not previous or 'error' in previous:
+            continue
+        if 'error' in metrics:
+            messages.append('%s: %s' % (os.path.basename(model_path), metrics['error']))
+            continue
+        for metric in ('oks', 'pck'):
+            if metrics[metric] < previous[metric] - tolerance:
+                messages.append('%s: %s dropped from %.3f to %.3f' % (
+                    os.path.basename(model_path), metric, previous[metric], metrics[metric]))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--models', nargs='*', help='Models to evaluate, all models '
+                        'under models/ except components by default.')
+    parser.add_argument('--images', default='test_data', help='Folder of images.')
+    parser.add_argument('--reference_model',
+                        default='models/mobilenet/posenet_mobilenet_v1_075_721_1281_quant_decoder.tflite',
+                        help='Ground truth for images without labels file.')
+    parser.add_argument('--cache_dir', default='.accuracy_cache',
+                        help='Cache of model outputs.')
+    parser.add_argument('--no_cache', action='store_true', help='Run every model again.')
+    parser.add_argument('--jobs', type=int, help='CPU worker processes.')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Inferences per model for the latency, 0 to skip it.')
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--baseline', help='Fail if worse than these earlier results.')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='Allowed OKS and PCK drop against the baseline.')
+    args = parser.parse_args()
+
+    models = args.models
+    if not models:
+        models = sorted(os.path.join(path, name) for path, _, names in os.walk('models')
+                        if 'component' not in path for name in names if name.endswith('.tflite'))
+    images = list_images(args.images)
+    start = time.monotonic()
+    report = evaluate(models, images, args.reference_model,
+                      None if args.no_cache else args.cache_dir, args.jobs, args.repeat)
+    print('%d models on %d images in %.1f s' % (len(models), len(images), time.monotonic() - start))
+    print('%-60s %8s %6s %6s %9s %7s' % ('model', 'ms', 'oks', 'pck', 'error px', 'cached'))
+    for model_path, metrics in report.items():
+        if 'error' in metrics:
+            print('%-60s failed: %s' % (os.path.basename(model_path), metrics['error']))
+            continue
+        print('%-60s %8.1f %6.3f %6.3f %9.2f %7d' % (
+            os.path.basename(model_path), metrics['latency_ms'], metrics['oks'], metrics['pck'],
+            metrics['mean_error_px'], metrics['cached']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            messages = regressions(report, json.load(f), args.tolerance)
+        for message in messages:
+            print('REGRESSION', message)
+        if messages:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
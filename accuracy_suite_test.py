@@ -0,0 +1,132 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import accuracy_suite
+import test_utils
+
+MODEL = os.path.join(test_utils.MODEL_DIR, 'mobilenet',
+                     'posenet_mobilenet_v1_075_353_481_quant_decoder.tflite')
+
+
+def make_pose(x, y, scale=100):
+    """Returns a [17, 2] pose with keypoints spread over scale pixels."""
+    rng = np.random.RandomState(0)
+    return (np.array([x, y]) + rng.uniform(0, scale, (17, 2))).astype(np.float32)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.truth = np.stack([make_pose(0, 0), make_pose(500, 0)])
+        self.visible = np.ones((2, 17), dtype=bool)
+
+    def test_perfect(self):
+        result = accuracy_suite.evaluate_poses(self.truth[::-1], np.ones((2, 17)),
+                                               self.truth, self.visible)
+        metrics = accuracy_suite.summarize([result])
+        self.assertAlmostEqual(metrics['oks'], 1.0, places=5)
+        self.assertEqual(metrics['pck'], 1.0)
+        self.assertEqual(metrics['mean_error_px'], 0.0)
+
+    def test_missed_person_and_keypoints(self):
+        scores = np.ones((1, 17))
+        scores[0, :5] = 0
+        result = accuracy_suite.evaluate_poses(self.truth[:1], scores, self.truth, self.visible)
+        metrics = accuracy_suite.summarize([result])
+        self.assertLess(metrics['oks'], 0.5)
+        self.assertAlmostEqual(metrics['pck'], 12 / 34)
+        self.assertTrue(np.isnan(metrics['error_px']['NOSE']))
+        self.assertEqual(metrics['error_px']['LEFT_ANKLE'], 0.0)
+
+    def test_shifted(self):
+        result = accuracy_suite.evaluate_poses(self.truth + [3, 4], np.ones((2, 17)),
+                                               self.truth, self.visible)
+        metrics = accuracy_suite.summarize([result])
+        self.assertAlmostEqual(metrics['mean_error_px'], 5.0, places=4)
+        self.assertEqual(metrics['pck'], 1.0)
+        self.assertLess(metrics['oks'], 1.0)
+
+    def test_one_to_one(self):
+        # Two detections of the same person: only one may count.
+        result = accuracy_suite.evaluate_poses(np.stack([self.truth[0]] * 2), np.ones((2, 17)),
+                                               self.truth, self.visible)
+        self.assertAlmostEqual(accuracy_suite.summarize([result])['oks'], 0.5, places=5)
+
+    def test_regressions(self):
+        baseline = {'m': {'oks': 0.8, 'pck': 0.9}}
+        self.assertEqual(accuracy_suite.regressions({'m': {'oks': 0.795, 'pck': 0.9}},
+                                                    baseline), [])
+        messages = accuracy_suite.regressions({'m': {'oks': 0.7, 'pck': 0.95}}, baseline)
+        self.assertEqual(len(messages), 1)
+        self.assertIn('oks', messages[0])
+
+
+class SuiteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.image = os.path.join(self.directory, 'couple.jpg')
+        shutil.copy(test_utils.TEST_IMAGE, self.image)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache(self):
+        first = accuracy_suite.run_model(MODEL, [self.image], self.cache_dir)
+        second = accuracy_suite.run_model(MODEL, [self.image], self.cache_dir)
+        self.assertFalse(first[self.image][3])
+        self.assertTrue(second[self.image][3])
+        for a, b in zip(first[self.image][:3], second[self.image][:3]):
+            np.testing.assert_array_equal(a, b)
+        # Keypoints are in image coordinates.
+        self.assertGreater(first[self.image][0][..., 0].max(), 481)
+
+    def test_evaluate_against_labels(self):
+        outputs = accuracy_suite.run_model(MODEL, [self.image], None)
+        keypoints, keypoint_scores, pose_scores, _ = outputs[self.image]
+        confident = pose_scores >= 0.5
+        with open(os.path.splitext(self.image)[0] + '.json', 'w') as f:
+            json.dump({'keypoints': keypoints[confident].tolist(),
+                       'visible': (keypoint_scores[confident] >= 0.2).tolist()}, f)
+        report = accuracy_suite.evaluate([MODEL], [self.image], cache_dir=self.cache_dir,
+                                         jobs=1)
+        self.assertAlmostEqual(report[MODEL]['oks'], 1.0, places=5)
+        self.assertEqual(report[MODEL]['pck'], 1.0)
+        self.assertGreater(report[MODEL]['latency_ms'], 0)
+        # Latency is measured again on every run, never taken from the cache.
+        with mock.patch.object(accuracy_suite, 'measure_latencies',
+                               return_value={MODEL: 1.5}) as measure:
+            report = accuracy_suite.evaluate([MODEL], [self.image], cache_dir=self.cache_dir,
+                                             jobs=1)
+        measure.assert_called_once()
+        self.assertEqual(report[MODEL]['cached'], 1)
+        self.assertEqual(report[MODEL]['latency_ms'], 1.5)
+
+    def test_missing_ground_truth(self):
+        with self.assertRaises(ValueError):
+            accuracy_suite.evaluate([MODEL], [self.image], cache_dir=self.cache_dir, jobs=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
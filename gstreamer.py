@@ -14,7 +14,10 @@
 
 from gi.repository import GLib, GObject, Gst, GstBase, GstVideo, Gtk
 import gi
+import metrics
 import numpy as np
+import pipeline_builder
+import pose_overlay
 import sys
 import threading
 import time
@@ -27,8 +30,32 @@ gi.require_version('Gtk', '3.0')
 
 Gst.init(None)
 
+INFERENCE_MS = metrics.REGISTRY.histogram(
+    'posenet_inference_callback_ms', 'Time spent in the inference callback.')
+RENDER_MS = metrics.REGISTRY.histogram(
+    'posenet_render_callback_ms', 'Time spent in the render callback.')
+FRAMES = metrics.REGISTRY.counter('posenet_frames_total', 'Frames received by the appsink.')
+SKIPPED = metrics.REGISTRY.counter(
+    'posenet_frames_skipped_total', 'Frames skipped by the load controller stride.')
+ENGINE_ERRORS = metrics.REGISTRY.counter(
+    'posenet_engine_errors_total', 'Inference callbacks that raised an exception.')
+STATIC = metrics.REGISTRY.counter(
+    'posenet_frames_static_total', 'Frames that reused the last poses, see scene_gate.py.')
+GATE_MS = metrics.REGISTRY.histogram(
+    'posenet_scene_gate_ms', 'Time spent checking a frame for changes.')
+OVERLAY_MS = metrics.REGISTRY.histogram(
+    'posenet_overlay_draw_ms', 'Time spent drawing poses into a frame by poseoverlay.')
+
+
+def dropped_counter(stage):
+    return metrics.REGISTRY.counter(
+        'posenet_frames_dropped_total', 'Frames dropped before inference or display.',
+        labels={'stage': stage})
+
 class GstPipeline:
-    def __init__(self, pipeline, inf_callback, render_callback, src_size):
+    def __init__(self, pipeline, inf_callback, render_callback, src_size,
+                 inference_size=None, controller=None, fallback_models=(), recorder=None,
+                 scene_gate=None):
         self.inf_callback = inf_callback
         self.render_callback = render_callback
         self.running = False
@@ -39,12 +66,42 @@ class GstPipeline:
         self.box = None
         self.condition = threading.Condition()
 
+        # Load shedding, see load_controller.py. Model 0 is the one passed as
+        # inf_callback and render_callback, fallback models are
+        # (inf_callback, render_callback, inference_size) tuples.
+        self.controller = controller
+        self.models = [(inf_callback, render_callback, inference_size)] + list(fallback_models)
+        self.model = 0
+        self.stride = 1
+        self.frames_seen = 0
+        self.output_model = 0
+        self.output_pts = Gst.CLOCK_TIME_NONE
+
+        # Frames without changes reuse the last output, see scene_gate.py.
+        self.scene_gate = scene_gate
+        self.last_output = None
+        self.last_output_model = None
+
         self.pipeline = Gst.parse_launch(pipeline)
+        self.rate = self.pipeline.get_by_name('rate')
         self.freezer = self.pipeline.get_by_name('freezer')
         self.overlay = self.pipeline.get_by_name('overlay')
         self.overlaysink = self.pipeline.get_by_name('overlaysink')
         appsink = self.pipeline.get_by_name('appsink')
         appsink.connect('new-sample', self.on_new_sample)
+        # Leaky queues signal overrun when full, right before dropping a buffer.
+        for name in ('overlay_queue', 'inference_queue'):
+            leaky_queue = self.pipeline.get_by_name(name)
+            if leaky_queue:
+                counter = dropped_counter(name)
+                leaky_queue.connect('overrun', lambda queue, counter=counter: counter.inc())
+        self.dropped = dropped_counter('inference_busy')
+
+        # Event-triggered recording, see recorder.py.
+        self.recorder = recorder
+        recsink = self.pipeline.get_by_name('recsink')
+        if recsink:
+            recsink.connect('new-sample', self.on_encoded_sample)
 
         # Set up a pipeline bus watch to catch errors.
         bus = self.pipeline.get_bus()
@@ -104,14 +161,27 @@ class GstPipeline:
 
     def on_new_sample(self, sink):
         sample = sink.emit('pull-sample')
-        if not self.sink_size:
-            s = sample.get_caps().get_structure(0)
-            self.sink_size = (s.get_value('width'), s.get_value('height'))
+        s = sample.get_caps().get_structure(0)
+        sink_size = (s.get_value('width'), s.get_value('height'))
+        if sink_size != self.sink_size:
+            # Inference size changes when the load controller switches models.
+            self.sink_size = sink_size
+            self.box = None
+        FRAMES.inc()
         with self.condition:
+            if self.gstbuffer:
+                # The inference thread didn't take the previous frame.
+                self.dropped.inc()
             self.gstbuffer = sample.get_buffer()
             self.condition.notify_all()
         return Gst.FlowReturn.OK
 
+    def on_encoded_sample(self, sink):
+        buffer = sink.emit('pull-sample').get_buffer()
+        keyframe = not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT)
+        self.recorder.add_frame(buffer.extract_dup(0, buffer.get_size()), keyframe)
+        return Gst.FlowReturn.OK
+
     def get_box(self):
         if not self.box:
             glbox = self.pipeline.get_by_name('glbox')
@@ -139,45 +209,89 @@ class GstPipeline:
                 gstbuffer = self.gstbuffer
                 self.gstbuffer = None
 
+            self.frames_seen += 1
+            if (self.frames_seen - 1) % self.stride:
+                SKIPPED.inc()
+                continue
+
             # Input tensor is expected to be tightly packed, that is,
             # width and stride in pixels are expected to be the same.
             # For the Coral devboard using GPU this will always be true,
             # but when using generic GStreamer CPU based elements the line
             # stride will always be a multiple of 4 bytes in RGB format.
-            # In case of mismatch we have to copy the input line by line.
-            # For best performance input tensor size should take this
-            # into account when using CPU based elements.
-            # TODO: Use padded posenet models to avoid this.
+            # In case of mismatch we have to repack the rows, which the
+            # pipeline builder reports at startup, see pipeline_builder.py.
             meta = GstVideo.buffer_get_video_meta(gstbuffer)
             assert meta and meta.n_planes == 1
+            model = self.model
+            inf_callback, _, inference_size = self.models[model]
+            if inference_size and (meta.width, meta.height) != tuple(inference_size):
+                # Frame still in flight from before a model switch.
+                continue
             bpp = 3 # bytes per pixel.
             buf_stride = meta.stride[0] # 0 for first and only plane.
             inf_stride = meta.width * bpp
 
+            if self.scene_gate and not self.gate(gstbuffer, meta, model):
+                continue
+
             if inf_stride == buf_stride:
                 # Fast case, pass buffer as input tensor as is.
                 input_tensor = gstbuffer
             else:
-                # Slow case, need to pack lines tightly (copy).
+                # Slow case, need to pack lines tightly, in one strided copy.
                 result, mapinfo = gstbuffer.map(Gst.MapFlags.READ)
                 assert result
-                data_view = memoryview(mapinfo.data)
-                input_tensor = bytearray(inf_stride * meta.height)
-                src_offset = dst_offset = 0
-                for row in range(meta.height):
-                    src_end = src_offset + inf_stride
-                    dst_end = dst_offset + inf_stride
-                    input_tensor[dst_offset : dst_end] = data_view[src_offset : src_end]
-                    src_offset += buf_stride
-                    dst_offset += inf_stride
-                input_tensor = bytes(input_tensor)
-                gstbuffer.unmap(mapinfo)
-
-            output = self.inf_callback(input_tensor)
+                try:
+                    rows = np.ndarray((meta.height, inf_stride), np.uint8, mapinfo.data,
+                                      offset=meta.offset[0], strides=(buf_stride, 1))
+                    input_tensor = np.ascontiguousarray(rows).reshape(-1)
+                finally:
+                    gstbuffer.unmap(mapinfo)
+
+            start = time.monotonic()
+            try:
+                output = inf_callback(input_tensor)
+            except Exception as e:
+                # Keep a long running pipeline going, count and skip the frame.
+                ENGINE_ERRORS.inc()
+                sys.stderr.write('Inference error: %s\n' % e)
+                continue
+            INFERENCE_MS.observe((time.monotonic() - start) * 1000)
+            self.last_output = output
+            self.last_output_model = model
             with self.condition:
                 self.output = output
+                self.output_model = model
+                self.output_pts = gstbuffer.pts
                 self.condition.notify_all()
 
+    def gate(self, gstbuffer, meta, model):
+        """Returns whether to infer a frame, or passes on the last output.
+
+        Render callbacks parse the output tensors of the engine, which still
+        hold the last inferred poses.
+        """
+        start = time.monotonic()
+        result, mapinfo = gstbuffer.map(Gst.MapFlags.READ)
+        assert result
+        try:
+            frame = np.ndarray((meta.height, meta.width, 3), np.uint8, mapinfo.data,
+                               offset=meta.offset[0], strides=(meta.stride[0], 3, 1))
+            infer = self.scene_gate.should_infer(frame)
+        finally:
+            gstbuffer.unmap(mapinfo)
+        GATE_MS.observe((time.monotonic() - start) * 1000)
+        if infer or self.last_output is None or self.last_output_model != model:
+            return True
+        STATIC.inc()
+        with self.condition:
+            self.output = self.last_output
+            self.output_model = model
+            self.output_pts = gstbuffer.pts
+            self.condition.notify_all()
+        return False
+
     def render_loop(self):
         while True:
             with self.condition:
@@ -186,14 +300,59 @@ class GstPipeline:
                 if not self.running:
                     break
                 output = self.output
+                model = self.output_model
+                pts = self.output_pts
                 self.output = None
 
-            svg, freeze = self.render_callback(output, self.src_size, self.get_box())
+            render_callback = self.models[model][1]
+            start = time.monotonic()
+            overlay, freeze = render_callback(output, self.src_size, self.get_box())
+            RENDER_MS.observe((time.monotonic() - start) * 1000)
             self.freezer.frozen = freeze
-            if self.overlaysink:
-                self.overlaysink.set_property('svg', svg)
-            elif self.overlay:
-                self.overlay.set_property('data', svg)
+            if isinstance(self.overlay, PoseOverlay):
+                if not isinstance(overlay, pose_overlay.Overlay):
+                    raise TypeError('poseoverlay needs render callbacks returning '
+                                    'pose_overlay.Overlay, use rsvgoverlay for SVG.')
+                self.overlay.overlay = overlay
+            else:
+                svg = overlay
+                if isinstance(overlay, pose_overlay.Overlay):
+                    svg = pose_overlay.to_svg(overlay, self.src_size)
+                if self.overlaysink:
+                    self.overlaysink.set_property('svg', svg)
+                elif self.overlay:
+                    self.overlay.set_property('data', svg)
+
+            if self.controller and pts != Gst.CLOCK_TIME_NONE:
+                latency_ms = (self.running_time() - pts) / Gst.MSECOND
+                level = self.controller.observe(latency_ms)
+                if level:
+                    self.apply_level(level)
+
+    def running_time(self):
+        clock = self.pipeline.get_clock()
+        if not clock:
+            return 0
+        return clock.get_time() - self.pipeline.get_base_time()
+
+    def apply_level(self, level):
+        """Applies a load_controller.Level to the running pipeline."""
+        self.stride = level.stride
+        if self.rate:
+            self.rate.set_property('max-rate', level.max_rate)
+        if level.model != self.model:
+            inference_size = self.models[level.model][2]
+            scale_caps, sink_caps = pipeline_caps(self.src_size, inference_size)
+            scalecaps = self.pipeline.get_by_name('scalecaps')
+            if scalecaps:
+                # The GL pipeline has no scalecaps, glbox follows sinkcaps.
+                scalecaps.set_property('caps', Gst.Caps.from_string(scale_caps))
+            self.pipeline.get_by_name('sinkcaps').set_property(
+                'caps', Gst.Caps.from_string(sink_caps))
+            self.model = level.model
+            if self.scene_gate:
+                # Thumbnails of the new inference size are not comparable.
+                self.scene_gate.reset()
 
     def setup_window(self):
         # Only set up our own window if we have Coral overlay sink in the pipeline.
@@ -276,6 +435,7 @@ def detectCoralDevBoard():
     return False
 
 class Freezer(GstBase.BaseTransform):
+    """Repeats one frame while frozen, passes frames through untouched otherwise."""
     __gstmetadata__ = ('<longname>', '<class>', '<description>', '<author>')
     __gsttemplates__ = (Gst.PadTemplate.new('sink',
                             Gst.PadDirection.SINK,
@@ -288,29 +448,104 @@ class Freezer(GstBase.BaseTransform):
                         )
     def __init__(self):
         self.buf = None
-        self.frozen = False
-        self.set_passthrough(False)
+        self._frozen = False
+        self.set_passthrough(True)
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    @frozen.setter
+    def frozen(self, frozen):
+        if frozen == self._frozen:
+            return
+        self._frozen = frozen
+        if not frozen:
+            self.buf = None
+        # In passthrough input buffers are pushed on as they are, with no
+        # output buffer and no transform.
+        self.set_passthrough(not frozen)
 
     def do_prepare_output_buffer(self, inbuf):
-        if self.frozen:
-            if not self.buf:
-                self.buf = inbuf
-            src_buf = self.buf
-        else:
-            src_buf = inbuf
-        buf = Gst.Buffer.new()
-        buf.copy_into(src_buf, Gst.BufferCopyFlags.FLAGS | Gst.BufferCopyFlags.TIMESTAMPS |
-            Gst.BufferCopyFlags.META | Gst.BufferCopyFlags.MEMORY, 0, inbuf.get_size())
+        if not self._frozen:
+            return GstBase.BaseTransform.do_prepare_output_buffer(self, inbuf)
+        if not self.buf:
+            # inbuf is only borrowed for this call, keep a buffer of our own.
+            # copy() is shallow, it references the frame's memory.
+            self.buf = inbuf.copy()
+        # A new buffer sharing the memory of the frozen frame, with the
+        # timestamps of this one. Downstream elements writing into it get a
+        # copy of the memory, the frozen frame stays as it is.
+        buf = self.buf.copy()
         buf.pts = inbuf.pts
-
+        buf.dts = inbuf.dts
+        buf.duration = inbuf.duration
         return (Gst.FlowReturn.OK, buf)
 
     def do_transform(self, inbuf, outbuf):
         return Gst.FlowReturn.OK
 
+class PoseOverlay(GstBase.BaseTransform):
+    """Draws the latest pose_overlay.Overlay into every frame, in place.
+
+    Replaces rsvgoverlay for render callbacks returning an Overlay: no SVG
+    is built, parsed or rasterized, only the pixels of the poses change.
+    """
+    __gstmetadata__ = ('Pose overlay', 'Filter/Effect/Video',
+                       'Draws poses into video frames in place', 'posenet')
+    _caps = Gst.Caps.from_string(
+        'video/x-raw,format={%s}' % ','.join(pose_overlay.CHANNELS))
+    __gsttemplates__ = (Gst.PadTemplate.new('sink',
+                            Gst.PadDirection.SINK,
+                            Gst.PadPresence.ALWAYS,
+                            _caps),
+                        Gst.PadTemplate.new('src',
+                            Gst.PadDirection.SRC,
+                            Gst.PadPresence.ALWAYS,
+                            _caps)
+                        )
+    def __init__(self):
+        # Set from the render thread, a single reference assignment.
+        self.overlay = None
+        self.drawer = None
+        self.info = None
+        self.set_in_place(True)
+
+    def do_set_caps(self, incaps, outcaps):
+        s = incaps.get_structure(0)
+        video_format = s.get_value('format')
+        self.info = (s.get_value('width'), s.get_value('height'), video_format)
+        self.drawer = pose_overlay.PoseDrawer(channels=pose_overlay.CHANNELS[video_format])
+        return True
+
+    def do_transform_ip(self, buf):
+        overlay = self.overlay
+        if not overlay or not self.drawer:
+            return Gst.FlowReturn.OK
+        start = time.monotonic()
+        width, height, video_format = self.info
+        meta = GstVideo.buffer_get_video_meta(buf)
+        bpp = len(video_format)  # RGB and BGR are 3 bytes, the others 4.
+        # Rows of packed RGB are padded to 4 bytes unless the meta says otherwise.
+        stride = meta.stride[0] if meta else (width * bpp + 3) & ~3
+        result, mapinfo = buf.map(Gst.MapFlags.READ | Gst.MapFlags.WRITE)
+        if not result:
+            return Gst.FlowReturn.ERROR
+        try:
+            frame = np.ndarray((height, width, bpp), np.uint8, mapinfo.data,
+                               offset=meta.offset[0] if meta else 0,
+                               strides=(stride, bpp, 1))
+            self.drawer.draw(frame, overlay)
+        finally:
+            buf.unmap(mapinfo)
+        OVERLAY_MS.observe((time.monotonic() - start) * 1000)
+        return Gst.FlowReturn.OK
+
 def register_elements(plugin):
     gtype = GObject.type_register(Freezer)
     Gst.Element.register(plugin, 'freezer', 0, gtype)
+    gtype = GObject.type_register(PoseOverlay)
+    Gst.Element.register(plugin, 'poseoverlay', 0, gtype)
     return True
 
 Gst.Plugin.register_static(
@@ -325,42 +560,46 @@ Gst.Plugin.register_static(
     ''                                  # origin
 )
 
+def pipeline_caps(src_size, inference_size):
+    """Returns (scale_caps, sink_caps) fitting src_size into inference_size."""
+    scale = pipeline_builder.scale_size(src_size, inference_size)
+    scale_caps = 'video/x-raw,width={width},height={height}'.format(
+        width=scale[0], height=scale[1])
+    sink_caps = 'video/x-raw,format=RGB,width={width},height={height}'.format(
+        width=inference_size[0], height=inference_size[1])
+    return scale_caps, sink_caps
+
 def run_pipeline(inf_callback, render_callback, src_size,
                  inference_size,
                  mirror=False,
                  h264=False,
                  jpeg=False,
-                 videosrc='/dev/video0'):
-    if h264:
-        SRC_CAPS = 'video/x-h264,width={width},height={height},framerate=30/1'
-    elif jpeg:
-        SRC_CAPS = 'image/jpeg,width={width},height={height},framerate=30/1'
-    else:
-        SRC_CAPS = 'video/x-raw,width={width},height={height},framerate=30/1'
-    PIPELINE = 'v4l2src device=%s ! {src_caps}' % videosrc
-
-    scale = min(inference_size[0] / src_size[0],
-                inference_size[1] / src_size[1])
-    scale = tuple(int(x * scale) for x in src_size)
-    scale_caps = 'video/x-raw,width={width},height={height}'.format(
-        width=scale[0], height=scale[1])
-    PIPELINE += """ ! decodebin ! videoflip video-direction={direction} ! tee name=t
-               t. ! {leaky_q} ! videoconvert ! freezer name=freezer ! rsvgoverlay name=overlay
-                  ! videoconvert ! autovideosink
-               t. ! {leaky_q} ! videoconvert ! videoscale ! {scale_caps} ! videobox name=box autocrop=true
-                  ! {sink_caps} ! {sink_element}
-            """
-
-    #TODO: Fix pipeline for the dev board.
-    SINK_ELEMENT = 'appsink name=appsink emit-signals=true max-buffers=1 drop=true'
-    SINK_CAPS = 'video/x-raw,format=RGB,width={width},height={height}'
-    LEAKY_Q = 'queue max-size-buffers=1 leaky=downstream'
-    direction = 'horiz' if mirror else 'identity'
-
-    src_caps = SRC_CAPS.format(width=src_size[0], height=src_size[1])
-    sink_caps = SINK_CAPS.format(width=inference_size[0], height=inference_size[1])
-    pipeline = PIPELINE.format(src_caps=src_caps, sink_caps=sink_caps,
-        sink_element=SINK_ELEMENT, direction=direction, leaky_q=LEAKY_Q, scale_caps=scale_caps)
+                 videosrc='/dev/video0',
+                 controller=None,
+                 fallback_models=(),
+                 recorder=None,
+                 overlay='svg',
+                 platform=None,
+                 scene_gate=None):
+    if platform is None:
+        platform = 'gl' if detectCoralDevBoard() else 'cpu'
+    builder = pipeline_builder.PipelineBuilder(src_size, inference_size, platform)
+    builder.add_source(videosrc, h264=h264, jpeg=jpeg, mirror=mirror,
+                       rate_control=bool(controller))
+    builder.add_display(overlay)
+    builder.add_inference()
+    if recorder:
+        builder.add_recorder()
+    pipeline = builder.build()
     print('Gstreamer pipeline: ', pipeline)
-    pipeline = GstPipeline(pipeline, inf_callback, render_callback, src_size)
+    for line in builder.report():
+        print(line)
+    if platform == 'cpu':
+        for _, _, size in fallback_models:
+            print('inference (fallback model): %s: %s' % builder.inference_path(size)[1:])
+    pipeline = GstPipeline(pipeline, inf_callback, render_callback, src_size, inference_size,
+                           controller=controller, fallback_models=fallback_models,
+                           recorder=recorder, scene_gate=scene_gate)
+    if controller:
+        pipeline.apply_level(controller.level)
     pipeline.run()
@@ -0,0 +1,422 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Parallel decoding and prefetching for offline jobs over many images.
+
+Run serially, as DetectPosesInImage is used in test_utils.py, most of the
+time goes to decoding and resizing each image while the Edge TPU waits.
+Here worker processes decode and resize the next images while the engine
+runs on the current one:
+
+  * JPEGs larger than the model input are decoded in draft mode, which
+    lets libjpeg scale by 1/2, 1/4 or 1/8 while decoding, so a 1920x1080
+    photo for a 641x481 model costs about a quarter of a full decode.
+  * Workers write the pixels straight into one of `depth` preallocated
+    input buffers in shared memory; a slot is only handed out again once
+    the engine is done with it, which bounds memory and the work queued
+    ahead.
+  * Workers are started by a forkserver, not forked from the caller, so
+    an engine that already runs libedgetpu and TFLite threads can be
+    created before the Prefetcher.
+  * Poses are collected by a ResultWriter and written in bulk, one .npz
+    file per chunk of images, by a background thread.
+
+    engine = PoseEngine(model)
+    with ResultWriter('/tmp/poses') as writer:
+        run(engine, image_paths, writer, workers=4)
+
+Images are stretched to the model input like DetectPosesInImage does, and
+keypoints are scaled back to image coordinates. main() compares images per
+second with the serial path.
+"""
+
+import argparse
+import collections
+import glob
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+import model_profiles
+from pose_engine import PoseEngine, poses_to_arrays
+
+Decoded = collections.namedtuple('Decoded', ['path', 'image_size', 'pixels', 'error'])
+Decoded.__doc__ = """One image ready for inference.
+
+  path: Image path.
+  image_size: (width, height) of the image as stored.
+  pixels: Flat uint8 RGB input tensor of the model input size, a view of a
+    shared buffer that is only valid until the next image is requested.
+    None if the image could not be decoded.
+  error: Why the image could not be decoded, or None.
+"""
+
+IngestStats = collections.namedtuple('IngestStats', ['images', 'errors', 'seconds',
+                                                     'inference_s', 'wait_s'])
+IngestStats.__doc__ = """Totals of a run.
+
+  images: Images inferred.
+  errors: Images that could not be decoded.
+  seconds: Wall time.
+  inference_s: Time spent in run_inference and ParseOutput.
+  wait_s: Time the engine waited for decoded images; near zero when the
+    workers keep up.
+"""
+
+
+def load_image(path, input_size, draft=True):
+    """Decodes an image stretched to input_size.
+
+    Args:
+      path: Image file.
+      input_size: (width, height) of the model input.
+      draft: Whether to let JPEGs decode at a reduced scale that is still at
+        least input_size.
+
+    Returns:
+      (pixels, image_size): uint8 array [height, width, 3] and the (width,
+      height) of the image as stored.
+    """
+    with Image.open(path) as image:
+        image_size = image.size
+        if draft and image.format == 'JPEG':
+            image.draft('RGB', tuple(input_size))
+        image = image.convert('RGB')
+        if image.size != tuple(input_size):
+            image = image.resize(tuple(input_size), Image.NEAREST)
+        return np.asarray(image), image_size
+
+
+# State of a worker process, set by _init_worker.
+_worker = {}
+
+
+def _init_worker(name, shape, draft):
+    # The worker holds the block for its whole life, the parent unlinks it.
+    _worker['memory'] = shared_memory.SharedMemory(name)
+    _worker['slots'] = np.ndarray(shape, np.uint8, _worker['memory'].buf)
+    _worker['draft'] = draft
+
+
+def _decode(sequence, slot, path):
+    slots = _worker['slots']
+    height, width, _ = slots.shape[1:]
+    try:
+        pixels, image_size = load_image(path, (width, height), _worker['draft'])
+    except Exception as e:
+        # Broken files raise OSError, ValueError or SyntaxError, oversized
+        # ones DecompressionBombError; none of them should stop the job.
+        return sequence, slot, path, None, '%s: %s' % (type(e).__name__, e)
+    slots[slot] = pixels
+    return sequence, slot, path, image_size, None
+
+
+class Prefetcher:
+    """Decodes images in worker processes into a ring of shared buffers.
+
+    Iterating yields a Decoded per path, in order. Up to depth images are
+    decoded ahead of the one the caller holds.
+    """
+
+    def __init__(self, paths, input_size, workers=None, depth=None, draft=True):
+        """Starts the worker processes.
+
+        Args:
+          paths: Image paths, any iterable.
+          input_size: (width, height) of the model input.
+          workers: Number of decoding processes, os.cpu_count() if None.
+          depth: Number of input buffers, twice the workers if None.
+          draft: Whether JPEGs may decode at a reduced scale.
+        """
+        workers = workers or os.cpu_count()
+        self.depth = depth or 2 * workers
+        width, height = int(input_size[0]), int(input_size[1])
+        self._paths = iter(paths)
+        # Forking a process that runs libedgetpu or TFLite threads can
+        # deadlock the child, so workers come from a forkserver and attach
+        # to a named shared memory block.
+        self._memory = shared_memory.SharedMemory(create=True,
+                                                  size=self.depth * height * width * 3)
+        self._slots = np.ndarray((self.depth, height * width * 3), np.uint8, self._memory.buf)
+        context = multiprocessing.get_context('forkserver')
+        self._pool = context.Pool(workers, _init_worker,
+                                  (self._memory.name, (self.depth, height, width, 3), draft))
+        self._done = queue.Queue()
+        self._free = list(range(self.depth))
+        self._submitted = 0
+
+    def _submit(self):
+        path = next(self._paths, None)
+        if path is None:
+            return
+        self._pool.apply_async(_decode, (self._submitted, self._free.pop(), path),
+                               callback=self._done.put, error_callback=self._done.put)
+        self._submitted += 1
+
+    def __iter__(self):
+        for _ in range(self.depth):
+            self._submit()
+        ready = {}
+        sequence = 0
+        while sequence < self._submitted:
+            while sequence not in ready:
+                result = self._done.get()
+                if isinstance(result, BaseException):
+                    raise result
+                ready[result[0]] = result
+            _, slot, path, image_size, error = ready.pop(sequence)
+            sequence += 1
+            yield Decoded(path, image_size, None if error else self._slots[slot], error)
+            # The caller is done with the slot.
+            self._free.append(slot)
+            self._submit()
+
+    def close(self):
+        """Stops the workers and frees the shared buffers."""
+        self._pool.terminate()
+        self._pool.join()
+        self._slots = None
+        self._memory.unlink()
+        try:
+            self._memory.close()
+        except BufferError:
+            # The caller still holds a Decoded; the mapping goes with it.
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultWriter:
+    """Collects poses and writes them in chunks from a background thread.
+
+    Every chunk is a file results_<n>.npz of concatenated arrays: paths
+    [N], image_sizes [N, 2], offsets [N + 1] indexing the poses of every
+    image, keypoints [P, 17, 2] in image coordinates, keypoint_scores
+    [P, 17] and pose_scores [P]. read_results reads them back.
+    """
+
+    def __init__(self, directory, chunk=1000):
+        self.directory = directory
+        self.chunk = chunk
+        self.chunks = 0
+        self.errors = []
+        self._rows = []
+        self._queue = queue.Queue(maxsize=2)
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def add(self, path, image_size, keypoints, keypoint_scores, pose_scores):
+        """Adds the poses of one image."""
+        self._rows.append((path, image_size, keypoints, keypoint_scores, pose_scores))
+        if len(self._rows) >= self.chunk:
+            self.flush()
+
+    def add_error(self, path, error):
+        """Records an image that could not be processed."""
+        self.errors.append((path, error))
+
+    def flush(self):
+        """Queues the collected rows for writing."""
+        if self._rows:
+            self._queue.put((self.chunks, self._rows))
+            self.chunks += 1
+            self._rows = []
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            index, rows = item
+            paths, sizes, keypoints, keypoint_scores, pose_scores = zip(*rows)
+            counts = [len(scores) for scores in pose_scores]
+            np.savez(os.path.join(self.directory, 'results_%05d.npz' % index),
+                     paths=np.array(paths), image_sizes=np.array(sizes, dtype=np.int32),
+                     offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                     keypoints=np.concatenate(keypoints).reshape(-1, 17, 2),
+                     keypoint_scores=np.concatenate(keypoint_scores).reshape(-1, 17),
+                     pose_scores=np.concatenate(pose_scores))
+
+    def close(self):
+        """Writes the remaining rows and the list of errors, then waits."""
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        if self.errors:
+            with open(os.path.join(self.directory, 'errors.tsv'), 'w') as f:
+                for path, error in self.errors:
+                    f.write('%s\t%s\n' % (path, error))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_results(directory):
+    """Yields (path, keypoints, keypoint_scores, pose_scores) written by ResultWriter."""
+    for name in sorted(glob.glob(os.path.join(directory, 'results_*.npz'))):
+        with np.load(name) as chunk:
+            offsets = chunk['offsets']
+            keypoints = chunk['keypoints']
+            keypoint_scores = chunk['keypoint_scores']
+            pose_scores = chunk['pose_scores']
+            for i, path in enumerate(chunk['paths']):
+                poses = slice(offsets[i], offsets[i + 1])
+                yield str(path), keypoints[poses], keypoint_scores[poses], pose_scores[poses]
+
+
+def run(engine, paths, writer, workers=None, depth=None, draft=True):
+    """Runs an engine on images decoded by a Prefetcher.
+
+    The engine stays in the calling process. It may be created before
+    run, the workers are started by a forkserver and never inherit its
+    Edge TPU or TFLite threads.
+
+    Returns:
+      IngestStats.
+    """
+    _, height, width, _ = engine.get_input_tensor_shape()
+    images = errors = 0
+    inference_s = wait_s = 0.0
+    start = time.monotonic()
+    with Prefetcher(paths, (width, height), workers, depth, draft) as prefetcher:
+        ready = time.monotonic()
+        for decoded in prefetcher:
+            inferring = time.monotonic()
+            wait_s += inferring - ready
+            if decoded.error:
+                writer.add_error(decoded.path, decoded.error)
+                errors += 1
+                ready = time.monotonic()
+                continue
+            engine.run_inference(decoded.pixels)
+            keypoints, keypoint_scores, pose_scores = poses_to_arrays(engine.ParseOutput()[0])
+            keypoints *= np.array([decoded.image_size[0] / width,
+                                   decoded.image_size[1] / height], dtype=np.float32)
+            writer.add(decoded.path, decoded.image_size, keypoints, keypoint_scores, pose_scores)
+            images += 1
+            ready = time.monotonic()
+            inference_s += ready - inferring
+    return IngestStats(images, errors, time.monotonic() - start, inference_s, wait_s)
+
+
+def run_serial(engine, paths, writer):
+    """Runs an engine on images decoded one by one, as a baseline."""
+    _, height, width, _ = engine.get_input_tensor_shape()
+    images = errors = 0
+    inference_s = 0.0
+    start = time.monotonic()
+    for path in paths:
+        try:
+            image = Image.open(path).convert('RGB')
+        except Exception as e:  # As in _decode.
+            writer.add_error(path, '%s: %s' % (type(e).__name__, e))
+            errors += 1
+            continue
+        # As DetectPosesInImage does, timing inference separately.
+        input_data = np.asarray(image.resize((width, height), Image.NEAREST)).reshape(-1)
+        inferring = time.monotonic()
+        engine.run_inference(input_data)
+        keypoints, keypoint_scores, pose_scores = poses_to_arrays(engine.ParseOutput()[0])
+        inference_s += time.monotonic() - inferring
+        keypoints *= np.array([image.width / width, image.height / height], dtype=np.float32)
+        writer.add(path, image.size, keypoints, keypoint_scores, pose_scores)
+        images += 1
+    elapsed = time.monotonic() - start
+    # Decoding is not overlapped with anything, all of it is waiting.
+    return IngestStats(images, errors, elapsed, inference_s, elapsed - inference_s)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--images', default='test_data/*.jpg',
+                        help='Glob of the images, or a file with one path per line.')
+    parser.add_argument('--repeat', type=int, default=100,
+                        help='Times the image list is repeated, to measure on few images.')
+    parser.add_argument('--model', help='.tflite model path, defaults to the 641x481 '
+                        'Edge TPU model.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--depth', type=int, help='Input buffers, twice the workers by default.')
+    parser.add_argument('--no_draft', action='store_true',
+                        help='Decode JPEGs at full size before resizing.')
+    parser.add_argument('--output', default='/tmp/posenet_ingest')
+    parser.add_argument('--skip_serial', action='store_true',
+                        help='Only run the parallel path.')
+    parser.add_argument('--decode_only', metavar='WIDTHxHEIGHT',
+                        help='Only measure decoding for this input size, without a model, '
+                        'as if inference took no time.')
+    args = parser.parse_args()
+
+    if os.path.isfile(args.images):
+        with open(args.images) as f:
+            paths = [line.strip() for line in f if line.strip()]
+    else:
+        paths = sorted(glob.glob(args.images))
+    if not paths:
+        raise SystemExit('No images match %s.' % args.images)
+    paths *= args.repeat
+    if args.decode_only:
+        input_size = tuple(int(x) for x in args.decode_only.split('x'))
+        start = time.monotonic()
+        if not args.skip_serial:
+            for path in paths:
+                Image.open(path).convert('RGB').resize(input_size, Image.NEAREST)
+            serial_s = time.monotonic() - start
+            start = time.monotonic()
+        with Prefetcher(paths, input_size, args.workers, args.depth,
+                        not args.no_draft) as prefetcher:
+            for _ in prefetcher:
+                pass
+        parallel_s = time.monotonic() - start
+        print('%d images decoded to %dx%d, %d workers' % ((len(paths),) + input_size +
+                                                           (args.workers,)))
+        if not args.skip_serial:
+            print('serial: %.1f images/s' % (len(paths) / serial_s))
+        print('parallel: %.1f images/s' % (len(paths) / parallel_s))
+        return
+
+    model = args.model or model_profiles.closest_profile((640, 480)).model_path
+    engine = PoseEngine(model)
+
+    results = []
+    if not args.skip_serial:
+        with ResultWriter(os.path.join(args.output, 'serial')) as writer:
+            results.append(('serial', run_serial(engine, paths, writer)))
+    with ResultWriter(os.path.join(args.output, 'parallel')) as writer:
+        results.append(('parallel', run(engine, paths, writer, args.workers, args.depth,
+                                        not args.no_draft)))
+    print('%d images, %s, %d workers' % (len(paths), model, args.workers))
+    print('%-10s %10s %10s %12s %10s' % ('path', 'images/s', 'errors', 'inference s',
+                                         'wait s'))
+    for name, stats in results:
+        print('%-10s %10.1f %10d %12.2f %10.2f' % (
+            name, stats.images / stats.seconds, stats.errors, stats.inference_s, stats.wait_s))
+    if len(results) == 2:
+        print('Speedup: %.2fx' % (results[0][1].seconds / results[1][1].seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+import image_ingest
+from pose_engine import KeypointType, Keypoint, Point, Pose
+
+INPUT_SIZE = (65, 49)
+
+
+class MeanColorEngine:
+    """Stands in for a PoseEngine, one pose with the mean input color as score."""
+
+    def __init__(self):
+        self.inputs = []
+
+    def get_input_tensor_shape(self):
+        return np.array([1, INPUT_SIZE[1], INPUT_SIZE[0], 3])
+
+    def run_inference(self, input_data):
+        self.inputs.append(np.array(input_data))
+        return 1.0
+
+    def ParseOutput(self):
+        score = float(self.inputs[-1].mean()) / 255
+        keypoints = {k: Keypoint(Point(INPUT_SIZE[0], INPUT_SIZE[1]), score) for k in KeypointType}
+        return [Pose(keypoints, score)], 0.001
+
+
+class ImageIngestTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.paths = []
+        for i in range(7):
+            image = Image.new('RGB', (640, 480), (i * 30, 100, 200))
+            path = os.path.join(cls.directory, 'image_%d.jpg' % i)
+            image.save(path, quality=95)
+            cls.paths.append(path)
+        png = os.path.join(cls.directory, 'small.png')
+        Image.new('RGB', (32, 24), (10, 20, 30)).save(png)
+        cls.paths.append(png)
+        cls.broken = os.path.join(cls.directory, 'broken.jpg')
+        with open(cls.broken, 'wb') as f:
+            f.write(b'not a jpeg')
+        # A PNG header claiming 20000x10000 pixels, which PIL refuses to open
+        # with DecompressionBombError rather than OSError.
+        cls.bomb = os.path.join(cls.directory, 'bomb.png')
+        with open(cls.bomb, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+            for kind, data in ((b'IHDR', struct.pack('>IIBBBBB', 20000, 10000, 8, 2, 0, 0, 0)),
+                               (b'IDAT', zlib.compress(b'')), (b'IEND', b'')):
+                f.write(struct.pack('>I', len(data)) + kind + data +
+                        struct.pack('>I', zlib.crc32(kind + data)))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_load_image(self):
+        pixels, image_size = image_ingest.load_image(self.paths[1], INPUT_SIZE)
+        self.assertEqual(pixels.shape, (49, 65, 3))
+        self.assertEqual(image_size, (640, 480))
+        full, _ = image_ingest.load_image(self.paths[1], INPUT_SIZE, draft=False)
+        # A flat color decodes the same at any scale, up to JPEG rounding.
+        np.testing.assert_allclose(pixels, full, atol=3)
+        pixels, image_size = image_ingest.load_image(self.paths[-1], INPUT_SIZE)
+        self.assertEqual((pixels.shape, image_size), ((49, 65, 3), (32, 24)))
+
+    def test_prefetcher_order_and_contents(self):
+        paths = self.paths * 3
+        with image_ingest.Prefetcher(paths, INPUT_SIZE, workers=2, depth=3) as prefetcher:
+            decoded = [(d.path, d.image_size, d.pixels.copy()) for d in prefetcher]
+        self.assertEqual([d[0] for d in decoded], paths)
+        for path, image_size, pixels in decoded:
+            expected, expected_size = image_ingest.load_image(path, INPUT_SIZE)
+            self.assertEqual(image_size, expected_size)
+            np.testing.assert_array_equal(pixels, expected.reshape(-1))
+
+    def test_broken_image(self):
+        paths = [self.paths[0], self.broken, self.bomb, self.paths[1]]
+        with image_ingest.Prefetcher(paths, INPUT_SIZE, workers=1) as prefetcher:
+            decoded = list(prefetcher)
+        self.assertEqual([d.error is None for d in decoded], [True, False, False, True])
+        self.assertIsNone(decoded[1].pixels)
+        self.assertTrue(decoded[2].error.startswith('DecompressionBombError'), decoded[2].error)
+
+    def test_close_unlinks_shared_memory(self):
+        prefetcher = image_ingest.Prefetcher(self.paths[:2], INPUT_SIZE, workers=1)
+        name = prefetcher._memory.name
+        with prefetcher:
+            # Still holding a slot after closing must not fail.
+            held = next(iter(prefetcher))
+        self.assertIsNone(held.error)
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name)
+
+    def test_run_and_read_results(self):
+        paths = self.paths + [self.broken, self.bomb]
+        output = os.path.join(self.directory, 'results')
+        engine = MeanColorEngine()
+        with image_ingest.ResultWriter(output, chunk=3) as writer:
+            stats = image_ingest.run(engine, paths, writer, workers=2)
+        self.assertEqual((stats.images, stats.errors), (8, 2))
+        self.assertEqual(len(os.listdir(output)), 3 + 1)  # Chunks and errors.tsv.
+        results = list(image_ingest.read_results(output))
+        self.assertEqual([r[0] for r in results], self.paths)
+        for (path, keypoints, keypoint_scores, pose_scores), expected in zip(results,
+                                                                               engine.inputs):
+            self.assertEqual(keypoints.shape, (1, 17, 2))
+            self.assertAlmostEqual(pose_scores[0], expected.mean() / 255, places=5)
+        # Keypoints at the bottom right corner of the input, in image coordinates.
+        np.testing.assert_allclose(results[0][1][0, 0], (640, 480))
+        np.testing.assert_allclose(results[-1][1][0, 0], (32, 24))
+
+        serial_output = os.path.join(self.directory, 'serial')
+        serial_engine = MeanColorEngine()
+        with image_ingest.ResultWriter(serial_output) as writer:
+            stats = image_ingest.run_serial(serial_engine, paths, writer)
+        self.assertEqual((stats.images, stats.errors), (8, 2))
+        serial = list(image_ingest.read_results(serial_output))
+        for parallel_result, serial_result in zip(results, serial):
+            np.testing.assert_allclose(parallel_result[3], serial_result[3], atol=0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+import keypoint_crops
+from pose_engine import KeypointType
+
+
+def gradient_frame(width=320, height=240):
+    """Frame whose red channel is x and green channel is y."""
+    ys, xs = np.mgrid[0:height, 0:width]
+    return np.stack([xs % 256, ys % 256, np.full_like(xs, 128)], axis=2).astype(np.uint8)
+
+
+class KeypointCropsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.keypoints, self.scores = keypoint_crops.random_people(
+            3, (320, 240), np.random.RandomState(1))
+
+    def test_frame_from_buffer(self):
+        frame = gradient_frame(10, 4)
+        padded = np.zeros((4, 32), dtype=np.uint8)
+        padded[:, :30] = frame.reshape(4, 30)
+        view = keypoint_crops.frame_from_buffer(padded.tobytes(), 10, 4, stride=32)
+        np.testing.assert_array_equal(view, frame)
+
+    def test_face_box(self):
+        centers, sizes, angles, valid = keypoint_crops.region_boxes(
+            self.keypoints, self.scores, 'face')
+        self.assertTrue(valid.all())
+        np.testing.assert_allclose(angles, 0, atol=1e-6)
+        face = list(keypoint_crops.REGIONS['face'].keypoints)
+        np.testing.assert_allclose(centers, self.keypoints[:, face].mean(axis=1), rtol=1e-5)
+
+        scores = self.scores.copy()
+        scores[0, [KeypointType.NOSE, KeypointType.LEFT_EYE, KeypointType.RIGHT_EYE]] = 0
+        _, _, _, valid = keypoint_crops.region_boxes(self.keypoints, scores, 'face')
+        self.assertEqual(valid.tolist(), [False, True, True])
+
+    def test_hand_box(self):
+        keypoints = np.zeros((1, 17, 2), dtype=np.float32)
+        keypoints[0, KeypointType.LEFT_ELBOW] = (100, 100)
+        keypoints[0, KeypointType.LEFT_WRIST] = (140, 100)
+        centers, sizes, angles, valid = keypoint_crops.region_boxes(
+            keypoints, np.ones((1, 17)), 'left_hand')
+        np.testing.assert_allclose(centers[0], (154, 100))
+        np.testing.assert_allclose(sizes[0], 36)
+        # The forearm points right, so the crop is turned a quarter.
+        np.testing.assert_allclose(angles[0], np.pi / 2, rtol=1e-6)
+
+    def test_extract_matches_unaligned_crop(self):
+        frame = gradient_frame()
+        extractor = keypoint_crops.CropExtractor(('torso',), size=(16, 16), align=False)
+        crops, owners = extractor.extract(frame, self.keypoints, self.scores)
+        self.assertEqual(owners, [(0, 'torso'), (1, 'torso'), (2, 'torso')])
+        centers, sizes, _, _ = extractor.boxes(self.keypoints, self.scores)
+        for crop, (x, y), side in zip(crops, centers, sizes):
+            inside = crop[..., 2] == 128
+            self.assertTrue(inside.any())
+            # Red grows left to right, green top to bottom, around the center.
+            xs = crop[..., 0][inside].astype(float)
+            self.assertLessEqual(abs(np.median(xs) - x), side / 8 + 1)
+            self.assertTrue((np.diff(crop[8, :, 0].astype(int))[inside[8, 1:]] >= 0).all())
+
+    def test_upright_gather_matches_general_gather(self):
+        keypoints, scores = keypoint_crops.random_people(6, (320, 240), np.random.RandomState(3))
+        keypoints[:3] -= 60  # Partly outside the frame.
+        extractor = keypoint_crops.CropExtractor(('face', 'torso'), size=(12, 8), align=False)
+        for frame in (gradient_frame(), gradient_frame()[:, ::2]):
+            crops, _ = extractor.extract(frame, keypoints, scores)
+            self.assertFalse(crops.all())
+            centers, sizes, _, _ = extractor.boxes(keypoints, scores)
+            xs = centers[:, 0, np.newaxis] + sizes[:, np.newaxis] * extractor._ox
+            ys = centers[:, 1, np.newaxis] + sizes[:, np.newaxis] * extractor._oy
+            expected = np.empty_like(crops)
+            extractor._gather(frame, xs[:, np.newaxis, :], ys[:, :, np.newaxis], expected)
+            np.testing.assert_array_equal(crops, expected)
+
+    def test_aligned_rotation(self):
+        frame = gradient_frame()
+        keypoints = np.zeros((1, 17, 2), dtype=np.float32)
+        keypoints[0, KeypointType.RIGHT_ELBOW] = (160, 120)
+        keypoints[0, KeypointType.RIGHT_WRIST] = (160, 160)  # Forearm points down.
+        extractor = keypoint_crops.CropExtractor(('right_hand',), size=(8, 8))
+        crops, _ = extractor.extract(frame, keypoints, np.ones((1, 17)))
+        # Turned upside down: green (y) decreases going down the crop.
+        self.assertTrue((np.diff(crops[0, :, 4, 1].astype(int)) < 0).all())
+        bilinear = keypoint_crops.CropExtractor(('right_hand',), size=(8, 8),
+                                                interpolation='bilinear')
+        smooth, _ = bilinear.extract(frame, keypoints, np.ones((1, 17)))
+        self.assertLessEqual(np.abs(smooth.astype(int) - crops.astype(int)).max(), 3)
+
+    def test_capacity_and_outside(self):
+        keypoints, scores = keypoint_crops.random_people(20, (320, 240), np.random.RandomState(2))
+        extractor = keypoint_crops.CropExtractor(('face', 'torso'), size=(8, 8), max_crops=10,
+                                                 min_size=0)
+        frame = gradient_frame()
+        crops, owners = extractor.extract(frame, keypoints + 1000, scores)
+        self.assertEqual(crops.shape, (10, 8, 8, 3))
+        self.assertEqual(owners[:2], [(0, 'face'), (0, 'torso')])
+        self.assertFalse(crops.any())
+        empty, owners = extractor.extract(frame, np.zeros((0, 17, 2)), np.zeros((0, 17)))
+        self.assertEqual((len(empty), owners), (0, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
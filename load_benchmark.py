@@ -0,0 +1,112 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Load test of the stages downstream of the pose engine.
+
+Drives the pose_camera callbacks, and the tracking, drawing and synthesizer
+stages of the other examples, with a synthetic_engine.SyntheticPoseEngine,
+and reports the time per frame of every stage as the number of people
+grows. No camera, model or Edge TPU needed:
+
+    python3 load_benchmark.py --people 1,10,100
+
+Stages, each timed on its own on the same frames:
+
+  render_overlay: The pose_camera render callback, which includes parse
+    and arrays below.
+  parse: ParseOutput, building a Pose per person.
+  arrays: poses_to_arrays.
+  draw: pose_overlay.PoseDrawer drawing the overlay into the frame.
+  to_svg: The SVG document rsvgoverlay gets instead.
+  draw_pose: pose_camera.draw_pose of every pose into an svgwrite drawing,
+    as the synthesizer and anonymizer examples do.
+  tracker: pose_tracker.PoseTracker.update.
+  notes: synthesizer.wrist_notes.
+"""
+
+import argparse
+import collections
+import time
+
+import numpy as np
+import svgwrite
+
+import pipeline_builder
+import pose_camera
+import pose_overlay
+from pose_engine import ParsedOutput, poses_to_arrays
+from pose_tracker import PoseTracker
+from synthesizer import wrist_notes
+from synthetic_engine import SyntheticPoseEngine
+
+STAGES = ('render_overlay', 'parse', 'arrays', 'draw', 'to_svg', 'draw_pose', 'tracker',
+          'notes')
+
+
+def run(people, frames=100, src_size=(640, 480), input_size=(641, 481), seed=0):
+    """Runs every stage on frames of a simulation.
+
+    Returns:
+      Dict of stage name to the mean time per frame in ms.
+    """
+    engine = SyntheticPoseEngine(input_size, people=people, inference_ms=10, seed=seed)
+    inference_box = (0, 0) + pipeline_builder.scale_size(src_size, input_size)
+    run_inference, render_overlay = pose_camera.make_callbacks()
+    drawer = pose_overlay.PoseDrawer()
+    tracker = PoseTracker()
+    frame = np.zeros((src_size[1], src_size[0], 3), dtype=np.uint8)
+    times = collections.defaultdict(float)
+
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        times[stage] += time.perf_counter() - start
+        return result
+
+    for _ in range(frames):
+        output = run_inference(engine, None)
+        overlay, _ = timed('render_overlay', render_overlay, ParsedOutput(engine), output,
+                           src_size, inference_box)
+        poses, _ = timed('parse', engine.ParseOutput)
+        keypoints, keypoint_scores, _ = timed('arrays', poses_to_arrays, poses)
+        timed('draw', drawer.draw, frame, overlay)
+        timed('to_svg', pose_overlay.to_svg, overlay, src_size)
+
+        def draw_poses():
+            drawing = svgwrite.Drawing('', size=src_size)
+            for pose in poses:
+                pose_camera.draw_pose(drawing, pose, src_size, inference_box)
+            return drawing.tostring()
+        timed('draw_pose', draw_poses)
+        track_ids = timed('tracker', tracker.update, keypoints, keypoint_scores)
+        timed('notes', wrist_notes, keypoints, keypoint_scores, track_ids, inference_box)
+    return {stage: times[stage] * 1000 / frames for stage in STAGES}
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--people', default='1,5,10,20,50,100',
+                        help='Comma separated numbers of people.')
+    parser.add_argument('--frames', type=int, default=100, help='Frames per number of people.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('Mean ms per frame; render_overlay includes parse and arrays.')
+    print('%6s' % 'people' + ''.join('%15s' % stage for stage in STAGES))
+    for people in (int(p) for p in args.people.split(',')):
+        result = run(people, args.frames, seed=args.seed)
+        print('%6d' % people + ''.join('%15.3f' % result[stage] for stage in STAGES))
+
+
+if __name__ == '__main__':
+    main()
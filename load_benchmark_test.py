@@ -0,0 +1,29 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import load_benchmark
+
+
+class LoadBenchmarkTest(unittest.TestCase):
+
+    def test_run_without_gstreamer(self):
+        result = load_benchmark.run(people=2, frames=2)
+        self.assertEqual(sorted(result), sorted(load_benchmark.STAGES))
+        self.assertTrue(all(ms >= 0 for ms in result.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Adaptive frame rate and load shedding for the camera pipeline.
+
+The controller walks a ladder of levels, from best quality to cheapest. Every
+level sets three knobs, which gstreamer.GstPipeline applies:
+
+  stride: Only every stride-th frame delivered to the appsink is inferred.
+  max_rate: Maximum capture frame rate, applied with videorate.
+  model: Index of the model to use, 0 being the largest.
+
+Within a model, levels lower the inference rate (max_rate / stride) down to
+min_inference_rate, then the ladder moves on to the next smaller model at
+full rate. When the measured end-to-end latency (or frame rate) misses its
+target for a whole measurement window the controller steps down one level;
+when it beats the target by the hysteresis margin it steps back up. After
+every change, measurements are discarded for a cooldown period so that the
+pipeline settles before the next decision. A level that had to be left
+because it missed the target is not retried for a backoff period that
+doubles every time, up to max_backoff, to avoid oscillating between two
+neighbouring levels.
+"""
+
+import collections
+import time
+
+import numpy as np
+
+Level = collections.namedtuple('Level', ['stride', 'max_rate', 'model'])
+
+
+def build_levels(num_models=1, rates=(30, 20, 15, 10), strides=(1, 2, 3),
+                 min_inference_rate=10):
+    """Builds a ladder of levels ordered from most to least expensive.
+
+    Args:
+      num_models: Number of models, ordered from largest to smallest.
+      rates: Capture frame rates to choose from.
+      strides: Inference strides to choose from.
+      min_inference_rate: Lowest inference rate used before switching to a
+        smaller model. The smallest model goes all the way down.
+
+    Returns:
+      List of Level.
+    """
+    by_rate = {}
+    for rate in sorted(rates, reverse=True):
+        for stride in sorted(strides):
+            # For equal inference rates prefer the higher capture rate, it
+            # keeps the displayed video smooth.
+            by_rate.setdefault(rate / stride, (stride, rate))
+    ordered = [by_rate[r] for r in sorted(by_rate, reverse=True)]
+
+    levels = []
+    for model in range(num_models):
+        last = model == num_models - 1
+        for stride, rate in ordered:
+            if last or rate / stride >= min_inference_rate:
+                levels.append(Level(stride, rate, model))
+    return levels
+
+
+class LoadController:
+    """Picks the level that holds a latency or frame rate target."""
+
+    def __init__(self, levels, target_latency_ms=None, target_fps=None, window=30,
+                 hysteresis=0.2, cooldown=2.0, max_backoff=60.0, log=print):
+        """Creates a controller starting at the first level.
+
+        Args:
+          levels: Ladder of Level, as returned by build_levels.
+          target_latency_ms: 90th percentile end-to-end latency to hold.
+          target_fps: Rendered frame rate to hold. Levels that can't reach it
+            are dropped from the ladder.
+          window: Number of frames per measurement.
+          hysteresis: Relative margin the target must be beaten by before
+            stepping back up.
+          cooldown: Seconds to wait after a change before measuring again.
+          max_backoff: Longest time a failed level is skipped for, in seconds.
+          log: Function called with a message for every decision.
+
+        Raises:
+          ValueError: If not exactly one target is given.
+        """
+        if (target_latency_ms is None) == (target_fps is None):
+            raise ValueError('Exactly one of target_latency_ms and target_fps is required.')
+        if target_fps is not None:
+            levels = [l for l in levels if l.max_rate / l.stride >= target_fps]
+        if not levels:
+            raise ValueError('No level can reach the target.')
+        self.levels = levels
+        self.target_latency_ms = target_latency_ms
+        self.target_fps = target_fps
+        self.window = window
+        self.hysteresis = hysteresis
+        self.cooldown = cooldown
+        self.max_backoff = max_backoff
+        self.log = log
+        self.index = 0
+        self._latencies = []
+        self._timestamps = []
+        self._settle_until = None
+        self._failures = collections.Counter()
+        self._blocked_until = {}
+
+    @property
+    def level(self):
+        """The current Level."""
+        return self.levels[self.index]
+
+    def observe(self, latency_ms, timestamp=None):
+        """Records the latency of a rendered frame.
+
+        Args:
+          latency_ms: Time from capture to the end of rendering.
+          timestamp: Time the frame was rendered, defaults to time.monotonic().
+
+        Returns:
+          The new Level if the controller changed level, None otherwise.
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self._settle_until is not None and timestamp < self._settle_until:
+            return None
+        self._latencies.append(latency_ms)
+        self._timestamps.append(timestamp)
+        if len(self._latencies) < self.window:
+            return None
+
+        latency = float(np.percentile(self._latencies, 90))
+        elapsed = self._timestamps[-1] - self._timestamps[0]
+        fps = (len(self._timestamps) - 1) / elapsed if elapsed > 0 else float('inf')
+        self._latencies = []
+        self._timestamps = []
+
+        if self.target_latency_ms is not None:
+            measured = 'latency p90 %.1f ms, target %.1f ms' % (latency, self.target_latency_ms)
+            overloaded = latency > self.target_latency_ms
+            underloaded = latency < self.target_latency_ms * (1 - self.hysteresis)
+        else:
+            measured = '%.1f fps, target %.1f fps' % (fps, self.target_fps)
+            overloaded = fps < self.target_fps
+            underloaded = fps > self.target_fps * (1 + self.hysteresis)
+
+        if overloaded and self.index + 1 < len(self.levels):
+            self._failures[self.index] += 1
+            backoff = self.cooldown * 2 ** self._failures[self.index]
+            self._blocked_until[self.index] = timestamp + min(backoff, self.max_backoff)
+            return self._change(self.index + 1, timestamp, measured)
+        if (underloaded and self.index > 0 and
+                timestamp >= self._blocked_until.get(self.index - 1, timestamp)):
+            return self._change(self.index - 1, timestamp, measured)
+        return None
+
+    def _change(self, index, timestamp, measured):
+        old_index, old = self.index, self.level
+        self.index = index
+        self._settle_until = timestamp + self.cooldown
+        self.log('LoadController: %s, level %d -> %d (stride %d -> %d, max rate %d -> %d, '
+                 'model %d -> %d)' % (measured, old_index, index,
+                                      old.stride, self.level.stride, old.max_rate,
+                                      self.level.max_rate, old.model, self.level.model))
+        return self.level
@@ -0,0 +1,101 @@
+# Lint as: python3
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import load_controller
+from load_controller import Level
+
+# Inference time of the three default models on a slowed down engine.
+INFERENCE_MS = (120.0, 45.0, 25.0)
+
+
+def simulate(controller, seconds, target_latency_ms=None):
+    """Runs a simulated pipeline.
+
+    Latency is the inference time plus queueing delay that grows when
+    frames arrive faster than they can be inferred.
+
+    Returns:
+      (visited, missed) where visited lists the levels visited and missed is
+      the fraction of frames over target_latency_ms during the second half.
+    """
+    t = 0.0
+    visited = [controller.index]
+    frames = missed = 0
+    while t < seconds:
+        level = controller.level
+        rate = level.max_rate / level.stride
+        inference_ms = INFERENCE_MS[level.model]
+        t += max(1.0 / rate, inference_ms / 1000)
+        latency_ms = inference_ms + max(0.0, inference_ms - 1000 / rate) * 2
+        if t > seconds / 2:
+            frames += 1
+            missed += target_latency_ms is not None and latency_ms > target_latency_ms
+        if controller.observe(latency_ms, timestamp=t):
+            visited.append(controller.index)
+    return visited, missed / max(frames, 1)
+
+
+class LoadControllerTest(unittest.TestCase):
+
+    def test_build_levels(self):
+        levels = load_controller.build_levels(num_models=2, rates=(30, 15), strides=(1, 2))
+        # Equal inference rates keep the higher capture rate, only the last
+        # model goes below min_inference_rate.
+        self.assertEqual(levels, [Level(1, 30, 0), Level(2, 30, 0),
+                                  Level(1, 30, 1), Level(2, 30, 1), Level(2, 15, 1)])
+
+    def test_holds_latency_target(self):
+        messages = []
+        controller = load_controller.LoadController(
+            load_controller.build_levels(num_models=3), target_latency_ms=60,
+            log=messages.append)
+        visited, missed = simulate(controller, 300, target_latency_ms=60)
+        self.assertEqual(controller.level.model, 1)
+        self.assertEqual(len(messages), len(visited) - 1)
+        # Backs off from probing the level above instead of oscillating.
+        self.assertLess(len(visited), 25)
+        self.assertLess(missed, 0.1)
+
+    def test_holds_fps_target(self):
+        controller = load_controller.LoadController(
+            load_controller.build_levels(num_models=3), target_fps=25, log=lambda m: None)
+        simulate(controller, 120)
+        self.assertEqual(controller.level, Level(1, 30, 2))
+
+    def test_recovers_when_load_drops(self):
+        controller = load_controller.LoadController(
+            load_controller.build_levels(num_models=3), target_latency_ms=60,
+            log=lambda m: None)
+        for i in range(10 * controller.window):
+            controller.observe(500, timestamp=i * 0.1)
+        self.assertGreater(controller.index, 0)
+        t = 100.0
+        while controller.index and t < 1000:
+            controller.observe(10, timestamp=t)
+            t += 0.1
+        self.assertEqual(controller.index, 0)
+
+    def test_requires_one_target(self):
+        levels = load_controller.build_levels()
+        with self.assertRaises(ValueError):
+            load_controller.LoadController(levels)
+        with self.assertRaises(ValueError):
+            load_controller.LoadController(levels, target_latency_ms=10, target_fps=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
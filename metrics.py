@@ -0,0 +1,325 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Counters and histograms for long running deployments.
+
+Metrics are updated from the pipeline threads without taking a lock: every
+thread increments its own cell of a metric, created the first time the
+thread touches it, and readers add up the cells. A reader can miss an update
+that is in progress, which only delays it to the next scrape.
+
+The registry renders all metrics in the Prometheus text format, served by
+MetricsServer on /metrics and periodically appended to a rotating file by
+MetricsFileWriter:
+
+    registry = metrics.REGISTRY
+    inference_ms = registry.histogram('posenet_inference_ms', 'Inference time.')
+    inference_ms.observe(12.5)
+    server = metrics.MetricsServer(registry, ('0.0.0.0', 9100))
+"""
+
+import argparse
+import bisect
+import http.server
+import os
+import threading
+import time
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+                             for k, v in sorted(labels.items()))
+
+
+class _Metric:
+    """Metric with one cell per updating thread."""
+
+    type = None
+
+    def __init__(self, name, description, labels=None):
+        self.name = name
+        self.description = description
+        self.labels = dict(labels or {})
+        self._cells = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _new_cell(self):
+        raise NotImplementedError
+
+    def _cell(self):
+        cell = getattr(self._local, 'cell', None)
+        if cell is None:
+            cell = self._local.cell = self._new_cell()
+            # Only taken once per thread, readers copy the list.
+            with self._lock:
+                self._cells = self._cells + [cell]
+        return cell
+
+    def samples(self):
+        """Returns a list of (suffix, labels, value)."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. of frames or errors."""
+
+    type = 'counter'
+
+    def _new_cell(self):
+        return [0]
+
+    def inc(self, amount=1):
+        self._cell()[0] += amount
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in self._cells)
+
+    def samples(self):
+        return [('', self.labels, self.value)]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS_MS, labels=None):
+        """Creates a histogram.
+
+        Args:
+          name: Metric name.
+          description: One line description, the Prometheus HELP.
+          buckets: Increasing upper bounds, +Inf is added.
+          labels: Dict of constant labels.
+        """
+        super().__init__(name, description, labels)
+        self.buckets = tuple(float(b) for b in buckets)
+        if list(self.buckets) != sorted(set(self.buckets)):
+            raise ValueError('Buckets must be increasing: {}'.format(buckets))
+
+    def _new_cell(self):
+        # Bucket counts (not cumulative, the last one is +Inf), then sum.
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value):
+        cell = self._cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self):
+        """Returns (cumulative bucket counts including +Inf, sum, count)."""
+        totals = [0] * (len(self.buckets) + 2)
+        for cell in self._cells:
+            for i, value in enumerate(list(cell)):
+                totals[i] += value
+        cumulative = []
+        count = 0
+        for value in totals[:-1]:
+            count += value
+            cumulative.append(count)
+        return cumulative, totals[-1], count
+
+    def percentile(self, q):
+        """Returns the upper bound of the bucket holding the q-th percentile."""
+        cumulative, _, count = self.snapshot()
+        if not count:
+            return float('nan')
+        i = bisect.bisect_left(cumulative, count * q / 100)
+        return self.buckets[i] if i < len(self.buckets) else float('inf')
+
+    def samples(self):
+        cumulative, total, count = self.snapshot()
+        samples = []
+        for bound, value in zip(self.buckets + (float('inf'),), cumulative):
+            samples.append(('_bucket', dict(self.labels, le=_format_value(bound)), value))
+        samples.append(('_sum', self.labels, total))
+        samples.append(('_count', self.labels, count))
+        return samples
+
+
+class Registry:
+    """Set of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, description, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(name, description, labels=labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError('{} is already a {}.'.format(name, metric.type))
+        return metric
+
+    def counter(self, name, description, labels=None):
+        """Returns the counter with this name and labels, creating it if needed."""
+        return self._get(Counter, name, description, labels)
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS_MS, labels=None):
+        """Returns the histogram with this name and labels, creating it if needed."""
+        return self._get(Histogram, name, description, labels, buckets=buckets)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        previous = None
+        for (name, _), metric in metrics:
+            if name != previous:
+                lines.append('# HELP %s %s' % (name, metric.description))
+                lines.append('# TYPE %s %s' % (name, metric.type))
+                previous = name
+            for suffix, labels, value in metric.samples():
+                lines.append('%s%s%s %s' % (name, suffix, _format_labels(labels),
+                                            _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    """Serves a registry on http://address/metrics from a background thread."""
+
+    def __init__(self, registry=REGISTRY, address=('127.0.0.1', 9100)):
+        """Starts the server.
+
+        Args:
+          registry: Registry to serve.
+          address: (host, port) to listen on, port 0 picks a free port.
+        """
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(address, Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+class MetricsFileWriter:
+    """Appends timestamped registry dumps to a file from a background thread.
+
+    When the file grows beyond max_bytes it is renamed to path.1 (and path.1
+    to path.2 and so on), keeping backup_count old files.
+    """
+
+    def __init__(self, registry=REGISTRY, path='metrics.prom', interval=60.0,
+                 max_bytes=1 << 20, backup_count=3):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self):
+        """Appends a dump now, rotating the file first if it is full."""
+        text = '# time %.3f\n%s\n' % (time.time(), self.registry.render())
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(text) > self.max_bytes:
+            self._rotate()
+        with open(self.path, 'a') as f:
+            f.write(text)
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self.path, i)):
+                os.replace('%s.%d' % (self.path, i), '%s.%d' % (self.path, i + 1))
+        if self.backup_count:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        """Writes a last dump and stops the thread."""
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+def overhead(updates_per_frame=8, frames=100000):
+    """Returns the time in microseconds that updating metrics adds per frame."""
+    registry = Registry()
+    histogram = registry.histogram('benchmark_ms', 'Benchmark.')
+    counter = registry.counter('benchmark_total', 'Benchmark.')
+    start = time.perf_counter()
+    for i in range(frames):
+        for _ in range(updates_per_frame // 2):
+            histogram.observe(i % 50)
+            counter.inc()
+    return (time.perf_counter() - start) / frames * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--updates_per_frame', type=int, default=8,
+                        help='Metric updates per frame, pose_camera makes about 8.')
+    parser.add_argument('--frame_ms', type=float, default=33.3, help='Frame time.')
+    args = parser.parse_args()
+    cost = overhead(args.updates_per_frame)
+    print('%.2f us per frame for %d updates, %.4f%% of a %.1f ms frame' % (
+        cost, args.updates_per_frame, cost / 10 / args.frame_ms, args.frame_ms))
+
+
+if __name__ == '__main__':
+    main()
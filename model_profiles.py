@@ -0,0 +1,164 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Registry of the PoseNet models supported by this repo.
+
+Every model is described by a ModelProfile with what the engine, the camera
+examples and the benchmarks need to know about it: input size, output stride,
+how to normalize float inputs and where the decoder component lives. Profile
+names are the model file names without extension, which are also the names
+of the reference results in test_data.
+
+There is a profile for each of the 18 models with reference results: the
+twelve ResNet-50 models (six input sizes, each for CPU and Edge TPU) and the
+six MobileNet models in models/, so ResNet and MobileNet models can be
+compared in one table and picked the same way.
+"""
+
+import collections
+import os
+
+import numpy as np
+
+MODEL_DIR = 'models'
+
+# Float MobileNet models take pixels in [-1, 1].
+MOBILENET_MEAN = (128.0, 128.0, 128.0)
+MOBILENET_STD = (128.0, 128.0, 128.0)
+# Float ResNet models take pixels minus the ImageNet mean.
+RESNET_MEAN = (123.15, 115.90, 103.06)
+RESNET_STD = (1.0, 1.0, 1.0)
+
+ModelProfile = collections.namedtuple('ModelProfile', [
+    'name', 'architecture', 'input_size', 'output_stride', 'edgetpu',
+    'model_path', 'decoder_path', 'input_mean', 'input_std'])
+ModelProfile.__doc__ = """Description of one PoseNet model.
+
+  name: Model file name without extension.
+  architecture: 'mobilenet' or 'resnet'.
+  input_size: (width, height) of the input tensor.
+  output_stride: Input pixels per heatmap cell.
+  edgetpu: Whether the model is compiled for the Edge TPU.
+  model_path: Path to the model, relative to the repo root.
+  decoder_path: Path to the decoder component of the model.
+  input_mean: Per channel value subtracted from float inputs.
+  input_std: Per channel value float inputs are divided by.
+"""
+
+MOBILENET_SIZES = ((481, 353), (641, 481), (1281, 721))
+RESNET_SIZES = ((416, 288, 16), (640, 480, 16), (768, 496, 32),
+                (864, 624, 32), (928, 672, 16), (960, 736, 32))
+
+
+def _mobilenet_profile(width, height, edgetpu):
+    size = '%d_%d' % (height, width)
+    name = 'posenet_mobilenet_v1_075_%s_quant_decoder%s' % (size, '_edgetpu' if edgetpu else '')
+    directory = os.path.join(MODEL_DIR, 'mobilenet')
+    return ModelProfile(
+        name, 'mobilenet', (width, height), 16, edgetpu,
+        os.path.join(directory, name + '.tflite'),
+        os.path.join(directory, 'components', 'posenet_mobilenet_v1_075_%s_decoder.tflite' % size),
+        MOBILENET_MEAN, MOBILENET_STD)
+
+
+def _resnet_profile(width, height, stride, edgetpu):
+    prefix = 'posenet_resnet_50_%d_%d_%d' % (width, height, stride)
+    name = '%s_quant_%s_decoder' % (prefix, 'edgetpu' if edgetpu else 'cpu')
+    directory = os.path.join(MODEL_DIR, 'resnet')
+    return ModelProfile(
+        name, 'resnet', (width, height), stride, edgetpu,
+        os.path.join(directory, name + '.tflite'),
+        os.path.join(directory, 'components', prefix + '_customop_stub.tflite'),
+        RESNET_MEAN, RESNET_STD)
+
+
+def _build_profiles():
+    profiles = []
+    for edgetpu in (True, False):
+        profiles += [_mobilenet_profile(w, h, edgetpu) for w, h in MOBILENET_SIZES]
+        profiles += [_resnet_profile(w, h, s, edgetpu) for w, h, s in RESNET_SIZES]
+    return collections.OrderedDict((p.name, p) for p in profiles)
+
+
+PROFILES = _build_profiles()
+
+
+def get_profile(name):
+    """Returns the ModelProfile with the given name.
+
+    Raises:
+      ValueError: If there is no such profile.
+    """
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError('Unknown model profile {}, expected one of: {}'.format(
+            name, ', '.join(PROFILES)))
+
+
+def profile_for_model(model_path):
+    """Returns the ModelProfile of a model file, None if it is not a known model."""
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return PROFILES.get(name)
+
+
+def is_available(profile, root='.'):
+    """Returns whether the model file of the profile exists."""
+    return os.path.exists(os.path.join(root, profile.model_path))
+
+
+def find_profiles(architecture=None, edgetpu=None, output_stride=None, available=False):
+    """Returns profiles matching all given criteria, smallest input first."""
+    profiles = [p for p in PROFILES.values()
+                if (architecture is None or p.architecture == architecture) and
+                (edgetpu is None or p.edgetpu == edgetpu) and
+                (output_stride is None or p.output_stride == output_stride) and
+                (not available or is_available(p))]
+    return sorted(profiles, key=lambda p: p.input_size[0] * p.input_size[1])
+
+
+def closest_profile(size, architecture='mobilenet', edgetpu=True, output_stride=None,
+                    available=True):
+    """Returns the profile with the input size closest to size.
+
+    Args:
+      size: (width, height) the model should take, e.g. the camera resolution.
+      architecture: 'mobilenet' or 'resnet'.
+      edgetpu: Whether to pick an Edge TPU model.
+      output_stride: Only consider models with this output stride.
+      available: Only consider profiles whose model file exists.
+
+    Raises:
+      ValueError: If no profile matches, or none of the model files of the
+        matching profiles exists.
+    """
+    profiles = find_profiles(architecture, edgetpu, output_stride)
+    if not profiles:
+        raise ValueError('No {} model with output stride {}.'.format(architecture, output_stride))
+
+    def distance(p):
+        return abs(p.input_size[0] - size[0]) + abs(p.input_size[1] - size[1])
+
+    if available:
+        present = [p for p in profiles if is_available(p)]
+        if not present:
+            raise ValueError('No {} model file found, the closest one would be {}.'.format(
+                architecture, min(profiles, key=distance).model_path))
+        profiles = present
+    return min(profiles, key=distance)
+
+
+def normalize_input(pixels, mean, std, dtype=np.float32):
+    """Converts uint8 RGB pixels to the float input of a model."""
+    pixels = np.asarray(pixels, dtype=dtype).reshape(-1, 3)
+    return ((pixels - np.asarray(mean, dtype=dtype)) / np.asarray(std, dtype=dtype)).ravel()
@@ -0,0 +1,82 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+from tflite_runtime.interpreter import Interpreter
+
+import model_profiles
+import test_utils
+
+
+class ModelProfilesTest(unittest.TestCase):
+
+    def test_profiles(self):
+        self.assertEqual(len(model_profiles.PROFILES), 18)
+        for profile in model_profiles.PROFILES.values():
+            self.assertIs(model_profiles.profile_for_model(profile.model_path), profile)
+            self.assertEqual(profile.edgetpu, 'edgetpu' in profile.name)
+            self.assertTrue(os.path.exists(os.path.join(
+                test_utils.TEST_DATA_DIR, profile.name + '_reference.csv')), profile.name)
+
+    def test_decoder_matches_stride(self):
+        for profile in model_profiles.PROFILES.values():
+            interpreter = Interpreter(profile.decoder_path)
+            heatmaps = interpreter.get_input_details()[0]
+            width, height = profile.input_size
+            stride = profile.output_stride
+            self.assertEqual(list(heatmaps['shape'][1:3]),
+                             [height // stride + 1, width // stride + 1], profile.name)
+
+    def test_unknown_profile(self):
+        self.assertIsNone(model_profiles.profile_for_model('models/other.tflite'))
+        with self.assertRaises(ValueError):
+            model_profiles.get_profile('other')
+
+    def test_closest_profile(self):
+        profile = model_profiles.closest_profile((640, 480))
+        self.assertEqual(profile.name, 'posenet_mobilenet_v1_075_481_641_quant_decoder_edgetpu')
+        profile = model_profiles.closest_profile((1280, 720), 'resnet', edgetpu=False,
+                                                 available=False)
+        self.assertEqual(profile.name, 'posenet_resnet_50_960_736_32_quant_cpu_decoder')
+        profile = model_profiles.closest_profile((640, 480), 'resnet', output_stride=32,
+                                                 available=False)
+        self.assertEqual(profile.input_size, (768, 496))
+
+    def test_closest_profile_missing_files(self):
+        large = model_profiles.get_profile('posenet_mobilenet_v1_075_721_1281_quant_decoder_edgetpu')
+        with mock.patch.object(model_profiles, 'is_available', lambda p: p is not large):
+            profile = model_profiles.closest_profile((1280, 720))
+            self.assertEqual(profile.input_size, (641, 481))
+        with mock.patch.object(model_profiles, 'is_available', lambda p: False):
+            with self.assertRaisesRegex(ValueError, large.model_path):
+                model_profiles.closest_profile((1280, 720))
+
+    def test_normalize_input(self):
+        pixels = np.array([0, 128, 255, 123, 116, 103], dtype=np.uint8)
+        np.testing.assert_allclose(
+            model_profiles.normalize_input(pixels, model_profiles.MOBILENET_MEAN,
+                                           model_profiles.MOBILENET_STD)[:3],
+            [-1.0, 0.0, 127.0 / 128])
+        np.testing.assert_allclose(
+            model_profiles.normalize_input(pixels, model_profiles.RESNET_MEAN,
+                                           model_profiles.RESNET_STD)[3:],
+            [-0.15, 0.1, -0.06], atol=1e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
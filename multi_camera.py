@@ -0,0 +1,607 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fusion of the poses of calibrated, overlapping cameras into 3D tracks.
+
+Every update takes the poses of one synchronized frame of every camera, in
+that camera's (undistorted) pixel coordinates:
+
+  1. Association: for every pair of cameras, the symmetric epipolar distance
+     between all poses is computed at once as an [Na, Nb] cost matrix. Pose
+     pairs are then merged into people, those that triangulate to the same
+     place as many other pairs first, never putting two poses of the same
+     camera into one person.
+  2. Triangulation: all keypoints of all people seen by at least two
+     cameras are solved together as a batch of score weighted linear least
+     squares (DLT) problems.
+  3. Tracking: people get stable ids with a PoseTracker on the 3D points.
+
+    cameras = multi_camera.load_cameras('cameras.json')
+    fusion = multi_camera.FusionEngine(cameras)
+    people = fusion.update([(keypoints, keypoint_scores) for each camera])
+
+FrameSynchronizer groups pose_publisher frames of several cameras by
+timestamp, and read_log / write_log store pose streams for offline runs.
+"""
+
+import argparse
+import collections
+import json
+import time
+
+import numpy as np
+
+from pose_tracker import PoseTracker
+
+NUM_KEYPOINTS = 17
+
+People3D = collections.namedtuple(
+    'People3D', ['track_ids', 'points', 'scores', 'views', 'reprojection_error'])
+People3D.__doc__ = """People of one fused frame.
+
+  track_ids: [N] int64 track ids.
+  points: [N, 17, 3] float32 world coordinates, NaN for keypoints seen by
+    fewer than two cameras.
+  scores: [N, 17] float32 mean keypoint score over the cameras used.
+  views: [N, C] pose index of every person in every camera, -1 if unseen.
+  reprojection_error: [N] mean reprojection error in pixels.
+"""
+
+
+class Camera:
+    """Pinhole camera: intrinsics K and world to camera rotation R, translation t."""
+
+    def __init__(self, K, R, t, size=None, name=None):
+        self.K = np.asarray(K, dtype=np.float64).reshape(3, 3)
+        self.R = np.asarray(R, dtype=np.float64).reshape(3, 3)
+        self.t = np.asarray(t, dtype=np.float64).reshape(3)
+        self.size = tuple(size) if size is not None else None
+        self.name = name
+        self.Rt = np.concatenate([self.R, self.t[:, np.newaxis]], axis=1)
+        self.P = self.K @ self.Rt
+        self.K_inv = np.linalg.inv(self.K)
+
+    @classmethod
+    def look_at(cls, position, target, size=(640, 480), fov=60.0, name=None):
+        """Returns a camera at position looking at target, y is down in the world."""
+        position = np.asarray(position, dtype=np.float64)
+        forward = np.asarray(target, dtype=np.float64) - position
+        forward /= np.linalg.norm(forward)
+        right = np.cross(forward, [0.0, -1.0, 0.0])
+        right /= np.linalg.norm(right)
+        down = np.cross(forward, right)
+        R = np.stack([right, down, forward])
+        focal = size[0] / 2 / np.tan(np.radians(fov) / 2)
+        K = [[focal, 0, size[0] / 2], [0, focal, size[1] / 2], [0, 0, 1]]
+        return cls(K, R, -R @ position, size, name)
+
+    @property
+    def center(self):
+        """Camera position in world coordinates."""
+        return -self.R.T @ self.t
+
+    def project(self, points):
+        """Projects [..., 3] world points to [..., 2] pixels, NaN behind the camera."""
+        camera = np.asarray(points, dtype=np.float64) @ self.R.T + self.t
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pixels = camera @ self.K.T
+            pixels = pixels[..., :2] / pixels[..., 2:]
+        return np.where(camera[..., 2:] > 0, pixels, np.nan)
+
+    def to_dict(self):
+        return {'K': self.K.tolist(), 'R': self.R.tolist(), 't': self.t.tolist(),
+                'size': list(self.size) if self.size else None}
+
+
+def load_cameras(path):
+    """Loads cameras from JSON: {"name": {"K": 3x3, "R": 3x3, "t": [3]}, ...}."""
+    with open(path) as f:
+        calibration = json.load(f)
+    return [Camera(c['K'], c['R'], c['t'], c.get('size'), name)
+            for name, c in calibration.items()]
+
+
+def save_cameras(path, cameras):
+    with open(path, 'w') as f:
+        json.dump({camera.name or str(i): camera.to_dict()
+                   for i, camera in enumerate(cameras)}, f, indent=2)
+
+
+def fundamental_matrix(camera_a, camera_b):
+    """Returns F with x_b^T F x_a = 0 for pixels of the same world point."""
+    # Relative pose of b with respect to a.
+    R = camera_b.R @ camera_a.R.T
+    t = camera_b.t - R @ camera_a.t
+    t_cross = np.array([[0, -t[2], t[1]], [t[2], 0, -t[0]], [-t[1], t[0], 0]])
+    return camera_b.K_inv.T @ t_cross @ R @ camera_a.K_inv
+
+
+def epipolar_cost(keypoints_a, scores_a, keypoints_b, scores_b, F, threshold=0.2):
+    """Mean symmetric epipolar distance between all poses of two cameras.
+
+    Args:
+      keypoints_a: [Na, 17, 2] pixels in camera a.
+      scores_a: [Na, 17] keypoint scores.
+      keypoints_b: [Nb, 17, 2] pixels in camera b.
+      scores_b: [Nb, 17] keypoint scores.
+      F: Fundamental matrix from a to b.
+      threshold: Keypoints scoring below this are ignored.
+
+    Returns:
+      [Na, Nb] cost in pixels, inf for pairs without common keypoints.
+    """
+    ha = np.concatenate([keypoints_a, np.ones(keypoints_a.shape[:2] + (1,))], axis=2)
+    hb = np.concatenate([keypoints_b, np.ones(keypoints_b.shape[:2] + (1,))], axis=2)
+    lines_b = ha @ F.T  # Epipolar lines in b of the points of a, [Na, 17, 3].
+    lines_a = hb @ F    # And in a of the points of b, [Nb, 17, 3].
+    # x_b^T F x_a for all pairs, [Na, Nb, 17].
+    algebraic = np.einsum('ikc,jkc->ijk', lines_b, hb)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        distance = np.abs(algebraic) * (
+            1 / np.hypot(lines_b[:, np.newaxis, :, 0], lines_b[:, np.newaxis, :, 1]) +
+            1 / np.hypot(lines_a[np.newaxis, :, :, 0], lines_a[np.newaxis, :, :, 1])) / 2
+    common = (scores_a >= threshold)[:, np.newaxis] & (scores_b >= threshold)[np.newaxis]
+    count = common.sum(axis=2)
+    total = np.where(common, np.nan_to_num(distance, nan=np.inf), 0).sum(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / np.maximum(count, 1), np.inf)
+
+
+def _pair_centers(camera_a, keypoints_a, scores_a, camera_b, keypoints_b, scores_b,
+                  threshold):
+    """Centers of K pose pairs, triangulated as closest points of rays.
+
+    Args:
+      camera_a, camera_b: The two Camera.
+      keypoints_a, keypoints_b: [K, 17, 2] pixels of the paired poses.
+      scores_a, scores_b: [K, 17] keypoint scores.
+      threshold: Keypoints scoring below this are ignored.
+
+    Returns:
+      [K, 3] mean of the keypoints seen in both cameras, NaN if there are none.
+    """
+    def rays(camera, keypoints):
+        homogeneous = np.concatenate([keypoints, np.ones(keypoints.shape[:2] + (1,))], axis=2)
+        return homogeneous @ (camera.R.T @ camera.K_inv).T
+
+    da, db = rays(camera_a, keypoints_a), rays(camera_b, keypoints_b)
+    w = camera_a.center - camera_b.center
+    a, b, c = (da * da).sum(axis=2), (da * db).sum(axis=2), (db * db).sum(axis=2)
+    d, e = da @ w, db @ w
+    with np.errstate(invalid='ignore', divide='ignore'):
+        denominator = a * c - b * b
+        s = (b * e - c * d) / denominator
+        t = (a * e - b * d) / denominator
+    midpoints = (camera_a.center + s[..., np.newaxis] * da +
+                 camera_b.center + t[..., np.newaxis] * db) / 2
+    counted = ((scores_a >= threshold) & (scores_b >= threshold) & (s > 0) & (t > 0) &
+               np.isfinite(midpoints).all(axis=2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (np.where(counted[..., np.newaxis], midpoints, 0).sum(axis=1) /
+                counted.sum(axis=1)[:, np.newaxis])
+
+
+def associate(cameras, keypoints, keypoint_scores, max_cost=20.0, threshold=0.2,
+              merge_distance=0.3):
+    """Groups the poses of all cameras into people.
+
+    A pair of poses of the same person triangulates to the same place as
+    every other pair of that person's poses, while two people who happen to
+    lie on one epipolar plane of a camera pair triangulate somewhere else.
+    Pairs are therefore merged in order of how many other pairs agree with
+    them in 3D, cheapest first among equals.
+
+    Args:
+      cameras: List of C Camera.
+      keypoints: List of C [N_c, 17, 2] arrays.
+      keypoint_scores: List of C [N_c, 17] arrays.
+      max_cost: Largest mean epipolar distance in pixels for the same person.
+      threshold: Keypoints scoring below this are ignored.
+      merge_distance: Distance in world units within which the centers of
+        two triangulated pairs agree.
+
+    Returns:
+      [P, C] int array of the pose index of every person in every camera, -1
+      where the person is not seen, for the P people seen by 2 or more cameras.
+    """
+    costs = {}
+    edges = []
+    centers = []
+    for a in range(len(cameras)):
+        for b in range(a + 1, len(cameras)):
+            if not len(keypoints[a]) or not len(keypoints[b]):
+                continue
+            F = fundamental_matrix(cameras[a], cameras[b])
+            cost = costs[(a, b)] = epipolar_cost(keypoints[a], keypoint_scores[a], keypoints[b],
+                                                 keypoint_scores[b], F, threshold)
+            i, j = np.nonzero(cost <= max_cost)
+            edges.extend((cost[i, j], a, int(i), b, int(j)) for i, j in zip(i, j))
+            centers.append(_pair_centers(cameras[a], keypoints[a][i], keypoint_scores[a][i],
+                                         cameras[b], keypoints[b][j], keypoint_scores[b][j],
+                                         threshold))
+    if edges:
+        centers = np.nan_to_num(np.concatenate(centers), nan=np.inf)
+        squared = (centers * centers).sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            distance = squared[:, np.newaxis] + squared[np.newaxis] - 2 * centers @ centers.T
+        support = (distance <= merge_distance ** 2).sum(axis=1)
+        order = np.lexsort(([edge[0] for edge in edges], -support))
+        edges = [edges[e] for e in order]
+
+    def consistent(group_a, group_b):
+        # Every pose of one group must match every pose of the other, so that
+        # chains of good pairs can't join different people.
+        for a, i in group_a.items():
+            for b, j in group_b.items():
+                if a == b:
+                    return False
+                cost = costs[(a, b)][i, j] if a < b else costs[(b, a)][j, i]
+                if cost > max_cost:
+                    return False
+        return True
+
+    # Merge (camera, pose) groups along the cheapest pairs first.
+    groups = {}
+    for _, a, i, b, j in edges:
+        group_a = groups.get((a, i), {a: i})
+        group_b = groups.get((b, j), {b: j})
+        if group_a is group_b or not consistent(group_a, group_b):
+            continue
+        group_a.update(group_b)
+        for camera, pose in group_a.items():
+            groups[(camera, pose)] = group_a
+
+    people = []
+    seen = set()
+    for group in groups.values():
+        if id(group) in seen:
+            continue
+        seen.add(id(group))
+        row = np.full(len(cameras), -1, dtype=np.int64)
+        for camera, pose in group.items():
+            row[camera] = pose
+        people.append(row)
+    people.sort(key=lambda row: tuple(row))
+    return np.array(people, dtype=np.int64).reshape(-1, len(cameras))
+
+
+def triangulate(cameras, keypoints, weights, min_views=2):
+    """Score weighted linear triangulation of a batch of points.
+
+    Args:
+      cameras: List of C Camera.
+      keypoints: [M, C, 2] pixels of M points in every camera.
+      weights: [M, C] weights, 0 where a camera doesn't see a point.
+      min_views: Cameras with weight > 0 needed for a point.
+
+    Returns:
+      [M, 3] world points, NaN where fewer than min_views cameras see them.
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float64)
+    weights = np.nan_to_num(np.asarray(weights, dtype=np.float64))
+    # Normalized image coordinates condition the problem much better.
+    K_inv = np.stack([camera.K_inv for camera in cameras])
+    Rt = np.stack([camera.Rt for camera in cameras])
+    homogeneous = np.concatenate([np.nan_to_num(keypoints), np.ones(keypoints.shape[:2] + (1,))],
+                                 axis=2)
+    normalized = np.einsum('cij,mcj->mci', K_inv, homogeneous)
+    x = (normalized[..., 0] / normalized[..., 2])[..., np.newaxis]
+    y = (normalized[..., 1] / normalized[..., 2])[..., np.newaxis]
+    # Two rows per camera: x * P3 - P1 and y * P3 - P2, [M, 2C, 4].
+    rows = np.concatenate([x * Rt[np.newaxis, :, 2] - Rt[np.newaxis, :, 0],
+                           y * Rt[np.newaxis, :, 2] - Rt[np.newaxis, :, 1]], axis=1)
+    rows *= np.concatenate([weights, weights], axis=1)[..., np.newaxis]
+    _, _, vt = np.linalg.svd(rows)
+    solution = vt[:, -1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        points = solution[:, :3] / solution[:, 3:]
+    valid = (weights > 0).sum(axis=1) >= min_views
+    return np.where(valid[:, np.newaxis], points, np.nan)
+
+
+class FusionEngine:
+    """Associates, triangulates and tracks the people seen by several cameras."""
+
+    def __init__(self, cameras, max_cost=20.0, threshold=0.2, merge_distance=0.3,
+                 max_distance=0.5, max_age=5):
+        """Creates an engine.
+
+        Args:
+          cameras: List of calibrated Camera.
+          max_cost: Largest mean epipolar distance in pixels between two
+            poses of the same person.
+          threshold: Keypoints scoring below this are not used.
+          merge_distance: Distance in world units within which pose pairs
+            triangulate to the same person, see associate().
+          max_distance: Furthest a person may move between frames, in world
+            units, for tracking.
+          max_age: Frames a track survives without being seen.
+        """
+        if len(cameras) < 2:
+            raise ValueError('Fusion needs at least two cameras.')
+        self.cameras = list(cameras)
+        self.max_cost = max_cost
+        self.threshold = threshold
+        self.merge_distance = merge_distance
+        self.tracker = PoseTracker(threshold, max_distance, max_age)
+
+    def update(self, views):
+        """Fuses one synchronized frame.
+
+        Args:
+          views: List with (keypoints [N, 17, 2], keypoint_scores [N, 17])
+            for every camera, keypoints in that camera's pixel coordinates.
+
+        Returns:
+          People3D.
+        """
+        keypoints = [np.asarray(k, dtype=np.float64).reshape(-1, NUM_KEYPOINTS, 2)
+                     for k, _ in views]
+        scores = [np.asarray(s, dtype=np.float64).reshape(-1, NUM_KEYPOINTS) for _, s in views]
+        people = associate(self.cameras, keypoints, scores, self.max_cost, self.threshold,
+                           self.merge_distance)
+        gathered, weights = self._gather(people, keypoints, scores)
+        points, errors = self._triangulate(gathered, weights)
+        # A wrongly associated camera shows as a large reprojection error:
+        # drop it and solve again, dropping people left with one camera.
+        outliers = errors > self.max_cost
+        if outliers.any():
+            people[outliers] = -1
+            weights[outliers] = 0.0
+            points, errors = self._triangulate(gathered, weights)
+        # A person seen by only two cameras can still be a wrong pair. People
+        # seen by three or more are reliable: they claim the poses they
+        # reproject onto in every camera.
+        if self._reassign(people, points, keypoints, scores):
+            gathered, weights = self._gather(people, keypoints, scores)
+            points, errors = self._triangulate(gathered, weights)
+        keep = (people >= 0).sum(axis=1) >= 2
+        people, points, weights, errors = people[keep], points[keep], weights[keep], errors[keep]
+
+        used = weights > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            point_scores = weights.sum(axis=1) / used.sum(axis=1)
+            mean_errors = np.nansum(errors, axis=1) / np.isfinite(errors).sum(axis=1)
+        valid = np.isfinite(points).all(axis=2)
+        point_scores = np.where(valid, point_scores, 0.0)
+
+        track_ids = self.tracker.update(np.where(valid[..., np.newaxis], points, 0.0),
+                                        point_scores)
+        return People3D(track_ids, points.astype(np.float32), point_scores.astype(np.float32),
+                        people, mean_errors.astype(np.float32))
+
+    def _gather(self, people, keypoints, scores):
+        """Returns the [P, C, 17, 2] views and [P, C, 17] weights of people."""
+        num_people, num_cameras = people.shape
+        gathered = np.full((num_people, num_cameras, NUM_KEYPOINTS, 2), np.nan)
+        weights = np.zeros((num_people, num_cameras, NUM_KEYPOINTS))
+        for c in range(num_cameras):
+            seen = people[:, c] >= 0
+            gathered[seen, c] = keypoints[c][people[seen, c]]
+            weights[seen, c] = scores[c][people[seen, c]]
+        return gathered, np.where(weights >= self.threshold, weights, 0.0)
+
+    def _reassign(self, people, points, keypoints, scores):
+        """Matches the poses of every camera to people seen by 3+ cameras.
+
+        Updates people in place and returns whether anything changed.
+        """
+        anchors = np.flatnonzero((people >= 0).sum(axis=1) >= 3)
+        if not len(anchors):
+            return False
+        before = people.copy()
+        for c, camera in enumerate(self.cameras):
+            if not len(keypoints[c]):
+                continue
+            reprojected = camera.project(points[anchors])  # [A, 17, 2]
+            distance = np.linalg.norm(reprojected[:, np.newaxis] - keypoints[c][np.newaxis],
+                                      axis=3)  # [A, N, 17]
+            counted = (scores[c][np.newaxis] >= self.threshold) & np.isfinite(distance)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                cost = np.where(counted, distance, 0).sum(axis=2) / counted.sum(axis=2)
+            cost = np.nan_to_num(cost, nan=np.inf)
+            # Cheapest pairs first, one pose per person.
+            people[anchors, c] = -1
+            taken = set()
+            for flat in np.argsort(cost, axis=None):
+                a, n = np.unravel_index(flat, cost.shape)
+                if cost[a, n] > self.max_cost:
+                    break
+                if people[anchors[a], c] < 0 and n not in taken:
+                    people[anchors[a], c] = n
+                    taken.add(n)
+            others = np.isin(people[:, c], list(taken))
+            others[anchors] = False
+            people[others, c] = -1
+        return not np.array_equal(before, people)
+
+    def _triangulate(self, gathered, weights):
+        """Returns [P, 17, 3] points and [P, C] mean reprojection errors, NaN if unused."""
+        num_people, num_cameras = weights.shape[:2]
+        # One batch of P * 17 triangulations.
+        flat_points = gathered.transpose(0, 2, 1, 3).reshape(-1, num_cameras, 2)
+        flat_weights = weights.transpose(0, 2, 1).reshape(-1, num_cameras)
+        points = triangulate(self.cameras, flat_points, flat_weights).reshape(
+            num_people, NUM_KEYPOINTS, 3)
+        reprojected = np.stack([camera.project(points) for camera in self.cameras], axis=1)
+        distance = np.linalg.norm(reprojected - gathered, axis=3)
+        # Points behind a camera count as far off.
+        counted = (weights > 0) & np.isfinite(points).all(axis=2)[:, np.newaxis]
+        distance = np.where(counted, np.nan_to_num(distance, nan=np.inf), 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            errors = distance.sum(axis=2) / counted.sum(axis=2)
+        return points, errors
+
+
+class FrameSynchronizer:
+    """Groups frames of several cameras whose timestamps are close.
+
+    Frames are added as they arrive, e.g. pose_publisher.Frame from one
+    PoseSubscriber per camera. Once every camera has a frame, the frames
+    closest to the latest of their oldest ones are returned together; older
+    frames are dropped. Cameras must share a clock, e.g. through NTP or PTP.
+    """
+
+    def __init__(self, num_cameras, tolerance=0.02):
+        self.tolerance = tolerance
+        self.dropped = 0
+        self._queues = [collections.deque() for _ in range(num_cameras)]
+
+    def add(self, camera, timestamp, frame):
+        """Adds a frame; returns (timestamp, [frame per camera]) or None."""
+        self._queues[camera].append((timestamp, frame))
+        while all(self._queues):
+            reference = max(queue[0][0] for queue in self._queues)
+            # Drop frames too old to match the reference.
+            stale = False
+            for queue in self._queues:
+                while queue and queue[0][0] < reference - self.tolerance:
+                    queue.popleft()
+                    self.dropped += 1
+                    stale = True
+            if stale:
+                continue
+            frames = [queue.popleft()[1] for queue in self._queues]
+            return reference, frames
+        return None
+
+
+def write_log(f, camera, timestamp, keypoints, keypoint_scores):
+    """Writes one camera frame of poses as a JSON line."""
+    f.write(json.dumps({'camera': camera, 'timestamp': timestamp,
+                        'keypoints': np.round(np.nan_to_num(keypoints), 2).tolist(),
+                        'keypoint_scores': np.round(keypoint_scores, 3).tolist()}) + '\n')
+
+
+def read_log(path):
+    """Yields (camera, timestamp, keypoints, keypoint_scores) of a write_log file."""
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            yield (record['camera'], record['timestamp'],
+                   np.array(record['keypoints'], dtype=np.float32).reshape(-1, NUM_KEYPOINTS, 2),
+                   np.array(record['keypoint_scores'], dtype=np.float32).reshape(-1, NUM_KEYPOINTS))
+
+
+# Standing person facing +z, (x, y, z) in meters relative to the ankles'
+# midpoint, y down; their left is -x.
+SKELETON = np.array([
+    (0, -1.6, 0.1), (-0.03, -1.65, 0.08), (0.03, -1.65, 0.08), (-0.08, -1.62, 0), (0.08, -1.62, 0),
+    (-0.2, -1.4, 0), (0.2, -1.4, 0), (-0.25, -1.1, 0), (0.25, -1.1, 0), (-0.27, -0.85, 0.05),
+    (0.27, -0.85, 0.05), (-0.12, -0.95, 0), (0.12, -0.95, 0), (-0.12, -0.5, 0.02),
+    (0.12, -0.5, 0.02), (-0.12, -0.05, 0), (0.12, -0.05, 0)])
+
+
+def synthetic_scene(num_people, num_frames, seed=0):
+    """Returns [T, N, 17, 3] skeletons walking around a 6 x 6 m room."""
+    rng = np.random.RandomState(seed)
+    start = rng.uniform(-2.5, 2.5, (num_people, 2))
+    velocity = rng.uniform(-0.03, 0.03, (num_people, 2))
+    heading = rng.uniform(0, 2 * np.pi, num_people)
+    frames = []
+    for frame in range(num_frames):
+        position = np.clip(start + frame * velocity, -3, 3)
+        cos, sin = np.cos(heading), np.sin(heading)
+        x = SKELETON[:, 0] * cos[:, np.newaxis] + SKELETON[:, 2] * sin[:, np.newaxis]
+        z = -SKELETON[:, 0] * sin[:, np.newaxis] + SKELETON[:, 2] * cos[:, np.newaxis]
+        frames.append(np.stack([x + position[:, :1], np.broadcast_to(SKELETON[:, 1], x.shape),
+                                z + position[:, 1:]], axis=2))
+    return np.array(frames)
+
+
+def synthetic_cameras(num_cameras, size=(640, 480)):
+    """Returns cameras on a circle around the room, 2.5 m high, looking at its center."""
+    angles = np.linspace(0, 2 * np.pi, num_cameras, endpoint=False)
+    return [Camera.look_at((5 * np.cos(a), -2.5, 5 * np.sin(a)), (0, -1, 0), size,
+                           fov=75, name='camera%d' % i) for i, a in enumerate(angles)]
+
+
+def synthetic_views(cameras, skeletons, rng, noise=1.0, dropout=0.1):
+    """Projects skeletons into every camera as detected poses.
+
+    Poses come in random order per camera, with pixel noise, dropped
+    keypoints and no poses for people out of view.
+    """
+    views = []
+    for camera in cameras:
+        pixels = camera.project(skeletons) + rng.normal(0, noise, skeletons.shape[:2] + (2,))
+        scores = rng.uniform(0.5, 1.0, skeletons.shape[:2])
+        scores[rng.random_sample(scores.shape) < dropout] = 0.0
+        inside = np.isfinite(pixels).all(axis=2)
+        if camera.size:
+            inside &= ((pixels >= 0) & (pixels < camera.size)).all(axis=2)
+        scores[~inside] = 0.0
+        pixels = np.nan_to_num(pixels)
+        keep = rng.permutation(np.flatnonzero((scores > 0).sum(axis=1) >= 5))
+        views.append((pixels[keep], scores[keep]))
+    return views
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--cameras', help='Calibration JSON, synthetic cameras if not given.')
+    parser.add_argument('--log', help='Pose log of write_log to fuse, a synthetic '
+                        'scene if not given.')
+    parser.add_argument('--save_log', help='Write the synthetic views to this pose log.')
+    parser.add_argument('--num_cameras', type=int, default=4)
+    parser.add_argument('--people', type=int, default=5)
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--noise', type=float, default=1.0, help='Pixel noise.')
+    args = parser.parse_args()
+
+    cameras = load_cameras(args.cameras) if args.cameras else synthetic_cameras(args.num_cameras)
+    truth = None
+    if args.log:
+        synchronizer = FrameSynchronizer(len(cameras))
+        frames = []
+        for camera, timestamp, keypoints, keypoint_scores in read_log(args.log):
+            synced = synchronizer.add(camera, timestamp, (keypoints, keypoint_scores))
+            if synced:
+                frames.append(synced[1])
+    else:
+        rng = np.random.RandomState(0)
+        truth = synthetic_scene(args.people, args.frames)
+        frames = [synthetic_views(cameras, skeletons, rng, args.noise) for skeletons in truth]
+        if args.save_log:
+            with open(args.save_log, 'w') as f:
+                for number, views in enumerate(frames):
+                    for camera, (keypoints, keypoint_scores) in enumerate(views):
+                        write_log(f, camera, number / 30, keypoints, keypoint_scores)
+            save_cameras(args.save_log + '.cameras.json', cameras)
+
+    fusion = FusionEngine(cameras)
+    times = []
+    errors = []
+    people = []
+    for number, views in enumerate(frames):
+        start = time.perf_counter()
+        result = fusion.update(views)
+        times.append(time.perf_counter() - start)
+        people.append(len(result.track_ids))
+        if truth is not None and len(result.track_ids):
+            # Error of every fused person against the closest true skeleton.
+            centers = np.nanmean(result.points, axis=1)
+            true_centers = truth[number].mean(axis=1)
+            closest = np.argmin(np.linalg.norm(centers[:, np.newaxis] - true_centers, axis=2),
+                                axis=1)
+            errors.append(np.nanmean(np.linalg.norm(result.points - truth[number][closest],
+                                                    axis=2)))
+    print('%d cameras, %d frames: %.2f ms per frame (%.0f fps), %.1f people per frame, '
+          '%d tracks' % (len(cameras), len(frames), np.mean(times) * 1000,
+                         1 / np.mean(times), np.mean(people), fusion.tracker.next_pose_id))
+    if errors:
+        print('mean keypoint error %.1f cm' % (np.mean(errors) * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import multi_camera
+
+
+class MultiCameraTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cameras = multi_camera.synthetic_cameras(4)
+        self.truth = multi_camera.synthetic_scene(3, 20, seed=1)
+        self.rng = np.random.RandomState(0)
+
+    def test_camera_round_trip(self):
+        camera = self.cameras[1]
+        np.testing.assert_allclose(camera.project(camera.center + camera.R[2]),
+                                   np.array(camera.size) / 2, atol=1e-6)
+        self.assertTrue(np.isnan(camera.project(camera.center - camera.R[2])).all())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cameras.json')
+            multi_camera.save_cameras(path, self.cameras)
+            loaded = multi_camera.load_cameras(path)
+        self.assertEqual([c.name for c in loaded], [c.name for c in self.cameras])
+        np.testing.assert_allclose(loaded[2].project(self.truth[0]),
+                                   self.cameras[2].project(self.truth[0]), rtol=1e-6)
+
+    def test_epipolar_cost(self):
+        # Cameras 0 and 1 see people 1 and 2 on nearly one epipolar plane.
+        a, b = self.cameras[0], self.cameras[2]
+        pixels_a, pixels_b = a.project(self.truth[0]), b.project(self.truth[0])
+        scores = np.ones((3, 17))
+        cost = multi_camera.epipolar_cost(pixels_a, scores, pixels_b, scores,
+                                          multi_camera.fundamental_matrix(a, b))
+        self.assertEqual(cost.shape, (3, 3))
+        np.testing.assert_allclose(np.diag(cost), 0, atol=1e-6)
+        self.assertTrue((cost[~np.eye(3, dtype=bool)] > 20).all())
+        cost = multi_camera.epipolar_cost(pixels_a, np.zeros((3, 17)), pixels_b, scores,
+                                          multi_camera.fundamental_matrix(a, b))
+        self.assertTrue(np.isinf(cost).all())
+
+    def test_triangulate(self):
+        points = self.truth[0].reshape(-1, 3)
+        pixels = np.stack([camera.project(points) for camera in self.cameras], axis=1)
+        weights = np.ones(pixels.shape[:2])
+        weights[0, 1:] = 0  # Seen by one camera only.
+        solved = multi_camera.triangulate(self.cameras, pixels, weights)
+        self.assertTrue(np.isnan(solved[0]).all())
+        np.testing.assert_allclose(solved[1:], points[1:], atol=1e-6)
+
+    def test_associate(self):
+        views = multi_camera.synthetic_views(self.cameras, self.truth[0], self.rng, dropout=0)
+        people = multi_camera.associate(self.cameras, [k for k, _ in views],
+                                        [s for _, s in views])
+        self.assertEqual(people.shape, (3, 4))
+        for row in people:
+            # Every person's poses project from the same true skeleton.
+            owners = set()
+            for camera, pose in zip(self.cameras, row):
+                if pose >= 0:
+                    error = np.linalg.norm(camera.project(self.truth[0]) - views[
+                        self.cameras.index(camera)][0][pose], axis=2).mean(axis=1)
+                    owners.add(int(np.argmin(error)))
+            self.assertEqual(len(owners), 1)
+
+    def test_fusion(self):
+        fusion = multi_camera.FusionEngine(self.cameras)
+        ids = None
+        for skeletons in self.truth:
+            people = fusion.update(multi_camera.synthetic_views(self.cameras, skeletons, self.rng))
+            self.assertEqual(len(people.track_ids), 3)
+            # Within 5 cm of the true keypoints on average.
+            for points in people.points:
+                error = np.nanmean(np.linalg.norm(skeletons - points, axis=2), axis=1)
+                self.assertLess(error.min(), 0.05)
+            self.assertTrue((people.reprojection_error < 3).all())
+            ids = ids or sorted(people.track_ids)
+            self.assertEqual(sorted(people.track_ids), ids)
+
+    def test_empty_cameras(self):
+        fusion = multi_camera.FusionEngine(self.cameras)
+        views = [(np.zeros((0, 17, 2)), np.zeros((0, 17)))] * 4
+        self.assertEqual(len(fusion.update(views).track_ids), 0)
+        views[0] = multi_camera.synthetic_views(self.cameras, self.truth[0], self.rng)[0]
+        self.assertEqual(len(fusion.update(views).track_ids), 0)
+        with self.assertRaises(ValueError):
+            multi_camera.FusionEngine(self.cameras[:1])
+
+    def test_synchronizer(self):
+        synchronizer = multi_camera.FrameSynchronizer(2, tolerance=0.01)
+        self.assertIsNone(synchronizer.add(0, 1.0, 'a0'))
+        self.assertIsNone(synchronizer.add(0, 1.1, 'a1'))
+        # Camera 1 starts late: a0 is dropped.
+        self.assertEqual(synchronizer.add(1, 1.105, 'b1'), (1.105, ['a1', 'b1']))
+        self.assertEqual(synchronizer.dropped, 1)
+
+    def test_log_round_trip(self):
+        views = multi_camera.synthetic_views(self.cameras, self.truth[0], self.rng)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'poses.jsonl')
+            with open(path, 'w') as f:
+                for camera, (keypoints, keypoint_scores) in enumerate(views):
+                    multi_camera.write_log(f, camera, 0.5, keypoints, keypoint_scores)
+            records = list(multi_camera.read_log(path))
+        self.assertEqual([r[:2] for r in records], [(c, 0.5) for c in range(4)])
+        for (_, _, keypoints, keypoint_scores), (k, s) in zip(records, views):
+            np.testing.assert_allclose(keypoints, k, atol=0.01)
+            np.testing.assert_allclose(keypoint_scores, s, atol=0.001)
+
+
+if __name__ == '__main__':
+    unittest.main()
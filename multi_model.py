@@ -0,0 +1,341 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Running PoseNet and other models on the same frames, preprocessing once.
+
+Running a classifier next to PoseNet usually means decoding and resizing
+every frame twice, once in DetectPosesInImage and once for the classifier.
+A FramePipeline decodes a frame once, resizes it once per distinct model
+input size, and hands the same buffer to every model of that size; a frame
+that already has a model's input size, like the appsink buffers of the
+camera pipeline, is used as it is. Models then run concurrently, one thread
+per model, each on its own interpreter, and process() returns when all are
+done:
+
+    pipeline = multi_model.FramePipeline()
+    pipeline.add_model('pose', PoseEngine(pose_model))
+    pipeline.add_model('classes', TFLiteModel(classifier_model))
+    result = pipeline.process('/tmp/couple.jpg')
+    poses = result.outputs['pose']
+    scores = result.outputs['classes'][0]
+
+Models on the same Edge TPU are serialized by the driver; give every model
+its own device (PoseEngine and TFLiteModel take a device argument) for them
+to actually overlap. stats() reports the preprocessing time spent and an
+estimate of the time saved over preprocessing for every model on its own;
+main() measures both.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import time
+
+import numpy as np
+from PIL import Image
+from pycoral.utils import edgetpu
+
+import model_profiles
+from pose_engine import PoseEngine, input_array, make_interpreter
+
+FrameResult = collections.namedtuple('FrameResult', ['outputs', 'inference_ms',
+                                                     'preprocess_ms', 'total_ms'])
+FrameResult.__doc__ = """Joined results of all models on one frame.
+
+  outputs: Dict of model name to its parsed output.
+  inference_ms: Dict of model name to its inference and parsing time.
+  preprocess_ms: Time spent decoding and resizing the frame.
+  total_ms: Time process() took.
+"""
+
+PipelineStats = collections.namedtuple('PipelineStats', ['frames', 'preprocess_ms',
+                                                         'saved_ms', 'inference_ms'])
+PipelineStats.__doc__ = """Mean times per frame of a FramePipeline.
+
+  frames: Frames processed.
+  preprocess_ms: Decoding and resizing.
+  saved_ms: Estimated decoding and resizing saved by sharing, that is, the
+    time of every decode and resize times the number of other models that
+    would have repeated it.
+  inference_ms: Dict of model name to its inference and parsing time.
+"""
+
+
+class TFLiteModel:
+    """Any image model with a [1, height, width, 3] input, run like PoseEngine."""
+
+    def __init__(self, model_path, device=None, input_mean=127.5, input_std=127.5,
+                 dequantize=True):
+        """Creates the interpreter; Edge TPU models get the Edge TPU delegate.
+
+        Args:
+          model_path: String, path to TF-Lite Flatbuffer file.
+          device: Edge TPU to use, e.g. 'usb:0', any by default.
+          input_mean: Subtracted from pixels for float models.
+          input_std: Pixels of float models are divided by it.
+          dequantize: Whether outputs() converts quantized outputs to float.
+        """
+        self._interpreter = make_interpreter(model_path, decoder=False, device=device)
+        self._interpreter.allocate_tensors()
+        shape = self.get_input_tensor_shape()
+        if shape.size != 4 or shape[0] != 1 or shape[3] != 3:
+            raise ValueError('Image model should have input shape [1, height, width, 3]! '
+                             'This model has {}.'.format(shape))
+        self._input_type = self._interpreter.get_input_details()[0]['dtype']
+        self._input_mean = input_mean
+        self._input_std = input_std
+        self._dequantize = dequantize
+        self._inf_time = 0
+
+    def get_input_tensor_shape(self):
+        """Returns input tensor shape."""
+        return self._interpreter.get_input_details()[0]['shape']
+
+    def run_inference(self, input_data):
+        """Runs the model on a flat uint8 RGB buffer and returns the time in ms."""
+        start = time.monotonic()
+        if self._input_type == np.float32:
+            input_data = model_profiles.normalize_input(
+                input_array(input_data), self._input_mean, self._input_std)
+        edgetpu.run_inference(self._interpreter, input_data)
+        self._inf_time = time.monotonic() - start
+        return self._inf_time * 1000
+
+    def outputs(self):
+        """Returns copies of all output tensors, without the batch dimension."""
+        outputs = []
+        for detail in self._interpreter.get_output_details():
+            tensor = self._interpreter.get_tensor(detail['index'])[0]
+            scale, zero_point = detail['quantization']
+            if self._dequantize and scale:
+                tensor = np.float32(scale) * (tensor.astype(np.float32) - zero_point)
+            outputs.append(tensor)
+        return outputs
+
+
+def default_parse(model):
+    """Returns the poses of a pose engine or the output tensors of a TFLiteModel."""
+    if hasattr(model, 'ParseOutput'):
+        return model.ParseOutput()[0]
+    return model.outputs()
+
+
+class FramePipeline:
+    """Preprocesses frames once for several models and runs them concurrently."""
+
+    def __init__(self, draft=True):
+        """Creates an empty pipeline.
+
+        Args:
+          draft: Whether JPEG files may decode at a reduced scale that is still
+            at least the largest model input, see image_ingest.py.
+        """
+        self.draft = draft
+        self._models = collections.OrderedDict()  # name: (model, (width, height), parse)
+        self._executor = None
+        self._decode_time = 0.0
+        self._resize_times = {}
+        self.frames = 0
+        self._preprocess_time = 0.0
+        self._saved_time = 0.0
+        self._inference_time = collections.defaultdict(float)
+
+    def add_model(self, name, model, parse=default_parse):
+        """Registers a model.
+
+        Args:
+          name: Key of the model's output in FrameResult.outputs.
+          model: Object with get_input_tensor_shape() and run_inference(),
+            e.g. PoseEngine, TiledPoseEngine or TFLiteModel.
+          parse: Function of the model returning its output after
+            run_inference, default_parse by default.
+        """
+        if name in self._models:
+            raise ValueError('A model named %r is already registered.' % name)
+        _, height, width, _ = model.get_input_tensor_shape()
+        self._models[name] = (model, (int(width), int(height)), parse)
+        if self._executor:
+            self._executor.shutdown()
+        self._executor = concurrent.futures.ThreadPoolExecutor(len(self._models))
+
+    @property
+    def input_sizes(self):
+        """Distinct (width, height) model input sizes, largest first."""
+        sizes = {size for _, size, _ in self._models.values()}
+        return sorted(sizes, key=lambda size: size[0] * size[1], reverse=True)
+
+    def _decode(self, frame):
+        """Returns a frame as a PIL image or a [height, width, 3] array."""
+        if isinstance(frame, Image.Image):
+            return frame
+        if isinstance(frame, np.ndarray):
+            if frame.ndim != 3:
+                raise ValueError('Frames must be [height, width, 3] arrays, not %s.' % (
+                    frame.shape,))
+            return frame
+        image = Image.open(frame)
+        if self.draft and image.format == 'JPEG':
+            image.draft('RGB', self.input_sizes[0])
+        return image
+
+    def preprocess(self, frame):
+        """Decodes a frame once and resizes it once per model input size.
+
+        Args:
+          frame: Image path or file object, PIL image, or uint8 array
+            [height, width, 3].
+
+        Returns:
+          Dict of (width, height) to a flat uint8 RGB input tensor. A frame
+          already of that size is not copied.
+        """
+        start = time.monotonic()
+        frame = self._decode(frame)
+        if isinstance(frame, np.ndarray):
+            frame_size = (frame.shape[1], frame.shape[0])
+        else:
+            frame.load()
+            if frame.mode != 'RGB':
+                frame = frame.convert('RGB')
+            frame_size = frame.size
+        decoded = time.monotonic()
+        self._decode_time = decoded - start
+        self._resize_times = {}
+        inputs = {}
+        image = None
+        for size in self.input_sizes:
+            if size == frame_size and isinstance(frame, np.ndarray):
+                inputs[size] = np.ascontiguousarray(frame[..., :3]).reshape(-1)
+            else:
+                if image is None:
+                    image = frame if isinstance(frame, Image.Image) else Image.fromarray(
+                        np.ascontiguousarray(frame[..., :3]), 'RGB')
+                # The resize DetectPosesInImage does.
+                resized = image if image.size == size else image.resize(size, Image.NEAREST)
+                inputs[size] = np.asarray(resized).reshape(-1)
+            now = time.monotonic()
+            self._resize_times[size] = now - decoded
+            decoded = now
+        return inputs
+
+    def _run(self, name, input_data):
+        model, _, parse = self._models[name]
+        start = time.monotonic()
+        model.run_inference(input_data)
+        output = parse(model)
+        return output, (time.monotonic() - start) * 1000
+
+    def process(self, frame):
+        """Runs every model on a frame.
+
+        Args:
+          frame: Image path or file object, PIL image, or uint8 array
+            [height, width, 3].
+
+        Returns:
+          FrameResult.
+        """
+        if not self._models:
+            raise ValueError('No models, call add_model() first.')
+        start = time.monotonic()
+        inputs = self.preprocess(frame)
+        preprocessed = time.monotonic()
+        futures = collections.OrderedDict(
+            (name, self._executor.submit(self._run, name, inputs[size]))
+            for name, (_, size, _) in self._models.items())
+        outputs = {}
+        inference_ms = {}
+        for name, future in futures.items():
+            outputs[name], inference_ms[name] = future.result()
+        end = time.monotonic()
+
+        preprocess_time = preprocessed - start
+        self.frames += 1
+        self._preprocess_time += preprocess_time
+        # Without sharing, every model would decode the frame and resize it
+        # to its input size on its own.
+        sizes = [size for _, size, _ in self._models.values()]
+        self._saved_time += self._decode_time * (len(sizes) - 1) + sum(
+            seconds * (sizes.count(size) - 1) for size, seconds in self._resize_times.items())
+        for name, ms in inference_ms.items():
+            self._inference_time[name] += ms
+        return FrameResult(outputs, inference_ms, preprocess_time * 1000, (end - start) * 1000)
+
+    def stats(self):
+        """Returns PipelineStats."""
+        frames = max(self.frames, 1)
+        return PipelineStats(self.frames, self._preprocess_time * 1000 / frames,
+                             self._saved_time * 1000 / frames,
+                             {name: total / frames
+                              for name, total in self._inference_time.items()})
+
+    def close(self):
+        """Stops the worker threads."""
+        if self._executor:
+            self._executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--image', default='test_data/test_couple.jpg')
+    parser.add_argument('--pose_model', help='.tflite PoseNet model, defaults to the 641x481 '
+                        'Edge TPU model.')
+    parser.add_argument('--models', nargs='*', default=[
+        'models/mobilenet/components/posenet_mobilenet_v1_075_353_481_quant.tflite'],
+                        help='Other .tflite image models, e.g. a classifier.')
+    parser.add_argument('--frames', type=int, default=50)
+    args = parser.parse_args()
+
+    pose_model = (args.pose_model or
+                  model_profiles.closest_profile((640, 480)).model_path)
+    models = [('pose', PoseEngine(pose_model))]
+    models += [('model%d' % i, TFLiteModel(path)) for i, path in enumerate(args.models)]
+
+    # Every model decoding and resizing on its own, one after the other, as
+    # DetectPosesInImage does.
+    preprocess_time = 0.0
+    start = time.monotonic()
+    for _ in range(args.frames):
+        for _, model in models:
+            _, height, width, _ = model.get_input_tensor_shape()
+            preprocess_start = time.monotonic()
+            image = Image.open(args.image).convert('RGB')
+            input_data = np.asarray(image.resize((width, height), Image.NEAREST)).reshape(-1)
+            preprocess_time += time.monotonic() - preprocess_start
+            model.run_inference(input_data)
+            default_parse(model)
+    separate_total = (time.monotonic() - start) / args.frames
+
+    pipeline = FramePipeline()
+    for name, model in models:
+        pipeline.add_model(name, model)
+    start = time.monotonic()
+    for _ in range(args.frames):
+        pipeline.process(args.image)
+    shared_total = (time.monotonic() - start) / args.frames
+    pipeline.close()
+    stats = pipeline.stats()
+
+    print('%d models, input sizes %s, %d frames of %s' % (
+        len(models), pipeline.input_sizes, args.frames, args.image))
+    for name, ms in stats.inference_ms.items():
+        print('  %s: %.1f ms inference and parsing' % (name, ms))
+    print('Preprocessing per frame: %.1f ms separately, %.1f ms shared '
+          '(%.1f ms estimated saved by sharing)' % (
+              preprocess_time * 1000 / args.frames, stats.preprocess_ms, stats.saved_ms))
+    print('Total per frame: %.1f ms separately and one after the other, %.1f ms shared and '
+          'concurrent' % (separate_total * 1000, shared_total * 1000))
+
+
+if __name__ == '__main__':
+    main()
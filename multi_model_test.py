@@ -0,0 +1,126 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from multi_model import FramePipeline, TFLiteModel
+
+TEST_IMAGE = os.path.join('test_data', 'test_couple.jpg')
+BACKBONE = os.path.join('models', 'mobilenet', 'components',
+                        'posenet_mobilenet_v1_075_353_481_quant.tflite')
+
+
+class RecordingModel:
+    """Records its inputs and the threads it ran on; outputs the input mean."""
+
+    def __init__(self, size, delay=0.0):
+        self.size = size
+        self.delay = delay
+        self.inputs = []
+        self.threads = set()
+
+    def get_input_tensor_shape(self):
+        return np.array([1, self.size[1], self.size[0], 3])
+
+    def run_inference(self, input_data):
+        self.inputs.append(input_data)
+        self.threads.add(threading.get_ident())
+        time.sleep(self.delay)
+        return self.delay * 1000
+
+    def outputs(self):
+        return [float(self.inputs[-1].mean())]
+
+
+class FramePipelineTest(unittest.TestCase):
+
+    def test_shared_buffers(self):
+        pipeline = FramePipeline()
+        models = {'a': RecordingModel((64, 48)), 'b': RecordingModel((64, 48)),
+                  'c': RecordingModel((32, 24))}
+        for name, model in models.items():
+            pipeline.add_model(name, model)
+        self.assertEqual(pipeline.input_sizes, [(64, 48), (32, 24)])
+        frame = np.random.RandomState(0).randint(0, 256, (96, 128, 3), dtype=np.uint8)
+        result = pipeline.process(frame)
+        pipeline.close()
+        # One resize per size, shared by the models of that size.
+        self.assertIs(models['a'].inputs[0], models['b'].inputs[0])
+        self.assertEqual(models['c'].inputs[0].size, 32 * 24 * 3)
+        expected = np.asarray(Image.fromarray(frame).resize((64, 48), Image.NEAREST))
+        np.testing.assert_array_equal(models['a'].inputs[0], expected.reshape(-1))
+        self.assertEqual(set(result.outputs), {'a', 'b', 'c'})
+        self.assertAlmostEqual(result.outputs['a'][0], expected.mean())
+        stats = pipeline.stats()
+        self.assertEqual(stats.frames, 1)
+        self.assertGreater(stats.saved_ms, 0)
+        self.assertEqual(set(stats.inference_ms), {'a', 'b', 'c'})
+
+    def test_frame_of_input_size_is_not_copied(self):
+        pipeline = FramePipeline()
+        model = RecordingModel((64, 48))
+        pipeline.add_model('pose', model)
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        pipeline.process(frame)
+        pipeline.close()
+        self.assertTrue(np.shares_memory(model.inputs[0], frame))
+
+    def test_models_run_concurrently(self):
+        pipeline = FramePipeline()
+        models = [RecordingModel((32, 24), delay=0.1) for _ in range(4)]
+        for i, model in enumerate(models):
+            pipeline.add_model('model%d' % i, model)
+        start = time.monotonic()
+        result = pipeline.process(np.zeros((24, 32, 3), dtype=np.uint8))
+        elapsed = time.monotonic() - start
+        pipeline.close()
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual(len(set.union(*(model.threads for model in models))), 4)
+        self.assertGreaterEqual(min(result.inference_ms.values()), 100)
+
+    def test_files_and_errors(self):
+        pipeline = FramePipeline()
+        model = RecordingModel((481, 353))
+        pipeline.add_model('pose', model)
+        with self.assertRaises(ValueError):
+            pipeline.add_model('pose', model)
+        pipeline.process(TEST_IMAGE)
+        with Image.open(TEST_IMAGE) as image:
+            full = np.asarray(image.convert('RGB').resize((481, 353), Image.NEAREST))
+        # Draft mode decodes at a quarter of the size, close to a full decode.
+        self.assertLess(np.abs(model.inputs[0].astype(int) - full.reshape(-1)).mean(), 10)
+        pipeline.close()
+        with self.assertRaises(ValueError):
+            FramePipeline().process(TEST_IMAGE)
+
+    def test_tflite_model(self):
+        model = TFLiteModel(BACKBONE)
+        np.testing.assert_array_equal(model.get_input_tensor_shape(), [1, 353, 481, 3])
+        pipeline = FramePipeline()
+        pipeline.add_model('backbone', model)
+        outputs = pipeline.process(TEST_IMAGE).outputs['backbone']
+        pipeline.close()
+        # Heatmaps, short and mid range offsets of the 17 keypoints.
+        self.assertEqual([output.shape[-1] for output in outputs], [17, 34, 64])
+        self.assertTrue(all(output.dtype == np.float32 for output in outputs))
+
+
+if __name__ == '__main__':
+    unittest.main()
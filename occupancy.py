@@ -0,0 +1,237 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Zone people counting and dwell heatmaps.
+
+Every person is reduced to a foot position (the visible ankles, in source
+image coordinates) which is looked up in a raster of the zones, precomputed
+at heatmap resolution with one bit per zone. Per frame this costs a handful
+of vectorized array operations regardless of how complex the zone polygons
+are. Snapshots of the counters can be written to disk periodically from a
+background thread so that the render loop never waits for file I/O.
+"""
+
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from pose_engine import KeypointType, inference_to_source, poses_to_arrays
+from pose_events import points_in_polygon
+
+MAX_ZONES = 64
+
+# Longest gap between frames credited to dwell time, in seconds.
+MAX_FRAME_INTERVAL = 1.0
+
+Snapshot = collections.namedtuple(
+    'Snapshot', ['timestamp', 'counts', 'peak_counts', 'dwell_seconds', 'heatmap'])
+Snapshot.__doc__ = """Copy of the occupancy counters at one point in time.
+
+  timestamp: Time of the last frame.
+  counts: Dict of zone name to number of people in the zone in the last frame.
+  peak_counts: Dict of zone name to the highest count seen.
+  dwell_seconds: Dict of zone name to accumulated person-seconds.
+  heatmap: [H, W] float32 person-seconds spent in every heatmap cell.
+"""
+
+
+def foot_positions(keypoints, keypoint_scores, threshold=0.2):
+    """Returns the [N, 2] mean of the visible ankles, NaN if none is visible."""
+    ankles = [KeypointType.LEFT_ANKLE, KeypointType.RIGHT_ANKLE]
+    visible = keypoint_scores[:, ankles] >= threshold
+    count = visible.sum(axis=1)
+    total = (keypoints[:, ankles] * visible[..., np.newaxis]).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / count[:, np.newaxis]
+
+
+class OccupancyMap:
+    """Per-zone people counts and a downsampled dwell heatmap."""
+
+    def __init__(self, zones, src_size, cell_size=8, threshold=0.2):
+        """Creates an occupancy map.
+
+        Args:
+          zones: Dict of zone name to polygon, a sequence of (x, y) vertices in
+            source image coordinates. Zones may overlap.
+          src_size: (width, height) of the source image.
+          cell_size: Heatmap and zone raster cell size, in source pixels.
+          threshold: Keypoints scoring below this are ignored.
+
+        Raises:
+          ValueError: If there are more than MAX_ZONES zones.
+        """
+        if len(zones) > MAX_ZONES:
+            raise ValueError('At most {} zones are supported, got {}.'.format(
+                MAX_ZONES, len(zones)))
+        self.zone_names = list(zones)
+        self.src_size = src_size
+        self.cell_size = cell_size
+        self.threshold = threshold
+
+        width = -(-src_size[0] // cell_size)
+        height = -(-src_size[1] // cell_size)
+        xs = (np.arange(width, dtype=np.float32) + 0.5) * cell_size
+        ys = (np.arange(height, dtype=np.float32) + 0.5) * cell_size
+        centers = np.stack(np.meshgrid(xs, ys), axis=-1)
+        self._zone_raster = np.zeros((height, width), dtype=np.uint64)
+        for bit, polygon in enumerate(zones.values()):
+            inside = points_in_polygon(centers, polygon)
+            self._zone_raster[inside] |= np.uint64(1 << bit)
+        self._bits = np.uint64(1) << np.arange(len(zones), dtype=np.uint64)
+
+        self.heatmap = np.zeros((height, width), dtype=np.float32)
+        self.counts = np.zeros(len(zones), dtype=np.int64)
+        self.peak_counts = np.zeros(len(zones), dtype=np.int64)
+        self.dwell_seconds = np.zeros(len(zones), dtype=np.float64)
+        self.timestamp = None
+
+    def update(self, poses, inference_box, timestamp=None):
+        """Same as update_arrays but takes a list of Pose."""
+        keypoints, keypoint_scores, _ = poses_to_arrays(poses)
+        self.update_arrays(keypoints, keypoint_scores, inference_box, timestamp)
+
+    def update_arrays(self, keypoints, keypoint_scores, inference_box, timestamp=None):
+        """Accounts for the poses of a new frame.
+
+        Args:
+          keypoints: [N, 17, 2] keypoints in inference tensor coordinates.
+          keypoint_scores: [N, 17] keypoint scores.
+          inference_box: Source image box inside the inference tensor, as
+            passed to render callbacks.
+          timestamp: Time of the frame in seconds, defaults to time.monotonic().
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        interval = 0.0
+        if self.timestamp is not None:
+            interval = min(max(timestamp - self.timestamp, 0.0), MAX_FRAME_INTERVAL)
+        self.timestamp = timestamp
+
+        feet = foot_positions(keypoints, keypoint_scores, self.threshold)
+        feet = inference_to_source(feet, self.src_size, inference_box)
+        with np.errstate(invalid='ignore'):
+            cells = np.floor(feet / self.cell_size)
+            height, width = self.heatmap.shape
+            valid = ((cells[:, 0] >= 0) & (cells[:, 0] < width) &
+                     (cells[:, 1] >= 0) & (cells[:, 1] < height))
+        cells = cells[valid].astype(np.int64)
+        flat = cells[:, 1] * width + cells[:, 0]
+
+        masks = self._zone_raster.ravel()[flat]
+        self.counts = ((masks[:, np.newaxis] & self._bits) != 0).sum(axis=0)
+        np.maximum(self.peak_counts, self.counts, out=self.peak_counts)
+        self.dwell_seconds += self.counts * interval
+        if interval:
+            np.add.at(self.heatmap.reshape(-1), flat, np.float32(interval))
+
+    def zone_counts(self):
+        """Returns a dict of zone name to people in the zone in the last frame."""
+        return dict(zip(self.zone_names, self.counts.tolist()))
+
+    def snapshot(self):
+        """Returns a Snapshot of the current counters."""
+        return Snapshot(self.timestamp, self.zone_counts(),
+                        dict(zip(self.zone_names, self.peak_counts.tolist())),
+                        dict(zip(self.zone_names, self.dwell_seconds.tolist())),
+                        self.heatmap.copy())
+
+    def reset(self):
+        """Clears the peak counts, dwell times and heatmap."""
+        self.heatmap[:] = 0
+        self.peak_counts[:] = 0
+        self.dwell_seconds[:] = 0
+
+
+class SnapshotWriter:
+    """Periodically writes OccupancyMap snapshots from a background thread.
+
+    Call maybe_write from the render callback after every update. Every
+    `interval` seconds it takes a snapshot, which is a copy of a few small
+    arrays, and hands it to the writer thread. Every snapshot is written as
+    occupancy_<time>_<n>.json with the zone counters and
+    occupancy_<time>_<n>.npy with the heatmap, where time is the wall clock
+    time in ms and n counts snapshots. If the disk falls behind,
+    snapshots are dropped rather than queued without bound.
+    """
+
+    def __init__(self, occupancy_map, directory, interval=60.0, reset=False, max_pending=4):
+        """Creates a writer and starts its thread.
+
+        Args:
+          occupancy_map: OccupancyMap to snapshot.
+          directory: Directory to write snapshots to, created if missing.
+          interval: Seconds between snapshots.
+          reset: Whether to reset the map after each snapshot, making every
+            snapshot cover a single interval instead of everything so far.
+          max_pending: Snapshots allowed to wait for the writer thread.
+        """
+        self.occupancy_map = occupancy_map
+        self.directory = directory
+        self.interval = interval
+        self.reset = reset
+        self.dropped = 0
+        self._count = 0
+        self._last_write = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def maybe_write(self, timestamp=None):
+        """Queues a snapshot if interval has passed since the last one."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self._last_write is None:
+            self._last_write = timestamp
+        if timestamp - self._last_write < self.interval:
+            return
+        self._last_write = timestamp
+        self.write()
+
+    def write(self):
+        """Queues a snapshot now."""
+        snapshot = self.occupancy_map.snapshot()
+        if self.reset:
+            self.occupancy_map.reset()
+        try:
+            self._queue.put_nowait((time.time(), self._count, snapshot))
+            self._count += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Writes pending snapshots and stops the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            wall_time, count, snapshot = item
+            name = os.path.join(self.directory,
+                                'occupancy_%d_%06d' % (int(wall_time * 1000), count))
+            np.save(name + '.npy', snapshot.heatmap)
+            with open(name + '.json', 'w') as f:
+                json.dump({'time': wall_time,
+                           'counts': snapshot.counts,
+                           'peak_counts': snapshot.peak_counts,
+                           'dwell_seconds': snapshot.dwell_seconds,
+                           'cell_size': self.occupancy_map.cell_size}, f)
@@ -0,0 +1,82 @@
+# Lint as: python3
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from pose_engine import KeypointType
+import occupancy
+
+ZONES = {
+    'left': [(0, 0), (320, 0), (320, 480), (0, 480)],
+    'all': [(0, 0), (640, 0), (640, 480), (0, 480)],
+    'corner': [(600, 440), (640, 440), (640, 480), (600, 480)],
+}
+
+
+def people(feet, scores=1.0):
+    keypoints = np.zeros((len(feet), 17, 2), dtype=np.float32)
+    keypoints[:, KeypointType.LEFT_ANKLE] = feet
+    keypoints[:, KeypointType.RIGHT_ANKLE] = feet
+    return keypoints, np.full((len(feet), 17), scores, dtype=np.float32)
+
+
+class OccupancyMapTest(unittest.TestCase):
+
+    def test_counts_and_dwell(self):
+        occupancy_map = occupancy.OccupancyMap(ZONES, (640, 480))
+        box = (0, 0, 640, 480)
+        occupancy_map.update_arrays(*people([(10, 10), (400, 10)]), box, timestamp=0.0)
+        self.assertEqual(occupancy_map.zone_counts(), {'left': 1, 'all': 2, 'corner': 0})
+        occupancy_map.update_arrays(*people([(630, 470)]), box, timestamp=0.5)
+        self.assertEqual(occupancy_map.zone_counts(), {'left': 0, 'all': 1, 'corner': 1})
+
+        snapshot = occupancy_map.snapshot()
+        self.assertEqual(snapshot.peak_counts, {'left': 1, 'all': 2, 'corner': 1})
+        self.assertAlmostEqual(snapshot.dwell_seconds['corner'], 0.5)
+        self.assertAlmostEqual(snapshot.heatmap.sum(), 0.5)
+        self.assertEqual(snapshot.heatmap[470 // 8, 630 // 8], 0.5)
+
+    def test_inference_box_and_invisible_feet(self):
+        occupancy_map = occupancy.OccupancyMap(ZONES, (640, 480))
+        # Source image scaled to half size inside the inference tensor.
+        box = (0, 0, 320, 240)
+        occupancy_map.update_arrays(*people([(310, 230)]), box, timestamp=0.0)
+        self.assertEqual(occupancy_map.zone_counts()['corner'], 1)
+        occupancy_map.update_arrays(*people([(310, 230)], scores=0.0), box, timestamp=1.0)
+        self.assertEqual(occupancy_map.zone_counts()['all'], 0)
+
+    def test_snapshot_writer(self):
+        occupancy_map = occupancy.OccupancyMap(ZONES, (640, 480))
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = occupancy.SnapshotWriter(occupancy_map, tmp, interval=1.0, reset=True)
+            for t in range(5):
+                occupancy_map.update_arrays(*people([(10, 10)]), (0, 0, 640, 480), timestamp=t)
+                writer.maybe_write(timestamp=t)
+            writer.close()
+            files = sorted(glob.glob(os.path.join(tmp, '*.json')))
+            self.assertEqual(len(files), 4)
+            with open(files[-1]) as f:
+                self.assertEqual(json.load(f)['dwell_seconds']['left'], 1.0)
+            self.assertEqual(len(glob.glob(os.path.join(tmp, '*.npy'))), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
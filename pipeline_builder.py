@@ -0,0 +1,255 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Assembles the camera pipeline element by element, per platform.
+
+The pipeline has a source branch feeding a tee and up to three branches
+behind it: display, inference and recording. On the CPU platform frames are
+scaled and letterboxed with videoscale and videobox; on the Coral Dev Board
+('gl') they stay in GL memory and glbox does both on the GPU.
+
+    builder = pipeline_builder.PipelineBuilder((640, 480), (641, 481), 'cpu')
+    builder.add_source('/dev/video0')
+    builder.add_display()
+    builder.add_inference()
+    description = builder.build()  # For Gst.parse_launch.
+    for line in builder.report():
+        print(line)
+
+The model input tensor must be tightly packed. GStreamer pads every row of
+packed RGB to a multiple of 4 bytes, so appsink buffers of widths that are
+not a multiple of 4, like the 641, 481 and 1281 of the PoseNet models, need
+a repacking copy per frame; report() says which path every branch takes.
+"""
+
+import collections
+
+PLATFORMS = ('cpu', 'gl')
+# GStreamer aligns rows of packed video formats to 4 bytes.
+ROW_ALIGNMENT = 4
+RGB_BYTES = 3
+
+LEAKY_QUEUE = dict(max_size_buffers=1, leaky='downstream')
+
+BranchPath = collections.namedtuple('BranchPath', ['branch', 'path', 'detail'])
+BranchPath.__doc__ = """How frames travel through one branch.
+
+  branch: 'display', 'inference' or 'recorder'.
+  path: Short name of the path, e.g. 'zero-copy' or 'copy'.
+  detail: One line explanation.
+"""
+
+
+def row_stride(width, bytes_per_pixel=RGB_BYTES):
+    """Returns the bytes per row GStreamer uses for a packed video format."""
+    return -(-width * bytes_per_pixel // ROW_ALIGNMENT) * ROW_ALIGNMENT
+
+
+def is_tightly_packed(width, bytes_per_pixel=RGB_BYTES):
+    """Whether rows of this width have no padding."""
+    return row_stride(width, bytes_per_pixel) == width * bytes_per_pixel
+
+
+def aligned_width(width, bytes_per_pixel=RGB_BYTES):
+    """Returns the smallest width >= width whose rows have no padding."""
+    while not is_tightly_packed(width, bytes_per_pixel):
+        width += 1
+    return width
+
+
+def scale_size(src_size, inference_size):
+    """Returns the size src_size is scaled to, to fit into inference_size."""
+    scale = min(inference_size[0] / src_size[0], inference_size[1] / src_size[1])
+    return tuple(int(x * scale) for x in src_size)
+
+
+class Element:
+    """One element of a launch description: factory, name and properties."""
+
+    def __init__(self, factory, name=None, **properties):
+        self.factory = factory
+        self.name = name
+        # Python names, e.g. max_size_buffers for max-size-buffers.
+        self.properties = {key.replace('_', '-'): value for key, value in properties.items()}
+
+    def __str__(self):
+        parts = [self.factory]
+        if self.name:
+            parts.append('name=%s' % self.name)
+        for key, value in self.properties.items():
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            elif isinstance(value, str) and (',' in value or ' ' in value):
+                value = '"%s"' % value
+            parts.append('%s=%s' % (key, value))
+        return ' '.join(parts)
+
+
+def caps(caps_string, name=None):
+    """Returns a capsfilter Element."""
+    return Element('capsfilter', name, caps=caps_string)
+
+
+class PipelineBuilder:
+    """Builds the launch description of the camera pipeline."""
+
+    def __init__(self, src_size, inference_size, platform='cpu'):
+        """Creates a builder.
+
+        Args:
+          src_size: (width, height) of the camera frames.
+          inference_size: (width, height) of the model input.
+          platform: 'cpu' for generic GStreamer elements, 'gl' for the GL
+            elements of the Coral Dev Board.
+        """
+        if platform not in PLATFORMS:
+            raise ValueError('Unknown platform %r, expected one of %s.' % (platform, PLATFORMS))
+        self.src_size = tuple(src_size)
+        self.inference_size = tuple(inference_size)
+        self.platform = platform
+        self.source = None
+        self.branches = collections.OrderedDict()
+        self.paths = []
+
+    def add_source(self, videosrc='/dev/video0', h264=False, jpeg=False, mirror=False,
+                   rate_control=False):
+        """Sets the camera or test source feeding the tee.
+
+        Args:
+          videosrc: V4L2 device or 'videotestsrc'.
+          h264: Whether the camera sends H.264.
+          jpeg: Whether the camera sends JPEG.
+          mirror: Whether to flip frames horizontally.
+          rate_control: Whether to add the videorate element 'rate' the
+            load controller lowers the frame rate with.
+        """
+        if h264:
+            media = 'video/x-h264'
+        elif jpeg:
+            media = 'image/jpeg'
+        else:
+            media = 'video/x-raw'
+        if videosrc == 'videotestsrc':
+            elements = [Element('videotestsrc', is_live=True, pattern='ball')]
+        else:
+            elements = [Element('v4l2src', device=videosrc)]
+        elements += [caps('%s,width=%d,height=%d,framerate=30/1' % ((media,) + self.src_size)),
+                     Element('decodebin')]
+        if rate_control:
+            # Only drops frames when the load controller lowers max-rate.
+            elements.append(Element('videorate', 'rate', drop_only=True, max_rate=30))
+        direction = 'horiz' if mirror else 'identity'
+        if self.platform == 'gl':
+            elements += [Element('glupload'), Element('glvideoflip', video_direction=direction)]
+        else:
+            elements.append(Element('videoflip', video_direction=direction))
+        self.source = elements
+        return self
+
+    def add_display(self, overlay='svg'):
+        """Adds the branch showing frames with the poses drawn over them.
+
+        Args:
+          overlay: 'svg' for SVG from the render callback, 'direct' for
+            pose_overlay.Overlay drawn in place by poseoverlay (CPU only).
+        """
+        queue = Element('queue', 'overlay_queue', **LEAKY_QUEUE)
+        if self.platform == 'gl':
+            if overlay != 'svg':
+                raise ValueError('The GL pipeline only draws SVG overlays.')
+            # freezer only passes buffers on, it works on GL memory too.
+            self.branches['display'] = [queue, Element('freezer', 'freezer'),
+                                        Element('glsvgoverlaysink', 'overlaysink')]
+            self.paths.append(BranchPath('display', 'gl', 'glsvgoverlaysink composites the SVG '
+                                         'on the GPU, frames stay in GL memory'))
+            return self
+        if overlay == 'svg':
+            element = Element('rsvgoverlay', 'overlay')
+            self.paths.append(BranchPath('display', 'svg', 'rsvgoverlay parses and rasterizes '
+                                         'the SVG of every frame'))
+        elif overlay == 'direct':
+            element = Element('poseoverlay', 'overlay')
+            self.paths.append(BranchPath('display', 'in-place', 'poseoverlay draws poses into '
+                                         'the frames, no copy'))
+        else:
+            raise ValueError('Unknown overlay %r.' % overlay)
+        self.branches['display'] = [queue, Element('videoconvert'), Element('freezer', 'freezer'),
+                                    element, Element('videoconvert'), Element('autovideosink')]
+        return self
+
+    def add_inference(self):
+        """Adds the branch scaling and letterboxing frames into the appsink."""
+        width, height = self.inference_size
+        sink_caps = 'video/x-raw,format=RGB,width=%d,height=%d' % (width, height)
+        queue = Element('queue', 'inference_queue', **LEAKY_QUEUE)
+        sink = Element('appsink', 'appsink', emit_signals=True, max_buffers=1, drop=True)
+        if self.platform == 'gl':
+            # glbox scales and pads on the GPU; GL downloads are tightly packed.
+            self.branches['inference'] = [queue, Element('glfilterbin', 'glbox', filter='glbox'),
+                                          caps(sink_caps, 'sinkcaps'), sink]
+            self.paths.append(BranchPath('inference', 'zero-copy', 'glbox %dx%d RGB, rows of '
+                                         '%d bytes' % (width, height, width * RGB_BYTES)))
+            return self
+        scaled = scale_size(self.src_size, self.inference_size)
+        self.branches['inference'] = [
+            queue, Element('videoconvert'), Element('videoscale'),
+            caps('video/x-raw,width=%d,height=%d' % scaled, 'scalecaps'),
+            Element('videobox', 'box', autocrop=True), caps(sink_caps, 'sinkcaps'), sink]
+        self.paths.append(self.inference_path())
+        return self
+
+    def inference_path(self, inference_size=None):
+        """Returns the BranchPath of the CPU inference branch for a model size."""
+        width, height = inference_size or self.inference_size
+        stride = row_stride(width)
+        if stride == width * RGB_BYTES:
+            return BranchPath('inference', 'zero-copy', 'appsink %dx%d RGB, rows of %d bytes, '
+                              'buffers go to the model as they are' % (width, height, stride))
+        return BranchPath('inference', 'copy', 'appsink %dx%d RGB, rows of %d bytes padded to '
+                          '%d, one repacking copy of %d bytes per frame; models %d pixels wide '
+                          'would avoid it' % (width, height, width * RGB_BYTES, stride,
+                                              width * height * RGB_BYTES, aligned_width(width)))
+
+    def add_recorder(self):
+        """Adds the H.264 branch of recorder.EventRecorder.
+
+        One access unit per buffer and SPS/PPS with every keyframe, so that
+        any segment can be decoded.
+        """
+        elements = [Element('queue', max_size_buffers=30, leaky='downstream')]
+        if self.platform == 'gl':
+            elements.append(Element('gldownload'))
+        elements += [Element('videoconvert'),
+                     Element('x264enc', tune='zerolatency', speed_preset='ultrafast',
+                             key_int_max=30),
+                     Element('h264parse', config_interval=-1),
+                     caps('video/x-h264,stream-format=byte-stream,alignment=au'),
+                     Element('appsink', 'recsink', emit_signals=True, sync=False,
+                             max_buffers=30)]
+        self.branches['recorder'] = elements
+        self.paths.append(BranchPath('recorder', 'encode', 'x264enc, one access unit per buffer'))
+        return self
+
+    def build(self):
+        """Returns the launch description for Gst.parse_launch."""
+        if not self.source:
+            raise ValueError('No source, call add_source() first.')
+        lines = [' ! '.join(str(e) for e in self.source + [Element('tee', 't')])]
+        for elements in self.branches.values():
+            lines.append('t. ! ' + ' ! '.join(str(e) for e in elements))
+        return '\n'.join(lines)
+
+    def report(self):
+        """Returns one line per branch saying which path its frames take."""
+        return ['%s (%s): %s: %s' % (path.branch, self.platform, path.path, path.detail)
+                for path in self.paths]
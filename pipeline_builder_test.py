@@ -0,0 +1,100 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import pipeline_builder
+from pipeline_builder import Element, PipelineBuilder
+
+
+def factories(branch):
+    return [element.split()[0] for element in branch.split(' ! ')]
+
+
+class PipelineBuilderTest(unittest.TestCase):
+
+    def test_strides(self):
+        self.assertEqual(pipeline_builder.row_stride(641), 1924)
+        self.assertEqual(pipeline_builder.row_stride(640), 1920)
+        self.assertEqual(pipeline_builder.row_stride(641, bytes_per_pixel=4), 2564)
+        self.assertFalse(pipeline_builder.is_tightly_packed(481))
+        self.assertTrue(pipeline_builder.is_tightly_packed(1280))
+        self.assertEqual([pipeline_builder.aligned_width(w) for w in (481, 641, 1281, 640)],
+                         [484, 644, 1284, 640])
+
+    def test_element(self):
+        self.assertEqual(str(Element('queue', 'q', max_size_buffers=1, leaky='downstream')),
+                         'queue name=q max-size-buffers=1 leaky=downstream')
+        self.assertEqual(str(pipeline_builder.caps('video/x-raw,width=2', 'c')),
+                         'capsfilter name=c caps="video/x-raw,width=2"')
+        self.assertEqual(str(Element('appsink', sync=False)), 'appsink sync=false')
+
+    def test_cpu_pipeline(self):
+        builder = PipelineBuilder((640, 480), (641, 481))
+        builder.add_source('/dev/video1', mirror=True, rate_control=True)
+        builder.add_display()
+        builder.add_inference()
+        builder.add_recorder()
+        source, display, inference, recorder = builder.build().split('\n')
+        self.assertEqual(factories(source), ['v4l2src', 'capsfilter', 'decodebin', 'videorate',
+                                             'videoflip', 'tee'])
+        self.assertIn('device=/dev/video1', source)
+        self.assertIn('video-direction=horiz', source)
+        self.assertEqual(factories(display), ['t.', 'queue', 'videoconvert', 'freezer',
+                                              'rsvgoverlay', 'videoconvert', 'autovideosink'])
+        self.assertEqual(factories(inference), ['t.', 'queue', 'videoconvert', 'videoscale',
+                                                'capsfilter', 'videobox', 'capsfilter', 'appsink'])
+        self.assertIn('caps="video/x-raw,width=641,height=480"', inference)
+        self.assertIn('caps="video/x-raw,format=RGB,width=641,height=481"', inference)
+        self.assertIn('appsink name=recsink', recorder)
+        self.assertEqual([(p.branch, p.path) for p in builder.paths],
+                         [('display', 'svg'), ('inference', 'copy'), ('recorder', 'encode')])
+        self.assertIn('644', builder.paths[1].detail)
+        self.assertEqual(len(builder.report()), 3)
+
+    def test_zero_copy_sizes(self):
+        builder = PipelineBuilder((1280, 720), (1280, 720))
+        self.assertEqual(builder.inference_path().path, 'zero-copy')
+        self.assertEqual(builder.inference_path((481, 353)).path, 'copy')
+
+    def test_gl_pipeline(self):
+        builder = PipelineBuilder((1280, 720), (1281, 721), platform='gl')
+        builder.add_source('videotestsrc')
+        builder.add_display()
+        builder.add_inference()
+        source, display, inference = builder.build().split('\n')
+        self.assertEqual(factories(source), ['videotestsrc', 'capsfilter', 'decodebin',
+                                             'glupload', 'glvideoflip', 'tee'])
+        self.assertEqual(factories(display), ['t.', 'queue', 'freezer', 'glsvgoverlaysink'])
+        self.assertIn('glfilterbin name=glbox filter=glbox', inference)
+        self.assertNotIn('scalecaps', inference)
+        self.assertEqual(builder.paths[1].path, 'zero-copy')
+        with self.assertRaises(ValueError):
+            builder.add_display('direct')
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            PipelineBuilder((640, 480), (641, 481), platform='tpu')
+        builder = PipelineBuilder((640, 480), (641, 481))
+        with self.assertRaises(ValueError):
+            builder.build()
+        with self.assertRaises(ValueError):
+            builder.add_display('png')
+        builder.add_source()
+        builder.add_display('direct')
+        self.assertIn('poseoverlay name=overlay', builder.build())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,33 +20,21 @@ import time
 
 import numpy as np
 from PIL import Image
-import svgwrite
-import gstreamer
+import load_controller
+import metrics
+import model_profiles
 
 from pose_engine import PoseEngine
-from pose_engine import KeypointType
-
-EDGES = (
-    (KeypointType.NOSE, KeypointType.LEFT_EYE),
-    (KeypointType.NOSE, KeypointType.RIGHT_EYE),
-    (KeypointType.NOSE, KeypointType.LEFT_EAR),
-    (KeypointType.NOSE, KeypointType.RIGHT_EAR),
-    (KeypointType.LEFT_EAR, KeypointType.LEFT_EYE),
-    (KeypointType.RIGHT_EAR, KeypointType.RIGHT_EYE),
-    (KeypointType.LEFT_EYE, KeypointType.RIGHT_EYE),
-    (KeypointType.LEFT_SHOULDER, KeypointType.RIGHT_SHOULDER),
-    (KeypointType.LEFT_SHOULDER, KeypointType.LEFT_ELBOW),
-    (KeypointType.LEFT_SHOULDER, KeypointType.LEFT_HIP),
-    (KeypointType.RIGHT_SHOULDER, KeypointType.RIGHT_ELBOW),
-    (KeypointType.RIGHT_SHOULDER, KeypointType.RIGHT_HIP),
-    (KeypointType.LEFT_ELBOW, KeypointType.LEFT_WRIST),
-    (KeypointType.RIGHT_ELBOW, KeypointType.RIGHT_WRIST),
-    (KeypointType.LEFT_HIP, KeypointType.RIGHT_HIP),
-    (KeypointType.LEFT_HIP, KeypointType.LEFT_KNEE),
-    (KeypointType.RIGHT_HIP, KeypointType.RIGHT_KNEE),
-    (KeypointType.LEFT_KNEE, KeypointType.LEFT_ANKLE),
-    (KeypointType.RIGHT_KNEE, KeypointType.RIGHT_ANKLE),
-)
+from pose_engine import ParsedOutput, inference_to_source
+from pose_overlay import EDGES, Overlay
+from pose_publisher import PosePublisher, parse_address
+from recorder import EventRecorder
+from scene_gate import SceneGate
+from tiled_pose import TiledPoseEngine
+
+PARSE_MS = metrics.REGISTRY.histogram('posenet_parse_output_ms', 'ParseOutput time.')
+POSES = metrics.REGISTRY.histogram('posenet_poses_per_frame', 'Poses per frame.',
+                                   buckets=metrics.COUNT_BUCKETS)
 
 
 def shadow_text(dwg, x, y, text, font_size=16):
@@ -89,46 +77,204 @@ def avg_fps_counter(window_size):
         yield len(window) / sum(window)
 
 
-def run(inf_callback, render_callback):
-    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+def run(inf_callback, render_callback, parents=(), returns_overlay=False):
+    """Runs the camera pipeline with the given callbacks.
+
+    Args:
+      inf_callback: Called as inf_callback(engine, input_tensor).
+      render_callback: Called as render_callback(engine, output, src_size,
+        inference_box), returns (overlay, freeze).
+      parents: argparse parsers whose options are added to the command line.
+      returns_overlay: Whether render_callback returns pose_overlay.Overlay,
+        which --overlay direct needs, rather than SVG.
+    """
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     parents=list(parents))
     parser.add_argument('--mirror', help='flip video horizontally', action='store_true')
     parser.add_argument('--model', help='.tflite model path.', required=False)
+    parser.add_argument('--profile', help='Model profile name, see model_profiles.py.',
+                        choices=list(model_profiles.PROFILES))
+    parser.add_argument('--arch', help='Architecture of the default model.',
+                        default='mobilenet', choices=['mobilenet', 'resnet'])
+    parser.add_argument('--cpu', help='Use the CPU version of the default model.',
+                        action='store_true')
     parser.add_argument('--res', help='Resolution', default='640x480',
                         choices=['480x360', '640x480', '1280x720'])
+    parser.add_argument('--tiled', action='store_true',
+                        help='Infer overlapping tiles of the full camera frame '
+                        'instead of downscaling it to the model input.')
     parser.add_argument('--videosrc', help='Which video source to use', default='/dev/video0')
     parser.add_argument('--h264', help='Use video/x-h264 input', action='store_true')
     parser.add_argument('--jpeg', help='Use image/jpeg input', action='store_true')
+    parser.add_argument('--target_latency_ms', type=float,
+                        help='Shed load to hold this end-to-end latency.')
+    parser.add_argument('--target_fps', type=float,
+                        help='Shed load to hold this frame rate.')
+    parser.add_argument('--publish', metavar='ADDRESS',
+                        help='Publish poses on this Unix socket path or host:port.')
+    parser.add_argument('--inference_delay_ms', type=float, default=0,
+                        help='Artificial extra inference time, to test load shedding.')
+    parser.add_argument('--record', metavar='DIRECTORY',
+                        help='Record H.264 segments to this directory while people are present.')
+    parser.add_argument('--pre_roll', type=float, default=5,
+                        help='Seconds recorded from before people appear.')
+    parser.add_argument('--post_roll', type=float, default=3,
+                        help='Seconds recorded after people leave.')
+    parser.add_argument('--overlay', default='svg', choices=['svg', 'direct'],
+                        help='Draw poses with rsvgoverlay, or directly into the frames. '
+                        'direct needs a render callback returning pose_overlay.Overlay.')
+    parser.add_argument('--scene_gate', action='store_true',
+                        help='Reuse the last poses while the picture does not change.')
+    parser.add_argument('--gate_threshold', type=float, default=4.0,
+                        help='Mean luma change of the whole frame that triggers inference.')
+    parser.add_argument('--gate_block_threshold', type=float, default=12.0,
+                        help='Mean luma change of one block that triggers inference.')
+    parser.add_argument('--gate_refresh', type=float, default=10.0,
+                        help='Seconds after which a static frame is inferred anyway.')
+    parser.add_argument('--metrics', metavar='ADDRESS',
+                        help='Serve Prometheus metrics on host:port/metrics, '
+                        'e.g. 0.0.0.0:9100.')
+    parser.add_argument('--metrics_file', help='Periodically append metrics to this file.')
+    parser.add_argument('--metrics_interval', type=float, default=60,
+                        help='Seconds between metrics file dumps.')
     args = parser.parse_args()
+    if args.overlay == 'direct' and not returns_overlay:
+        parser.error('--overlay direct needs a render callback returning pose_overlay.Overlay, '
+                     'this one returns SVG.')
+
+    if args.metrics:
+        metrics.MetricsServer(metrics.REGISTRY, parse_address(args.metrics))
+    if args.metrics_file:
+        metrics_writer = metrics.MetricsFileWriter(metrics.REGISTRY, args.metrics_file,
+                                                   args.metrics_interval)
 
-    default_model = 'models/mobilenet/posenet_mobilenet_v1_075_%d_%d_quant_decoder_edgetpu.tflite'
     if args.res == '480x360':
         src_size = (640, 480)
         appsink_size = (480, 360)
-        model = args.model or default_model % (353, 481)
     elif args.res == '640x480':
         src_size = (640, 480)
         appsink_size = (640, 480)
-        model = args.model or default_model % (481, 641)
     elif args.res == '1280x720':
         src_size = (1280, 720)
         appsink_size = (1280, 720)
-        model = args.model or default_model % (721, 1281)
+    if args.profile:
+        profile = model_profiles.get_profile(args.profile)
+    else:
+        try:
+            profile = model_profiles.closest_profile(appsink_size, args.arch, not args.cpu)
+        except ValueError as e:
+            parser.error(e)
+    model = args.model or profile.model_path
 
-    print('Loading model: ', model)
-    engine = PoseEngine(model)
-    input_shape = engine.get_input_tensor_shape()
-    inference_size = (input_shape[2], input_shape[1])
+    if args.inference_delay_ms:
+        def delayed(callback):
+            def delayed_callback(engine, input_tensor):
+                time.sleep(args.inference_delay_ms / 1000)
+                return callback(engine, input_tensor)
+            return delayed_callback
+        inf_callback = delayed(inf_callback)
 
-    gstreamer.run_pipeline(partial(inf_callback, engine), partial(render_callback, engine),
-                           src_size, inference_size,
-                           mirror=args.mirror,
-                           videosrc=args.videosrc,
-                           h264=args.h264,
-                           jpeg=args.jpeg
-                           )
+    publisher = None
+    if args.publish:
+        publisher = PosePublisher(args.publish)
 
+        def publishing(callback):
+            def publishing_callback(engine, output, src_size, inference_box):
+                result = callback(engine, output, src_size, inference_box)
+                keypoints, keypoint_scores, pose_scores = engine.ParseOutputArrays()
+                publisher.publish_arrays(inference_to_source(keypoints, src_size, inference_box),
+                                         keypoint_scores, pose_scores)
+                return result
+            return publishing_callback
+        render_callback = publishing(render_callback)
 
-def main():
+    gate = None
+    if args.scene_gate:
+        gate = SceneGate(args.gate_threshold, args.gate_block_threshold,
+                         refresh_interval=args.gate_refresh)
+
+    recorder = None
+    if args.record:
+        recorder = EventRecorder(args.record, args.pre_roll, args.post_roll)
+
+        def recording(callback):
+            def recording_callback(engine, output, src_size, inference_box):
+                result = callback(engine, output, src_size, inference_box)
+                recorder.update_arrays(*engine.ParseOutputArrays(), src_size=src_size,
+                                       inference_box=inference_box)
+                return result
+            return recording_callback
+        render_callback = recording(render_callback)
+
+    def parse_once(callback):
+        # The render callback, publisher and recorder share one parse per frame.
+        def parsed_callback(engine, output, src_size, inference_box):
+            return callback(ParsedOutput(engine), output, src_size, inference_box)
+        return parsed_callback
+    render_callback = parse_once(render_callback)
+
+    def load(model, profile=None):
+        print('Loading model: ', model)
+        if args.tiled:
+            engine = TiledPoseEngine(model, src_size)
+        else:
+            engine = PoseEngine(model, profile=profile)
+        input_shape = engine.get_input_tensor_shape()
+        inference_size = (input_shape[2], input_shape[1])
+        return partial(inf_callback, engine), partial(render_callback, engine), inference_size
+
+    primary = load(model, None if args.model else profile)
+    controller = None
+    fallback_models = []
+    if args.target_latency_ms or args.target_fps:
+        # Smaller default models to fall back to, unless a model was given.
+        # Tiled, smaller models only mean more tiles.
+        if not args.model and not args.tiled:
+            smaller = [p for p in model_profiles.find_profiles(
+                profile.architecture, profile.edgetpu, available=True)
+                if p.input_size[0] < profile.input_size[0]]
+            fallback_models = [load(p.model_path, p) for p in reversed(smaller)]
+        levels = load_controller.build_levels(num_models=1 + len(fallback_models))
+        controller = load_controller.LoadController(
+            levels, target_latency_ms=args.target_latency_ms, target_fps=args.target_fps)
+
+    # Imported here so make_callbacks and draw_pose work without GStreamer.
+    import gstreamer
+    try:
+        gstreamer.run_pipeline(primary[0], primary[1],
+                               src_size, primary[2],
+                               mirror=args.mirror,
+                               videosrc=args.videosrc,
+                               h264=args.h264,
+                               jpeg=args.jpeg,
+                               controller=controller,
+                               fallback_models=fallback_models,
+                               recorder=recorder,
+                               overlay=args.overlay,
+                               scene_gate=gate
+                               )
+    finally:
+        if publisher:
+            publisher.close()
+        if recorder:
+            recorder.close()
+            _, bytes_written, saved = recorder.stats()
+            print('Recorded %d segments, %.1f MB, %.1f%% of disk writes saved' % (
+                len(recorder.segments), bytes_written / 1e6, saved * 100))
+        if gate:
+            stats = gate.stats()
+            print('Scene gate: %d of %d frames reused the last poses, %.2f ms per check' % (
+                stats.skipped, stats.frames, stats.gate_ms))
+        if args.metrics_file:
+            metrics_writer.close()
+
+
+def make_callbacks():
+    """Returns the (inf_callback, render_callback) pair main() runs with.
+
+    Both take the engine as their first argument, see run(). The render
+    callback gets it wrapped in a pose_engine.ParsedOutput.
+    """
     n = 0
     sum_process_time = 0
     sum_inference_time = 0
@@ -141,10 +287,11 @@ def main():
     def render_overlay(engine, output, src_size, inference_box):
         nonlocal n, sum_process_time, sum_inference_time, fps_counter
 
-        svg_canvas = svgwrite.Drawing('', size=src_size)
         start_time = time.monotonic()
         outputs, inference_time = engine.ParseOutput()
         end_time = time.monotonic()
+        PARSE_MS.observe(1000 * (end_time - start_time))
+        POSES.observe(len(outputs))
         n += 1
         sum_process_time += 1000 * (end_time - start_time)
         sum_inference_time += inference_time * 1000
@@ -154,12 +301,15 @@ def main():
             avg_inference_time, 1000 / avg_inference_time, next(fps_counter), len(outputs)
         )
 
-        shadow_text(svg_canvas, 10, 20, text_line)
-        for pose in outputs:
-            draw_pose(svg_canvas, pose, src_size, inference_box)
-        return (svg_canvas.tostring(), False)
+        keypoints, keypoint_scores, _ = engine.ParseOutputArrays()
+        return (Overlay(inference_to_source(keypoints, src_size, inference_box), keypoint_scores,
+                        text_line), False)
+
+    return run_inference, render_overlay
 
-    run(run_inference, render_overlay)
+
+def main():
+    run(*make_callbacks(), returns_overlay=True)
 
 
 if __name__ == '__main__':
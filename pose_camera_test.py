@@ -0,0 +1,35 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import io
+import sys
+import unittest
+from unittest import mock
+
+import pose_camera
+
+
+class RunTest(unittest.TestCase):
+
+    def test_direct_overlay_needs_overlay_callback(self):
+        stderr = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['pose_camera.py', '--overlay', 'direct']), \
+                contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit):
+            pose_camera.run(None, None)
+        self.assertIn('--overlay direct needs a render callback', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,6 +20,7 @@ from tflite_runtime.interpreter import Interpreter
 import collections
 import enum
 import math
+import model_profiles
 import numpy as np
 import os
 import platform
@@ -32,6 +33,24 @@ EDGETPU_SHARED_LIB = 'libedgetpu.so.1'
 POSENET_SHARED_LIB = os.path.join(
     'posenet_lib', os.uname().machine, 'posenet_decoder.so')
 
+# Fixed point formats used by ParseOutputQuantized when the decoder outputs
+# float tensors. int16 with 1/16 pixel steps covers coordinates up to 2047.
+KEYPOINT_QUANTIZATION = (1.0 / 16, 0)
+SCORE_QUANTIZATION = (1.0 / 255, 0)
+
+# Per-keypoint standard deviations from the COCO keypoint evaluation.
+COCO_SIGMAS = np.array([.26, .25, .25, .35, .35, .79, .79, .72, .72,
+                        .62, .62, 1.07, 1.07, .87, .87, .89, .89],
+                       dtype=np.float32) / 10.0
+
+# Rough standing pose facing the camera, (x, y) relative to the person's
+# height with the nose at the origin; their left is on the right of the image.
+STANDING_POSE = np.array([
+    (0, 0), (0.03, -0.02), (-0.03, -0.02), (0.06, 0), (-0.06, 0),
+    (0.12, 0.15), (-0.12, 0.15), (0.15, 0.32), (-0.15, 0.32), (0.16, 0.47), (-0.16, 0.47),
+    (0.08, 0.5), (-0.08, 0.5), (0.08, 0.72), (-0.08, 0.72), (0.08, 0.95), (-0.08, 0.95)],
+    dtype=np.float32)
+
 
 class KeypointType(enum.IntEnum):
     """Pose kepoints."""
@@ -63,23 +82,294 @@ Keypoint = collections.namedtuple('Keypoint', ['point', 'score'])
 Pose = collections.namedtuple('Pose', ['keypoints', 'score'])
 
 
+def poses_to_arrays(poses):
+    """Packs a list of poses into dense numpy arrays.
+
+    Args:
+      poses: List of Pose, as returned by PoseEngine.ParseOutput.
+
+    Returns:
+      (keypoints, keypoint_scores, pose_scores) where keypoints is a
+      [N, 17, 2] float32 array of (x, y), keypoint_scores is [N, 17] and
+      pose_scores is [N]. Rows are indexed by KeypointType.
+    """
+    num_keypoints = len(KeypointType)
+    keypoints = np.zeros((len(poses), num_keypoints, 2), dtype=np.float32)
+    keypoint_scores = np.zeros((len(poses), num_keypoints), dtype=np.float32)
+    pose_scores = np.zeros(len(poses), dtype=np.float32)
+    for i, pose in enumerate(poses):
+        pose_scores[i] = pose.score
+        for label, keypoint in pose.keypoints.items():
+            keypoints[i, label] = keypoint.point
+            keypoint_scores[i, label] = keypoint.score
+    return keypoints, keypoint_scores, pose_scores
+
+
+def arrays_to_poses(keypoints, keypoint_scores, pose_scores):
+    """Unpacks arrays in the format of poses_to_arrays into a list of Pose."""
+    poses = []
+    for i in range(len(pose_scores)):
+        pose_keypoints = {}
+        for j in range(len(KeypointType)):
+            pose_keypoints[KeypointType(j)] = Keypoint(
+                Point(keypoints[i, j, 0], keypoints[i, j, 1]), keypoint_scores[i, j])
+        poses.append(Pose(pose_keypoints, pose_scores[i]))
+    return poses
+
+
+class ParsedOutput:
+    """Wraps an engine so the output of one frame is parsed at most once.
+
+    ParseOutput and ParseOutputArrays are computed on first use and then
+    returned from the cache; everything else is passed to the engine. Create
+    one per frame and hand it to every stage that reads the poses.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._parsed = None
+        self._arrays = None
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def ParseOutput(self):
+        """Returns the engine's (poses, inference_time), parsing once."""
+        if self._parsed is None:
+            self._parsed = self.engine.ParseOutput()
+        return self._parsed
+
+    def ParseOutputArrays(self):
+        """Returns the poses in the format of poses_to_arrays, parsing once."""
+        if self._arrays is None:
+            if hasattr(self.engine, 'ParseOutputArrays'):
+                self._arrays = self.engine.ParseOutputArrays()
+            else:
+                self._arrays = poses_to_arrays(self.ParseOutput()[0])
+        return self._arrays
+
+
+def oks_matrix(keypoints, keypoint_scores, ref_keypoints, ref_scores, threshold=0.2,
+               areas=None, sigmas=COCO_SIGMAS):
+    """Object keypoint similarity between every pose and every reference pose.
+
+    Only keypoints visible in both poses count.
+
+    Args:
+      keypoints: [N, 17, 2] keypoints.
+      keypoint_scores: [N, 17] keypoint scores.
+      ref_keypoints: [M, 17, 2] reference keypoints, in the same coordinates.
+      ref_scores: [M, 17] reference keypoint scores.
+      threshold: Keypoints scoring below this are not visible.
+      areas: [M] object scale of the reference poses. By default the area of
+        the bounding box of their visible keypoints, at least 1.
+      sigmas: [17] per-keypoint falloff.
+
+    Returns:
+      [N, M] float32 array of OKS in [0, 1], 0 if no keypoint is visible in
+      both poses.
+    """
+    ref_keypoints = np.asarray(ref_keypoints, dtype=np.float32)
+    ref_visible = np.asarray(ref_scores) >= threshold
+    if areas is None:
+        lo = np.where(ref_visible[..., np.newaxis], ref_keypoints, np.inf).min(axis=1)
+        hi = np.where(ref_visible[..., np.newaxis], ref_keypoints, -np.inf).max(axis=1)
+        with np.errstate(invalid='ignore'):
+            areas = np.nan_to_num(np.prod(hi - lo, axis=1), nan=1.0, posinf=1.0, neginf=1.0)
+        areas = np.maximum(areas, 1.0)
+
+    d2 = ((keypoints[:, np.newaxis] - ref_keypoints[np.newaxis]) ** 2).sum(axis=3)
+    similarity = np.exp(-d2 / (2 * np.asarray(areas)[np.newaxis, :, np.newaxis] *
+                               (2 * sigmas) ** 2))
+    visible = (np.asarray(keypoint_scores) >= threshold)[:, np.newaxis] & ref_visible[np.newaxis]
+    count = visible.sum(axis=2)
+    oks = (similarity * visible).sum(axis=2) / np.maximum(count, 1)
+    return oks.astype(np.float32)
+
+
+def inference_to_source(points, src_size, inference_box):
+    """Maps points from inference tensor to source image coordinates.
+
+    This is the mapping pose_camera.draw_pose applies to every keypoint.
+
+    Args:
+      points: [..., 2] array of (x, y) points in inference tensor coordinates.
+      src_size: (width, height) of the source image.
+      inference_box: (x, y, width, height) of the source image inside the
+        inference tensor, as passed to render callbacks.
+
+    Returns:
+      float32 array of the same shape as points.
+    """
+    box_x, box_y, box_w, box_h = inference_box
+    scale = np.array([src_size[0] / box_w, src_size[1] / box_h], dtype=np.float32)
+    offset = np.array([box_x, box_y], dtype=np.float32)
+    return (np.asarray(points, dtype=np.float32) - offset) * scale
+
+
+def input_array(input_data):
+    """Returns model input data as a flat uint8 array.
+
+    Accepts what edgetpu.run_inference accepts: numpy arrays, bytes and
+    the Gst.Buffer the camera pipeline passes when frame rows are tightly
+    packed. Buffers are mapped and copied, honouring the offset and stride
+    of their video meta.
+    """
+    if isinstance(input_data, np.ndarray):
+        return input_data.reshape(-1)
+    if isinstance(input_data, (bytes, bytearray, memoryview)):
+        return np.frombuffer(input_data, dtype=np.uint8)
+    # Only camera pipelines pass buffers, GStreamer is imported there anyway.
+    from gi.repository import Gst, GstVideo
+    result, mapinfo = input_data.map(Gst.MapFlags.READ)
+    if not result:
+        raise ValueError('Could not map input buffer.')
+    try:
+        meta = GstVideo.buffer_get_video_meta(input_data)
+        if not meta:
+            return np.frombuffer(mapinfo.data, dtype=np.uint8).copy()
+        row_bytes = meta.width * 3  # RGB.
+        rows = np.ndarray((meta.height, row_bytes), np.uint8, mapinfo.data,
+                          offset=meta.offset[0], strides=(meta.stride[0], 1))
+        return np.ascontiguousarray(rows).reshape(-1)
+    finally:
+        input_data.unmap(mapinfo)
+
+
+def make_interpreter(model_path, decoder=True, device=None):
+    """Creates an interpreter with the delegates a PoseNet model needs.
+
+    The Edge TPU delegate is only loaded for Edge TPU compiled models, so
+    CPU models also run on hosts without an Edge TPU. The model file is
+    memory mapped by TF-Lite, so processes loading the same model share its
+    pages.
+
+    Args:
+      model_path: String, path to TF-Lite Flatbuffer file.
+      decoder: Whether to load the PoseNet decoder custom op delegate.
+      device: Edge TPU to use, e.g. 'usb:0' or ':1', any by default.
+    """
+    delegates = []
+    if 'edgetpu' in os.path.basename(model_path):
+        options = {'device': device} if device else {}
+        delegates.append(load_delegate(EDGETPU_SHARED_LIB, options))
+    if decoder:
+        delegates.append(load_delegate(POSENET_SHARED_LIB))
+    return Interpreter(model_path, experimental_delegates=delegates)
+
+
+def parse_poses(keypoints, keypoint_scores, pose_scores, num_poses,
+                mirror=False, input_width=0):
+    """Converts decoder output tensors into a list of Pose.
+
+    Args:
+      keypoints: [P, 17, 2] decoder keypoints as (y, x).
+      keypoint_scores: [P, 17] keypoint scores.
+      pose_scores: [P] pose scores.
+      num_poses: Number of valid poses.
+      mirror: Flip keypoints horizontally.
+      input_width: Model input width, used by mirror.
+    """
+    poses = []
+    for i in range(int(num_poses)):
+        pose_score = pose_scores[i]
+        pose_keypoints = {}
+        for j, point in enumerate(keypoints[i]):
+            y, x = point
+            if mirror:
+                x = input_width - x
+            pose_keypoints[KeypointType(j)] = Keypoint(
+                Point(x, y), keypoint_scores[i, j])
+        poses.append(Pose(pose_keypoints, pose_score))
+    return poses
+
+
+class QuantizedPoses:
+    """Decoded poses kept in integer form.
+
+    Every array comes with a (scale, zero_point) pair and holds
+    real_value = scale * (q - zero_point), like quantized TF-Lite tensors.
+    Thresholds are converted to the integer domain once instead of converting
+    every value to float.
+
+    Attributes:
+      keypoints: [N, 17, 2] integer array of (x, y).
+      keypoint_scores: [N, 17] integer array.
+      pose_scores: [N] integer array.
+      keypoint_quantization: (scale, zero_point) of keypoints.
+      score_quantization: (scale, zero_point) of keypoint scores.
+      pose_score_quantization: (scale, zero_point) of pose scores, which
+        the decoder may quantize differently from keypoint scores.
+    """
+
+    def __init__(self, keypoints, keypoint_scores, pose_scores,
+                 keypoint_quantization, score_quantization, pose_score_quantization=None):
+        self.keypoints = keypoints
+        self.keypoint_scores = keypoint_scores
+        self.pose_scores = pose_scores
+        self.keypoint_quantization = keypoint_quantization
+        self.score_quantization = score_quantization
+        self.pose_score_quantization = pose_score_quantization or score_quantization
+
+    def __len__(self):
+        return len(self.pose_scores)
+
+    @property
+    def nbytes(self):
+        """Memory held by the arrays."""
+        return self.keypoints.nbytes + self.keypoint_scores.nbytes + self.pose_scores.nbytes
+
+    def quantize_score(self, threshold, quantization=None):
+        """Returns the smallest integer score that is >= threshold.
+
+        Uses the keypoint score quantization unless another is given.
+        """
+        scale, zero_point = quantization or self.score_quantization
+        return int(math.ceil(threshold / scale - 1e-6)) + zero_point
+
+    def keypoint_mask(self, threshold):
+        """Returns a [N, 17] boolean array of keypoints scoring >= threshold."""
+        return self.keypoint_scores >= self.quantize_score(threshold)
+
+    def filter(self, pose_threshold):
+        """Returns the poses scoring >= pose_threshold."""
+        keep = self.pose_scores >= self.quantize_score(pose_threshold,
+                                                       self.pose_score_quantization)
+        return QuantizedPoses(self.keypoints[keep], self.keypoint_scores[keep],
+                              self.pose_scores[keep], self.keypoint_quantization,
+                              self.score_quantization, self.pose_score_quantization)
+
+    def dequantize(self):
+        """Returns float arrays in the format of poses_to_arrays."""
+        def real(q, quantization):
+            scale, zero_point = quantization
+            return (np.float32(scale) * (q.astype(np.float32) - zero_point))
+        return (real(self.keypoints, self.keypoint_quantization),
+                real(self.keypoint_scores, self.score_quantization),
+                real(self.pose_scores, self.pose_score_quantization))
+
+    def to_poses(self):
+        """Returns a list of Pose, as ParseOutput does."""
+        return arrays_to_poses(*self.dequantize())
+
+
 class PoseEngine():
     """Engine used for pose tasks."""
 
-    def __init__(self, model_path, mirror=False):
+    def __init__(self, model_path, mirror=False, profile=None, device=None):
         """Creates a PoseEngine with given model.
 
         Args:
           model_path: String, path to TF-Lite Flatbuffer file.
           mirror: Flip keypoints horizontally.
+          profile: model_profiles.ModelProfile of the model, looked up by file
+            name if not given. Unknown models are treated as MobileNet.
+          device: Edge TPU to use, e.g. 'usb:0' or ':1', any by default.
 
         Raises:
           ValueError: An error occurred when model output is invalid.
         """
-        edgetpu_delegate = load_delegate(EDGETPU_SHARED_LIB)
-        posenet_decoder_delegate = load_delegate(POSENET_SHARED_LIB)
-        self._interpreter = Interpreter(
-            model_path, experimental_delegates=[edgetpu_delegate, posenet_decoder_delegate])
+        self._interpreter = make_interpreter(model_path, device=device)
         self._interpreter.allocate_tensors()
 
         self._mirror = mirror
@@ -93,12 +383,30 @@ class PoseEngine():
                  ' This model has {}.'.format(self._input_tensor_shape)))
         _, self._input_height, self._input_width, self._input_depth = self.get_input_tensor_shape()
         self._input_type = self._interpreter.get_input_details()[0]['dtype']
+
+        self.profile = profile or model_profiles.profile_for_model(model_path)
+        if self.profile:
+            if self.profile.input_size != (self._input_width, self._input_height):
+                raise ValueError('Model input is {}x{} but profile {} expects {}x{}.'.format(
+                    self._input_width, self._input_height, self.profile.name,
+                    *self.profile.input_size))
+            self._input_mean = self.profile.input_mean
+            self._input_std = self.profile.input_std
+        else:
+            self._input_mean = model_profiles.MOBILENET_MEAN
+            self._input_std = model_profiles.MOBILENET_STD
         self._inf_time = 0
 
     def run_inference(self, input_data):
         """Run inference using the zero copy feature from pycoral and returns inference time in ms.
+
+        Float models given uint8 pixels get them normalized as the model
+        profile specifies. input_data may be anything input_array takes.
         """
         start = time.monotonic()
+        if self._input_type == np.float32 and getattr(input_data, 'dtype', np.uint8) == np.uint8:
+            input_data = model_profiles.normalize_input(
+                input_array(input_data), self._input_mean, self._input_std)
         edgetpu.run_inference(self._interpreter, input_data)
         self._inf_time = time.monotonic() - start
         return (self._inf_time * 1000)
@@ -117,13 +425,8 @@ class PoseEngine():
         image_width, image_height = img.size
         resized_image = img.resize(
             (self._input_width, self._input_height), Image.NEAREST)
-        input_data = np.expand_dims(resized_image, axis=0)
-        if self._input_type is np.float32:
-            # Floating point versions of posenet take image data in [-1,1] range.
-            input_data = np.float32(resized_image) / 128.0 - 1.0
-        else:
-            # Assuming to be uint8
-            input_data = np.asarray(resized_image)
+        # Float models get the pixels normalized by run_inference.
+        input_data = np.asarray(resized_image)
         self.run_inference(input_data.flatten())
         return self.ParseOutput()
 
@@ -142,15 +445,46 @@ class PoseEngine():
         keypoint_scores = self.get_output_tensor(1)
         pose_scores = self.get_output_tensor(2)
         num_poses = self.get_output_tensor(3)
-        poses = []
-        for i in range(int(num_poses)):
-            pose_score = pose_scores[i]
-            pose_keypoints = {}
-            for j, point in enumerate(keypoints[i]):
-                y, x = point
-                if self._mirror:
-                    y = self._input_width - y
-                pose_keypoints[KeypointType(j)] = Keypoint(
-                    Point(x, y), keypoint_scores[i, j])
-            poses.append(Pose(pose_keypoints, pose_score))
+        poses = parse_poses(keypoints, keypoint_scores, pose_scores, num_poses,
+                            self._mirror, self._input_width)
         return poses, self._inf_time
+
+    def _quantized_output(self, idx, quantization, dtype):
+        """Returns an output tensor in integer form and its (scale, zero_point).
+
+        Integer tensors are returned as is (copied out of the interpreter),
+        float tensors are converted to dtype with the given quantization.
+        """
+        tensor = self.get_output_tensor(idx)
+        scale, zero_point = self._interpreter.get_output_details()[idx]['quantization']
+        if np.issubdtype(tensor.dtype, np.integer) and scale:
+            return np.array(tensor), (scale, zero_point)
+        scale, zero_point = quantization
+        info = np.iinfo(dtype)
+        tensor = np.rint(tensor / np.float32(scale)) + zero_point
+        return np.clip(tensor, info.min, info.max).astype(dtype), (scale, zero_point)
+
+    def ParseOutputQuantized(self):
+        """Parses interpreter output tensors without converting to Python floats.
+
+        Returns the same poses as ParseOutput, including the mirror transform,
+        as a QuantizedPoses plus the inference time.
+        """
+        num_poses = int(self.get_output_tensor(3))
+        keypoints, keypoint_quantization = self._quantized_output(
+            0, KEYPOINT_QUANTIZATION, np.int16)
+        keypoint_scores, score_quantization = self._quantized_output(
+            1, SCORE_QUANTIZATION, np.uint8)
+        pose_scores, pose_score_quantization = self._quantized_output(
+            2, SCORE_QUANTIZATION, np.uint8)
+
+        # Decoder outputs (y, x), swap to (x, y) like ParseOutput.
+        keypoints = keypoints[:num_poses, :, ::-1].astype(np.int16)
+        if self._mirror:
+            # Same transform as ParseOutput, done in the integer domain.
+            scale, zero_point = keypoint_quantization
+            width = int(round(self._input_width / scale)) + 2 * zero_point
+            keypoints[:, :, 0] = width - keypoints[:, :, 0].astype(np.int32)
+        return QuantizedPoses(keypoints, keypoint_scores[:num_poses],
+                              pose_scores[:num_poses], keypoint_quantization,
+                              score_quantization, pose_score_quantization), self._inf_time
@@ -0,0 +1,368 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Declarative gesture and event detection on a stream of poses.
+
+Rules describe a condition on a tracked person (or on the whole scene) and
+an optional hold time. The EventStage evaluates all rules on every frame and
+emits an Event when a condition has held for its hold time ('start') and when
+it stops holding ('end'):
+
+    stage = EventStage([
+        KeypointAbove('hand_up', KeypointType.RIGHT_WRIST, KeypointType.NOSE),
+        InZone('at_door', KeypointType.LEFT_ANKLE, door_polygon, hold=2.0),
+        PoseMatch('t_pose', index, 't_pose', max_distance=0.05),
+        PersonCount('empty', maximum=0, hold=2.0),
+    ])
+    for event in stage.update(poses):
+        print(event)
+
+Rules of the same type are evaluated together: keypoint relations are a single
+vectorized comparison, every distinct zone is tested once for all keypoints,
+and every pose index is searched once per person, so hundreds of rules cost
+little more than a few. update takes at most `budget_ms` per frame: pose
+similarity searches are the only expensive part, and they get what is left
+of the budget after tracking and the other rules, spreading the tracks over
+successive frames when there are too many to search at once. Tracking only
+runs when some rule reports per person.
+"""
+
+import collections
+import time
+
+import numpy as np
+
+from pose_engine import KeypointType, poses_to_arrays
+from pose_tracker import PoseTracker
+
+Event = collections.namedtuple('Event', ['timestamp', 'rule', 'track_id', 'kind'])
+Event.__doc__ = """A rule starting or ending to hold.
+
+  timestamp: Time of the frame that triggered the event.
+  rule: Name of the rule.
+  track_id: Track the event applies to, None for scene rules.
+  kind: 'start' or 'end'.
+"""
+
+
+class Rule:
+    """Base class of all rules."""
+
+    def __init__(self, name, hold=0.0):
+        """
+        Args:
+          name: Name reported in events.
+          hold: Seconds the condition must hold before a 'start' event.
+        """
+        self.name = name
+        self.hold = hold
+
+
+class KeypointAbove(Rule):
+    """Keypoint a is above keypoint b by at least margin pixels."""
+
+    def __init__(self, name, a, b, margin=0.0, hold=0.0):
+        super().__init__(name, hold)
+        self.a = KeypointType(a)
+        self.b = KeypointType(b)
+        self.margin = margin
+
+
+class KeypointBelow(KeypointAbove):
+    """Keypoint a is below keypoint b by at least margin pixels."""
+
+
+class InZone(Rule):
+    """Keypoint is inside a polygon given as a sequence of (x, y) vertices."""
+
+    def __init__(self, name, keypoint, polygon, hold=0.0):
+        super().__init__(name, hold)
+        self.keypoint = KeypointType(keypoint)
+        self.polygon = tuple((float(x), float(y)) for x, y in polygon)
+
+
+class PoseMatch(Rule):
+    """Closest pose of a pose_index index has the given label.
+
+    A pose only matches when the distance to that closest pose is at most
+    max_distance.
+    """
+
+    def __init__(self, name, index, label, max_distance, hold=0.0):
+        super().__init__(name, hold)
+        self.index = index
+        self.label = label
+        self.max_distance = max_distance
+
+
+class PersonCount(Rule):
+    """Scene rule: number of people is within [minimum, maximum]."""
+
+    def __init__(self, name, minimum=0, maximum=None, hold=0.0):
+        super().__init__(name, hold)
+        self.minimum = minimum
+        self.maximum = maximum
+
+
+def points_in_polygon(points, polygon):
+    """Even-odd rule point in polygon test.
+
+    Args:
+      points: [..., 2] array of (x, y) points.
+      polygon: [V, 2] array of vertices.
+
+    Returns:
+      Boolean array of shape points.shape[:-1].
+    """
+    polygon = np.asarray(polygon, dtype=np.float32)
+    x = points[..., 0, np.newaxis]
+    y = points[..., 1, np.newaxis]
+    x0, y0 = polygon[:, 0], polygon[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    crosses = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return (crosses & (x < x_cross)).sum(axis=-1) % 2 == 1
+
+
+def _transition(condition, since, active, hold, timestamp):
+    """Advances rule state by one frame, all arguments are [..., R] arrays.
+
+    Returns (since, active, started, ended) for the new frame.
+    """
+    since = np.where(condition, np.where(np.isnan(since), timestamp, since), np.nan)
+    with np.errstate(invalid='ignore'):
+        started = condition & ~active & (timestamp - since >= hold)
+    ended = active & ~condition
+    active = (active | started) & condition
+    return since, active, started, ended
+
+
+class EventStage:
+    """Evaluates a set of rules on every frame and emits events."""
+
+    def __init__(self, rules, threshold=0.2, tracker=None, budget_ms=5.0):
+        """Creates a stage.
+
+        Args:
+          rules: Sequence of Rule, names must be unique.
+          threshold: Keypoints scoring below this never satisfy a rule.
+          tracker: PoseTracker used when update is not given track ids.
+          budget_ms: Time budget of update per frame. PoseMatch searches
+            that don't fit are deferred to later frames, but at least one
+            track is searched per frame, so frames with PoseMatch rules can
+            exceed it by one track's searches; they are counted in
+            stats['over_budget'].
+        """
+        names = [rule.name for rule in rules]
+        if len(set(names)) != len(names):
+            raise ValueError('Rule names must be unique.')
+        self.threshold = threshold
+        self.tracker = tracker or PoseTracker(threshold)
+        self.budget_ms = budget_ms
+
+        self._scene_rules = [r for r in rules if isinstance(r, PersonCount)]
+        self._track_rules = [r for r in rules if not isinstance(r, PersonCount)]
+        self._compile()
+
+        num_rules = len(self._track_rules)
+        self._rows = {}
+        self._free_rows = []
+        self._since = np.zeros((0, num_rules))
+        self._active = np.zeros((0, num_rules), dtype=bool)
+        self._last_conditions = np.zeros((0, num_rules), dtype=bool)
+        self._scene_since = np.full(len(self._scene_rules), np.nan)
+        self._scene_active = np.zeros(len(self._scene_rules), dtype=bool)
+
+        self._search_ms = 0.1  # Running estimate of one similarity search.
+        self._next_match_track = 0
+        self.stats = collections.Counter()
+
+    def _compile(self):
+        rules = self._track_rules
+        self._hold = np.array([r.hold for r in rules], dtype=np.float64)
+
+        relations = [i for i, r in enumerate(rules) if isinstance(r, KeypointAbove)]
+        self._relation_columns = np.array(relations, dtype=np.int64)
+        self._relation_a = np.array([rules[i].a for i in relations], dtype=np.int64)
+        self._relation_b = np.array([rules[i].b for i in relations], dtype=np.int64)
+        self._relation_margin = np.array([rules[i].margin for i in relations], dtype=np.float32)
+        # Image y grows downwards, "a above b" means a.y < b.y.
+        self._relation_sign = np.array(
+            [-1.0 if isinstance(rules[i], KeypointBelow) else 1.0 for i in relations],
+            dtype=np.float32)
+
+        polygons = {}
+        self._zone_columns = []
+        self._zone_polygons = []
+        self._zone_keypoints = []
+        for i, rule in enumerate(rules):
+            if isinstance(rule, InZone):
+                polygon_id = polygons.setdefault(rule.polygon, len(polygons))
+                self._zone_columns.append(i)
+                self._zone_polygons.append(polygon_id)
+                self._zone_keypoints.append(int(rule.keypoint))
+        self._polygons = [np.array(p, dtype=np.float32) for p in polygons]
+
+        indexes = collections.OrderedDict()
+        for i, rule in enumerate(rules):
+            if isinstance(rule, PoseMatch):
+                indexes.setdefault(id(rule.index), (rule.index, []))[1].append(i)
+        self._match_groups = list(indexes.values())
+        self._match_columns = np.array(
+            [i for _, columns in self._match_groups for i in columns], dtype=np.int64)
+
+    def _track_rows(self, track_ids):
+        """Maps track ids to rows of the state arrays, allocating as needed."""
+        rows = np.empty(len(track_ids), dtype=np.int64)
+        for i, track_id in enumerate(track_ids):
+            row = self._rows.get(track_id)
+            if row is None:
+                if self._free_rows:
+                    row = self._free_rows.pop()
+                else:
+                    row = len(self._since)
+                    num_rules = len(self._track_rules)
+                    self._since = np.vstack([self._since, np.full((1, num_rules), np.nan)])
+                    self._active = np.vstack([self._active, np.zeros((1, num_rules), bool)])
+                    self._last_conditions = np.vstack(
+                        [self._last_conditions, np.zeros((1, num_rules), bool)])
+                self._rows[track_id] = row
+            rows[i] = row
+        return rows
+
+    def _conditions(self, keypoints, visible, rows, track_ids, begin):
+        conditions = np.zeros((len(keypoints), len(self._track_rules)), dtype=bool)
+
+        if len(self._relation_columns):
+            ya = keypoints[:, self._relation_a, 1]
+            yb = keypoints[:, self._relation_b, 1]
+            holds = (yb - ya) * self._relation_sign >= self._relation_margin
+            holds &= visible[:, self._relation_a] & visible[:, self._relation_b]
+            conditions[:, self._relation_columns] = holds
+
+        if self._polygons:
+            inside = np.stack([points_in_polygon(keypoints, p) for p in self._polygons])
+            inside &= visible
+            conditions[:, self._zone_columns] = inside[
+                self._zone_polygons, :, self._zone_keypoints].T
+
+        if self._match_groups:
+            conditions[:, self._match_columns] = self._matches(
+                keypoints, visible, rows, track_ids, begin)
+        return conditions
+
+    def _matches(self, keypoints, visible, rows, track_ids, begin):
+        """Evaluates PoseMatch rules for as many tracks as the budget allows.
+
+        The budget is what is left of budget_ms since begin, the start of
+        update. Tracks that don't fit in it keep their last result.
+        """
+        matched = self._last_conditions[rows][:, self._match_columns]
+        searches_per_track = len(self._match_groups)
+        remaining_ms = self.budget_ms - 1000 * (time.monotonic() - begin)
+        budget = int(max(remaining_ms, 0) / (self._search_ms * searches_per_track))
+        count = min(len(rows), max(budget, 1))
+        start = self._next_match_track % max(len(rows), 1)
+        selected = (np.arange(count) + start) % len(rows) if len(rows) else []
+        self._next_match_track = start + count
+        self.stats['match_searches_skipped'] += (len(rows) - count) * searches_per_track
+
+        scores = visible.astype(np.float32)
+        begin = time.monotonic()
+        for i in selected:
+            column = 0
+            for index, rule_columns in self._match_groups:
+                distances, ids = index.search(keypoints[i], scores[i], k=1)
+                label = index.labels[ids[0]] if len(ids) else None
+                for c in rule_columns:
+                    rule = self._track_rules[c]
+                    matched[i, column] = (label == rule.label and
+                                          distances[0] <= rule.max_distance)
+                    column += 1
+        if len(selected):
+            elapsed = 1000 * (time.monotonic() - begin) / (len(selected) * searches_per_track)
+            self._search_ms = 0.9 * self._search_ms + 0.1 * elapsed
+        self.stats['match_searches'] += len(selected) * searches_per_track
+        return matched
+
+    def update(self, poses, timestamp=None, track_ids=None):
+        """Same as update_arrays but takes a list of Pose."""
+        keypoints, keypoint_scores, _ = poses_to_arrays(poses)
+        return self.update_arrays(keypoints, keypoint_scores, timestamp, track_ids)
+
+    def update_arrays(self, keypoints, keypoint_scores, timestamp=None, track_ids=None):
+        """Evaluates all rules on a new frame.
+
+        Args:
+          keypoints: [N, 17, 2] array of (x, y) keypoint positions.
+          keypoint_scores: [N, 17] array of keypoint scores.
+          timestamp: Time of the frame in seconds, defaults to time.monotonic().
+          track_ids: Optional [N] track ids, assigned with self.tracker if None.
+
+        Returns:
+          List of Event, ordered by track and then by rule.
+        """
+        begin = time.monotonic()
+        if timestamp is None:
+            timestamp = begin
+        people = len(keypoints)
+        if track_ids is None:
+            # Scene rules only need the number of people.
+            track_ids = (self.tracker.update(keypoints, keypoint_scores)
+                         if self._track_rules else [])
+        track_ids = [int(t) for t in track_ids]
+        events = []
+
+        counts = np.array([people])
+        scene = np.array([counts[0] >= r.minimum and (r.maximum is None or counts[0] <= r.maximum)
+                          for r in self._scene_rules], dtype=bool)
+        self._scene_since, self._scene_active, started, ended = _transition(
+            scene, self._scene_since, self._scene_active,
+            np.array([r.hold for r in self._scene_rules]), timestamp)
+        for kind, changed in (('end', ended), ('start', started)):
+            for column in np.flatnonzero(changed):
+                events.append(Event(timestamp, self._scene_rules[column].name, None, kind))
+
+        # Tracks that disappeared end all their active rules.
+        current = set(track_ids)
+        for track_id in [t for t in self._rows if t not in current]:
+            row = self._rows.pop(track_id)
+            for column in np.flatnonzero(self._active[row]):
+                events.append(Event(timestamp, self._track_rules[column].name, track_id, 'end'))
+            self._since[row] = np.nan
+            self._active[row] = False
+            self._last_conditions[row] = False
+            self._free_rows.append(row)
+
+        if self._track_rules and track_ids:
+            rows = self._track_rows(track_ids)
+            visible = keypoint_scores >= self.threshold
+            conditions = self._conditions(
+                np.asarray(keypoints, dtype=np.float32), visible, rows, track_ids, begin)
+            self._last_conditions[rows] = conditions
+            since, active, started, ended = _transition(
+                conditions, self._since[rows], self._active[rows], self._hold, timestamp)
+            self._since[rows] = since
+            self._active[rows] = active
+            for i, column in zip(*np.nonzero(ended | started)):
+                kind = 'start' if started[i, column] else 'end'
+                events.append(Event(timestamp, self._track_rules[column].name,
+                                    track_ids[i], kind))
+
+        self.stats['frames'] += 1
+        self.stats['events'] += len(events)
+        elapsed_ms = 1000 * (time.monotonic() - begin)
+        self.stats['total_ms'] += elapsed_ms
+        self.stats['over_budget'] += int(elapsed_ms > self.budget_ms)
+        return events
@@ -0,0 +1,150 @@
+# Lint as: python3
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from pose_engine import KeypointType
+import pose_events
+import pose_index
+
+
+def standing_pose(x, y, scale=100.0):
+    keypoints, _ = pose_index.random_poses(1, seed=0)
+    template = (keypoints[0] - keypoints[0].min(axis=0))
+    template /= template.max()
+    return template * scale + (x, y), np.ones(17, dtype=np.float32)
+
+
+def frame(*poses):
+    if not poses:
+        return np.zeros((0, 17, 2), np.float32), np.zeros((0, 17), np.float32)
+    keypoints, scores = zip(*poses)
+    return np.stack(keypoints), np.stack(scores)
+
+
+class EventStageTest(unittest.TestCase):
+
+    def test_keypoint_relations(self):
+        stage = pose_events.EventStage([
+            pose_events.KeypointAbove('hand_up', KeypointType.RIGHT_WRIST, KeypointType.NOSE),
+            pose_events.KeypointBelow('hand_down', KeypointType.RIGHT_WRIST, KeypointType.NOSE),
+        ])
+        keypoints, scores = standing_pose(0, 0)
+        events = stage.update_arrays(*frame((keypoints, scores)), timestamp=0.0)
+        self.assertEqual(events, [pose_events.Event(0.0, 'hand_down', 0, 'start')])
+
+        raised = keypoints.copy()
+        raised[KeypointType.RIGHT_WRIST, 1] = keypoints[KeypointType.NOSE, 1] - 10
+        events = stage.update_arrays(*frame((raised, scores)), timestamp=1.0)
+        self.assertEqual(sorted(events), [pose_events.Event(1.0, 'hand_down', 0, 'end'),
+                                          pose_events.Event(1.0, 'hand_up', 0, 'start')])
+
+        # Low scoring keypoints never satisfy a rule.
+        scores = scores.copy()
+        scores[KeypointType.RIGHT_WRIST] = 0.0
+        events = stage.update_arrays(*frame((raised, scores)), timestamp=2.0)
+        self.assertEqual(events, [pose_events.Event(2.0, 'hand_up', 0, 'end')])
+
+    def test_zone_dwell_and_track_loss(self):
+        door = [(0, 0), (200, 0), (200, 200), (0, 200)]
+        stage = pose_events.EventStage([
+            pose_events.InZone('at_door', KeypointType.NOSE, door, hold=2.0),
+            pose_events.InZone('near_door', KeypointType.LEFT_ANKLE, door),
+        ])
+        inside = standing_pose(10, 10)
+        self.assertEqual(stage.update_arrays(*frame(inside), timestamp=0.0),
+                         [pose_events.Event(0.0, 'near_door', 0, 'start')])
+        self.assertEqual(stage.update_arrays(*frame(inside), timestamp=1.0), [])
+        self.assertEqual(stage.update_arrays(*frame(inside), timestamp=2.0),
+                         [pose_events.Event(2.0, 'at_door', 0, 'start')])
+        events = stage.update_arrays(*frame(), timestamp=3.0)
+        self.assertEqual(sorted(events), [pose_events.Event(3.0, 'at_door', 0, 'end'),
+                                          pose_events.Event(3.0, 'near_door', 0, 'end')])
+
+    def test_person_count(self):
+        stage = pose_events.EventStage(
+            [pose_events.PersonCount('empty', maximum=0, hold=2.0)])
+        person = standing_pose(10, 10)
+        self.assertEqual(stage.update_arrays(*frame(person), timestamp=0.0), [])
+        self.assertEqual(stage.update_arrays(*frame(), timestamp=1.0), [])
+        self.assertEqual(stage.update_arrays(*frame(person), timestamp=2.0), [])
+        self.assertEqual(stage.update_arrays(*frame(), timestamp=3.0), [])
+        self.assertEqual(stage.update_arrays(*frame(), timestamp=5.0),
+                         [pose_events.Event(5.0, 'empty', None, 'start')])
+
+    def test_scene_rules_skip_tracking(self):
+        tracker = mock.Mock()
+        stage = pose_events.EventStage(
+            [pose_events.PersonCount('crowd', minimum=2)], tracker=tracker)
+        events = stage.update_arrays(*frame(standing_pose(0, 0), standing_pose(200, 0)),
+                                     timestamp=0.0)
+        self.assertEqual(events, [pose_events.Event(0.0, 'crowd', None, 'start')])
+        tracker.update.assert_not_called()
+
+    def test_pose_match(self):
+        keypoints, scores = pose_index.random_poses(100, seed=5)
+        scores[:] = 1.0
+        index = pose_index.PoseIndex()
+        index.add(keypoints, scores, labels=['a'] * 50 + ['b'] * 50)
+        stage = pose_events.EventStage([
+            pose_events.PoseMatch('is_a', index, 'a', max_distance=0.01),
+            pose_events.PoseMatch('is_b', index, 'b', max_distance=0.01),
+        ])
+        events = stage.update_arrays(keypoints[[3, 70]], scores[[3, 70]], timestamp=0.0)
+        self.assertEqual(events, [pose_events.Event(0.0, 'is_a', 0, 'start'),
+                                  pose_events.Event(0.0, 'is_b', 1, 'start')])
+
+    def test_budget_defers_pose_matches(self):
+        keypoints, scores = pose_index.random_poses(100, seed=5)
+        scores[:] = 1.0
+        index = pose_index.PoseIndex()
+        index.add(keypoints, scores, labels=['a'] * 100)
+        stage = pose_events.EventStage(
+            [pose_events.PoseMatch('is_a', index, 'a', max_distance=0.01)], budget_ms=0.0)
+        started = set()
+        for t in range(4):
+            events = stage.update_arrays(keypoints[:4], scores[:4], timestamp=t * 0.1,
+                                         track_ids=range(4))
+            # One track searched per frame, the others wait for later frames.
+            self.assertEqual(len(events), 1)
+            started.update(event.track_id for event in events)
+        self.assertEqual(started, {0, 1, 2, 3})
+        self.assertEqual(stage.stats['match_searches'], 4)
+        self.assertEqual(stage.stats['match_searches_skipped'], 12)
+        self.assertEqual(stage.stats['over_budget'], 4)
+
+    def test_many_rules(self):
+        rules = []
+        for i in range(300):
+            a, b = KeypointType(i % 17), KeypointType((i // 17) % 17)
+            rules.append(pose_events.KeypointAbove('above%d' % i, a, b, margin=i % 5))
+            zone = [(0, 0), (100 + i, 0), (100 + i, 100), (0, 100)]
+            rules.append(pose_events.InZone('zone%d' % i, a, zone, hold=0.5))
+        stage = pose_events.EventStage(rules)
+        keypoints, scores = pose_index.random_poses(20, seed=1)
+        start = time.monotonic()
+        for t in range(20):
+            stage.update_arrays(keypoints + t, scores, timestamp=t * 0.1)
+        elapsed = (time.monotonic() - start) / 20
+        self.assertLess(elapsed, 0.05)
+        self.assertGreater(stage.stats['events'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,455 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Nearest-neighbor search over a library of reference poses.
+
+Poses are normalized (translated to their centroid and scaled to unit RMS
+radius) so that matching is invariant to where and how large a person appears
+in the frame. Two metrics are supported, both masking out keypoints whose
+score is below a threshold on either side of the comparison:
+
+  cosine: 1 - weighted cosine similarity of the normalized keypoint vectors.
+  oks:    1 - object keypoint similarity, using the COCO per-keypoint sigmas.
+
+PoseIndex does a vectorized brute force scan and is exact. PartitionedPoseIndex
+clusters the library with k-means, stores the normalized poses as uint8 codes
+and only scans the `nprobe` clusters closest to the query, which keeps queries
+in the millisecond range for libraries of millions of poses.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from pose_engine import (COCO_SIGMAS, STANDING_POSE, KeypointType, oks_matrix,
+                         poses_to_arrays)
+
+NUM_KEYPOINTS = len(KeypointType)
+
+METRICS = ('cosine', 'oks')
+
+_EPS = 1e-6
+
+
+def normalize_poses(keypoints, keypoint_scores, threshold=0.2):
+    """Normalizes poses for translation and scale.
+
+    Args:
+      keypoints: [N, 17, 2] or [17, 2] array of (x, y) keypoint positions.
+      keypoint_scores: [N, 17] or [17] array of keypoint scores.
+      threshold: Keypoints scoring below this are masked out.
+
+    Returns:
+      (normalized, mask) where normalized has the shape of keypoints, is
+      centered on the centroid of the visible keypoints, has unit RMS radius
+      and is zero for masked keypoints; mask is a float32 array of 0/1.
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float32)
+    keypoint_scores = np.asarray(keypoint_scores, dtype=np.float32)
+    single = keypoints.ndim == 2
+    if single:
+        keypoints = keypoints[np.newaxis]
+        keypoint_scores = keypoint_scores[np.newaxis]
+
+    mask = (keypoint_scores >= threshold).astype(np.float32)
+    count = np.maximum(mask.sum(axis=1, keepdims=True), 1.0)
+    center = (keypoints * mask[..., np.newaxis]).sum(axis=1) / count
+    centered = (keypoints - center[:, np.newaxis]) * mask[..., np.newaxis]
+    radius = np.sqrt((centered ** 2).sum(axis=(1, 2)) / count[:, 0])
+    normalized = centered / np.maximum(radius, _EPS)[:, np.newaxis, np.newaxis]
+
+    if single:
+        return normalized[0], mask[0]
+    return normalized, mask
+
+
+def cosine_distances(query, query_mask, refs, ref_mask):
+    """Weighted cosine distance between one normalized pose and many.
+
+    Only keypoints visible in both the query and the reference contribute.
+
+    Args:
+      query: [17, 2] normalized query pose.
+      query_mask: [17] keypoint weights of the query (0 masks a keypoint out).
+      refs: [N, 17, 2] normalized reference poses, zero where masked.
+      ref_mask: [N, 17] 0/1 visibility of the reference keypoints.
+
+    Returns:
+      [N] float32 array of distances in [0, 2].
+    """
+    weighted_query = query * query_mask[:, np.newaxis]
+    # No -1 in the shape, numpy can't infer it with no rows.
+    dot = refs.reshape(refs.shape[0], NUM_KEYPOINTS * 2) @ weighted_query.reshape(-1)
+    query_norm = ref_mask @ (query_mask * (query ** 2).sum(axis=1))
+    ref_norm = (refs ** 2).sum(axis=2) @ query_mask
+    similarity = dot / np.sqrt(np.maximum(query_norm * ref_norm, _EPS))
+    return (1.0 - similarity).astype(np.float32)
+
+
+def oks_distances(query, query_mask, refs, ref_mask, sigmas=COCO_SIGMAS):
+    """Object keypoint similarity distance between one normalized pose and many.
+
+    Positions are in normalized units (unit RMS radius), which stand in for
+    the object scale of the COCO definition.
+
+    Args:
+      query: [17, 2] normalized query pose.
+      query_mask: [17] keypoint weights of the query (0 masks a keypoint out).
+      refs: [N, 17, 2] normalized reference poses.
+      ref_mask: [N, 17] 0/1 visibility of the reference keypoints.
+      sigmas: [17] per-keypoint falloff.
+
+    Returns:
+      [N] float32 array of distances in [0, 1].
+    """
+    oks = oks_matrix(query[np.newaxis], query_mask[np.newaxis], refs, ref_mask, threshold=0.5,
+                     areas=np.ones(len(refs), dtype=np.float32), sigmas=sigmas)[0]
+    return (1.0 - oks).astype(np.float32)
+
+
+def _distances(metric, query, query_mask, refs, ref_mask):
+    if metric == 'cosine':
+        return cosine_distances(query, query_mask, refs, ref_mask)
+    if metric == 'oks':
+        return oks_distances(query, query_mask, refs, ref_mask)
+    raise ValueError('Unknown metric {}, expected one of {}.'.format(metric, METRICS))
+
+
+def _top_k(distances, k):
+    k = min(k, len(distances))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(distances, k - 1)[:k]
+    return top[np.argsort(distances[top], kind='stable')]
+
+
+class PoseIndex:
+    """Exact nearest-neighbor index over normalized poses."""
+
+    def __init__(self, metric='cosine', threshold=0.2):
+        """Creates an empty index.
+
+        Args:
+          metric: Distance used by search, one of METRICS.
+          threshold: Keypoint score below which keypoints are masked out.
+        """
+        if metric not in METRICS:
+            raise ValueError('Unknown metric {}, expected one of {}.'.format(metric, METRICS))
+        self.metric = metric
+        self.threshold = threshold
+        self._poses = np.zeros((0, NUM_KEYPOINTS, 2), dtype=np.float32)
+        self._masks = np.zeros((0, NUM_KEYPOINTS), dtype=np.float32)
+        self.labels = np.zeros(0, dtype=str)
+
+    def __len__(self):
+        return len(self._poses)
+
+    def add(self, keypoints, keypoint_scores, labels=None):
+        """Adds reference poses to the index.
+
+        Args:
+          keypoints: [N, 17, 2] array of (x, y) keypoint positions.
+          keypoint_scores: [N, 17] array of keypoint scores.
+          labels: Optional sequence of N strings naming the poses.
+        """
+        poses, masks = normalize_poses(keypoints, keypoint_scores, self.threshold)
+        if labels is None:
+            labels = [''] * len(poses)
+        self._poses = np.concatenate([self._poses, poses])
+        self._masks = np.concatenate([self._masks, masks])
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=str)])
+
+    def add_poses(self, poses, labels=None):
+        """Adds a list of Pose to the index."""
+        keypoints, keypoint_scores, _ = poses_to_arrays(poses)
+        self.add(keypoints, keypoint_scores, labels)
+
+    def search(self, keypoints, keypoint_scores, k=1):
+        """Finds the k reference poses closest to a query.
+
+        Args:
+          keypoints: [17, 2] array of (x, y) keypoint positions.
+          keypoint_scores: [17] array of keypoint scores.
+          k: Number of neighbors to return.
+
+        Returns:
+          (distances, indices), both of length min(k, len(self)), closest first.
+        """
+        query, query_mask = normalize_poses(keypoints, keypoint_scores, self.threshold)
+        distances = _distances(self.metric, query, query_mask, self._poses, self._masks)
+        top = _top_k(distances, k)
+        return distances[top], top
+
+    def search_pose(self, pose, k=1):
+        """Same as search but takes a Pose."""
+        keypoints, keypoint_scores, _ = poses_to_arrays([pose])
+        return self.search(keypoints[0], keypoint_scores[0], k)
+
+    def save(self, path):
+        """Writes the index to a .npz file."""
+        np.savez(path, kind='flat', metric=self.metric, threshold=self.threshold,
+                 poses=self._poses, masks=self._masks, labels=self.labels)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save."""
+        with np.load(path) as data:
+            index = cls(str(data['metric']), float(data['threshold']))
+            index._poses = data['poses']
+            index._masks = data['masks']
+            index.labels = data['labels']
+        return index
+
+
+def _kmeans(data, num_clusters, iterations=10, sample_size=65536, seed=0):
+    """Lloyd's k-means on a random sample of data, returns the centroids."""
+    rng = np.random.default_rng(seed)
+    if len(data) > sample_size:
+        data = data[rng.choice(len(data), sample_size, replace=False)]
+    centroids = data[rng.choice(len(data), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        counts = np.bincount(assignment, minlength=num_clusters)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, np.newaxis]
+        # Re-seed empty clusters so all lists get used.
+        centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def _assign(data, centroids, chunk_size=65536):
+    """Returns the index of the closest centroid for every row of data."""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignment = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        d2 = centroid_norms - 2.0 * chunk @ centroids.T
+        assignment[start:start + chunk_size] = np.argmin(d2, axis=1)
+    return assignment
+
+
+class PartitionedPoseIndex:
+    """Approximate nearest-neighbor index for large pose libraries.
+
+    Poses are partitioned into `num_lists` clusters with k-means and stored
+    as uint8 codes (8 bit scalar quantization of every normalized coordinate)
+    sorted by cluster, along with bit-packed visibility masks. A query
+    computes the exact distance to every member of the `nprobe` nearest
+    clusters, so recall trades off against speed through nprobe.
+
+    Unlike PoseIndex the library has to be given all at once to build.
+    """
+
+    def __init__(self, metric='cosine', threshold=0.2, num_lists=1024, nprobe=8):
+        """Creates an empty index.
+
+        Args:
+          metric: Distance used by search, one of METRICS.
+          threshold: Keypoint score below which keypoints are masked out.
+          num_lists: Number of k-means partitions.
+          nprobe: Number of partitions scanned per query.
+        """
+        if metric not in METRICS:
+            raise ValueError('Unknown metric {}, expected one of {}.'.format(metric, METRICS))
+        self.metric = metric
+        self.threshold = threshold
+        self.num_lists = num_lists
+        self.nprobe = nprobe
+        self._centroids = np.zeros((0, NUM_KEYPOINTS * 2), dtype=np.float32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._codes = np.zeros((0, NUM_KEYPOINTS * 2), dtype=np.uint8)
+        self._packed_masks = np.zeros((0, (NUM_KEYPOINTS + 7) // 8), dtype=np.uint8)
+        self._low = np.zeros(NUM_KEYPOINTS * 2, dtype=np.float32)
+        self._step = np.ones(NUM_KEYPOINTS * 2, dtype=np.float32)
+        self.labels = np.zeros(0, dtype=str)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def build(self, keypoints, keypoint_scores, labels=None, iterations=10, seed=0):
+        """Builds the index from the full library, replacing any previous content.
+
+        Args:
+          keypoints: [N, 17, 2] array of (x, y) keypoint positions.
+          keypoint_scores: [N, 17] array of keypoint scores.
+          labels: Optional sequence of N strings naming the poses.
+          iterations: Number of k-means iterations.
+          seed: Seed for k-means sampling and initialization.
+        """
+        poses, masks = normalize_poses(keypoints, keypoint_scores, self.threshold)
+        vectors = poses.reshape(len(poses), -1)
+        num_lists = min(self.num_lists, len(vectors))
+
+        self._centroids = _kmeans(vectors, num_lists, iterations, seed=seed)
+        assignment = _assign(vectors, self._centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=num_lists)
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._ids = order
+
+        self._low = vectors.min(axis=0)
+        self._step = np.maximum(vectors.max(axis=0) - self._low, _EPS) / 255.0
+        codes = np.rint((vectors[order] - self._low) / self._step)
+        self._codes = codes.astype(np.uint8)
+        self._packed_masks = np.packbits(masks[order].astype(bool), axis=1)
+
+        if labels is None:
+            labels = [''] * len(vectors)
+        self.labels = np.asarray(labels, dtype=str)
+
+    def build_from_poses(self, poses, labels=None, **kwargs):
+        """Builds the index from a list of Pose."""
+        keypoints, keypoint_scores, _ = poses_to_arrays(poses)
+        self.build(keypoints, keypoint_scores, labels, **kwargs)
+
+    def _candidates(self, query, query_mask):
+        # Compare only the coordinates visible in the query.
+        weights = np.repeat(query_mask, 2)
+        d2 = ((self._centroids - query.reshape(-1)) ** 2) @ weights
+        nprobe = min(self.nprobe, len(d2))
+        lists = np.argpartition(d2, nprobe - 1)[:nprobe]
+        return np.concatenate([np.arange(self._offsets[l], self._offsets[l + 1])
+                               for l in lists])
+
+    def search(self, keypoints, keypoint_scores, k=1):
+        """Finds approximately the k reference poses closest to a query.
+
+        Args:
+          keypoints: [17, 2] array of (x, y) keypoint positions.
+          keypoint_scores: [17] array of keypoint scores.
+          k: Number of neighbors to return.
+
+        Returns:
+          (distances, indices) closest first, indices refer to the order the
+          poses were given to build. Fewer than k results are returned if the
+          probed partitions hold fewer poses.
+        """
+        query, query_mask = normalize_poses(keypoints, keypoint_scores, self.threshold)
+        if not len(self):
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        rows = self._candidates(query, query_mask)
+
+        masks = np.unpackbits(self._packed_masks[rows], axis=1,
+                              count=NUM_KEYPOINTS).astype(np.float32)
+        refs = self._codes[rows] * self._step + self._low
+        refs = refs.reshape(len(rows), NUM_KEYPOINTS, 2) * masks[..., np.newaxis]
+
+        distances = _distances(self.metric, query, query_mask, refs, masks)
+        top = _top_k(distances, k)
+        return distances[top], self._ids[rows[top]]
+
+    def search_pose(self, pose, k=1):
+        """Same as search but takes a Pose."""
+        keypoints, keypoint_scores, _ = poses_to_arrays([pose])
+        return self.search(keypoints[0], keypoint_scores[0], k)
+
+    def save(self, path):
+        """Writes the index to a .npz file."""
+        np.savez(path, kind='partitioned', metric=self.metric, threshold=self.threshold,
+                 num_lists=self.num_lists, nprobe=self.nprobe,
+                 centroids=self._centroids, offsets=self._offsets, ids=self._ids,
+                 codes=self._codes, packed_masks=self._packed_masks,
+                 low=self._low, step=self._step, labels=self.labels)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save."""
+        with np.load(path) as data:
+            index = cls(str(data['metric']), float(data['threshold']),
+                        int(data['num_lists']), int(data['nprobe']))
+            index._centroids = data['centroids']
+            index._offsets = data['offsets']
+            index._ids = data['ids']
+            index._codes = data['codes']
+            index._packed_masks = data['packed_masks']
+            index._low = data['low']
+            index._step = data['step']
+            index.labels = data['labels']
+        return index
+
+
+def load_index(path):
+    """Reads either kind of index from a .npz file written by save."""
+    with np.load(path) as data:
+        kind = str(data['kind'])
+    if kind == 'partitioned':
+        return PartitionedPoseIndex.load(path)
+    return PoseIndex.load(path)
+
+
+def random_poses(num_poses, seed=0):
+    """Generates random but body-shaped poses, for benchmarks and tests."""
+    rng = np.random.default_rng(seed)
+    # The standing pose moved into a unit box.
+    template = STANDING_POSE + np.array([0.5, 0.05], dtype=np.float32)
+    jitter = rng.normal(0.0, 0.06, (num_poses, NUM_KEYPOINTS, 2)).astype(np.float32)
+    scale = rng.uniform(100, 400, (num_poses, 1, 1)).astype(np.float32)
+    offset = rng.uniform(0, 600, (num_poses, 1, 2)).astype(np.float32)
+    keypoints = (template + jitter) * scale + offset
+    keypoint_scores = rng.uniform(0.0, 1.0, (num_poses, NUM_KEYPOINTS)).astype(np.float32)
+    return keypoints, keypoint_scores
+
+
+def benchmark(library_size, num_queries, metric, num_lists, nprobe):
+    keypoints, keypoint_scores = random_poses(library_size, seed=0)
+    # Live poses resemble, but never exactly match, a reference pose.
+    rng = np.random.default_rng(1)
+    picks = rng.choice(library_size, num_queries)
+    queries = keypoints[picks] + rng.normal(0.0, 3.0, (num_queries, NUM_KEYPOINTS, 2))
+    query_scores = keypoint_scores[picks]
+
+    start = time.monotonic()
+    flat = PoseIndex(metric)
+    flat.add(keypoints, keypoint_scores)
+    print('PoseIndex: built %d poses in %.1f s' % (library_size, time.monotonic() - start))
+
+    start = time.monotonic()
+    partitioned = PartitionedPoseIndex(metric, num_lists=num_lists, nprobe=nprobe)
+    partitioned.build(keypoints, keypoint_scores)
+    print('PartitionedPoseIndex: built %d poses in %.1f s' %
+          (library_size, time.monotonic() - start))
+
+    flat_time = partitioned_time = 0.0
+    hits = 0
+    for query, query_score in zip(queries, query_scores):
+        start = time.monotonic()
+        _, expected = flat.search(query, query_score, k=1)
+        flat_time += time.monotonic() - start
+        start = time.monotonic()
+        _, found = partitioned.search(query, query_score, k=10)
+        partitioned_time += time.monotonic() - start
+        hits += int(expected[0] in found)
+
+    print('PoseIndex: %.2f ms/query' % (1000 * flat_time / num_queries))
+    print('PartitionedPoseIndex: %.2f ms/query, recall@10 %.3f' %
+          (1000 * partitioned_time / num_queries, hits / num_queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--library_size', type=int, default=1000000,
+                        help='Number of random reference poses.')
+    parser.add_argument('--queries', type=int, default=100, help='Number of queries.')
+    parser.add_argument('--metric', default='cosine', choices=METRICS)
+    parser.add_argument('--num_lists', type=int, default=1024, help='k-means partitions.')
+    parser.add_argument('--nprobe', type=int, default=8, help='Partitions scanned per query.')
+    args = parser.parse_args()
+    benchmark(args.library_size, args.queries, args.metric, args.num_lists, args.nprobe)
+
+
+if __name__ == '__main__':
+    main()
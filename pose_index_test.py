@@ -0,0 +1,95 @@
+# Lint as: python3
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import pose_index
+
+
+class PoseIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.keypoints, self.scores = pose_index.random_poses(2000, seed=3)
+        self.scores = np.maximum(self.scores, 0.5)
+
+    def test_normalization_is_translation_and_scale_invariant(self):
+        a, mask_a = pose_index.normalize_poses(self.keypoints[0], self.scores[0])
+        b, mask_b = pose_index.normalize_poses(self.keypoints[0] * 3 + 50, self.scores[0])
+        np.testing.assert_allclose(a, b, atol=1e-4)
+        np.testing.assert_array_equal(mask_a, mask_b)
+
+    def test_masked_keypoints_are_ignored(self):
+        index = pose_index.PoseIndex()
+        index.add(self.keypoints, self.scores)
+        query = self.keypoints[7].copy()
+        query_scores = self.scores[7].copy()
+        query[9] = (10000, 10000)
+        query_scores[9] = 0.0
+        distances, indices = index.search(query, query_scores, k=1)
+        self.assertEqual(indices[0], 7)
+
+    def test_exact_match(self):
+        for metric in pose_index.METRICS:
+            index = pose_index.PoseIndex(metric)
+            index.add(self.keypoints, self.scores, labels=[str(i) for i in range(2000)])
+            distances, indices = index.search(self.keypoints[42] + 5, self.scores[42], k=3)
+            self.assertEqual(indices[0], 42)
+            self.assertEqual(index.labels[indices[0]], '42')
+            self.assertAlmostEqual(distances[0], 0.0, delta=1e-4)
+            self.assertTrue(np.all(np.diff(distances) >= 0))
+
+    def test_empty_index(self):
+        for metric in pose_index.METRICS:
+            for index in (pose_index.PoseIndex(metric), pose_index.PartitionedPoseIndex(metric)):
+                distances, indices = index.search(self.keypoints[0], self.scores[0], k=3)
+                self.assertEqual((len(distances), len(indices)), (0, 0))
+
+    def test_partitioned_matches_flat(self):
+        for metric in pose_index.METRICS:
+            flat = pose_index.PoseIndex(metric)
+            flat.add(self.keypoints, self.scores)
+            partitioned = pose_index.PartitionedPoseIndex(metric, num_lists=16, nprobe=4)
+            partitioned.build(self.keypoints, self.scores)
+            hits = 0
+            for i in range(0, 2000, 50):
+                _, expected = flat.search(self.keypoints[i], self.scores[i], k=1)
+                _, found = partitioned.search(self.keypoints[i], self.scores[i], k=5)
+                hits += int(expected[0] in found)
+            self.assertGreaterEqual(hits, 36)
+
+    def test_save_and_load(self):
+        partitioned = pose_index.PartitionedPoseIndex(num_lists=8, nprobe=8)
+        partitioned.build(self.keypoints, self.scores, labels=['squat'] * 2000)
+        flat = pose_index.PoseIndex('oks')
+        flat.add(self.keypoints, self.scores)
+        with tempfile.TemporaryDirectory() as tmp:
+            for index in (partitioned, flat):
+                path = os.path.join(tmp, type(index).__name__ + '.npz')
+                index.save(path)
+                loaded = pose_index.load_index(path)
+                self.assertIsInstance(loaded, type(index))
+                self.assertEqual(loaded.metric, index.metric)
+                expected = index.search(self.keypoints[5], self.scores[5], k=4)
+                found = loaded.search(self.keypoints[5], self.scores[5], k=4)
+                np.testing.assert_array_equal(expected[1], found[1])
+                np.testing.assert_array_equal(index.labels, loaded.labels)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Draws poses straight into video frames, without an SVG round trip.
+
+The rsvgoverlay path builds an SVG document for every frame, which
+rsvgoverlay then parses, rasterizes into a full frame ARGB surface and
+blends over the video. PoseDrawer instead writes the pixels of all skeleton
+lines and keypoints of all people into the frame in place, with one indexed
+write per primitive type:
+
+    drawer = pose_overlay.PoseDrawer()
+    drawer.draw(frame, pose_overlay.Overlay(keypoints, keypoint_scores, 'text'))
+
+Render callbacks return an Overlay instead of an SVG string to use it with
+gstreamer's poseoverlay element; to_svg() keeps them working with
+rsvgoverlay.
+"""
+
+import argparse
+import collections
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+import svgwrite
+
+from pose_engine import KeypointType
+
+EDGES = (
+    (KeypointType.NOSE, KeypointType.LEFT_EYE),
+    (KeypointType.NOSE, KeypointType.RIGHT_EYE),
+    (KeypointType.NOSE, KeypointType.LEFT_EAR),
+    (KeypointType.NOSE, KeypointType.RIGHT_EAR),
+    (KeypointType.LEFT_EAR, KeypointType.LEFT_EYE),
+    (KeypointType.RIGHT_EAR, KeypointType.RIGHT_EYE),
+    (KeypointType.LEFT_EYE, KeypointType.RIGHT_EYE),
+    (KeypointType.LEFT_SHOULDER, KeypointType.RIGHT_SHOULDER),
+    (KeypointType.LEFT_SHOULDER, KeypointType.LEFT_ELBOW),
+    (KeypointType.LEFT_SHOULDER, KeypointType.LEFT_HIP),
+    (KeypointType.RIGHT_SHOULDER, KeypointType.RIGHT_ELBOW),
+    (KeypointType.RIGHT_SHOULDER, KeypointType.RIGHT_HIP),
+    (KeypointType.LEFT_ELBOW, KeypointType.LEFT_WRIST),
+    (KeypointType.RIGHT_ELBOW, KeypointType.RIGHT_WRIST),
+    (KeypointType.LEFT_HIP, KeypointType.RIGHT_HIP),
+    (KeypointType.LEFT_HIP, KeypointType.LEFT_KNEE),
+    (KeypointType.RIGHT_HIP, KeypointType.RIGHT_KNEE),
+    (KeypointType.LEFT_KNEE, KeypointType.LEFT_ANKLE),
+    (KeypointType.RIGHT_KNEE, KeypointType.RIGHT_ANKLE),
+)
+
+# Offsets of the color channels in a pixel, by GStreamer video format.
+CHANNELS = {
+    'RGB': (0, 1, 2), 'BGR': (2, 1, 0),
+    'RGBx': (0, 1, 2), 'BGRx': (2, 1, 0), 'xRGB': (1, 2, 3), 'xBGR': (3, 2, 1),
+    'RGBA': (0, 1, 2), 'BGRA': (2, 1, 0), 'ARGB': (1, 2, 3), 'ABGR': (3, 2, 1),
+}
+
+YELLOW = (255, 255, 0)
+CYAN = (0, 255, 255)
+
+Overlay = collections.namedtuple('Overlay', ['keypoints', 'keypoint_scores', 'text'])
+Overlay.__doc__ = """What to draw over one frame.
+
+  keypoints: [N, 17, 2] keypoints in source frame coordinates.
+  keypoint_scores: [N, 17] keypoint scores.
+  text: Status line for the top left corner, or None.
+"""
+
+
+def _disk(radius):
+    """Returns [K, 2] (dy, dx) offsets of a filled disk."""
+    r = int(np.ceil(radius))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dy * dy + dx * dx <= radius * radius
+    return np.stack([dy[inside], dx[inside]], axis=1)
+
+
+class PoseDrawer:
+    """Draws skeletons and a status line into [H, W, C] uint8 frames in place."""
+
+    def __init__(self, threshold=0.2, color=YELLOW, point_color=CYAN, radius=5,
+                 line_width=2, channels=(0, 1, 2)):
+        """Creates a drawer.
+
+        Args:
+          threshold: Keypoints scoring below this are not drawn.
+          color: RGB of the lines and keypoint outlines.
+          point_color: RGB of the keypoints, blended by keypoint score.
+          radius: Keypoint radius in pixels.
+          line_width: Line width in pixels.
+          channels: Offsets of R, G and B within a pixel, see CHANNELS.
+        """
+        self.threshold = threshold
+        self.color = np.array(color, dtype=np.uint8)
+        self.point_color = np.array(point_color, dtype=np.float32)
+        self.channels = np.array(channels, dtype=np.int32)
+        self._fill = _disk(radius - 1).astype(np.int32)
+        self._outline = _disk(radius).astype(np.int32)
+        self._outline = self._outline[(self._outline ** 2).sum(axis=1) > (radius - 1) ** 2]
+        # Lines are widened across their major axis, centered.
+        self._pen = (np.arange(line_width) - (line_width - 1) // 2).astype(np.int32)
+        self._edges = np.array(EDGES)
+        self._text_cache = {}
+        self._font = ImageFont.load_default()
+
+    def draw(self, frame, overlay):
+        """Draws an Overlay into a frame."""
+        if len(overlay.keypoints):
+            self.draw_poses(frame, overlay.keypoints, overlay.keypoint_scores)
+        if overlay.text:
+            self.draw_text(frame, 10, 10, overlay.text)
+
+    def draw_poses(self, frame, keypoints, keypoint_scores):
+        """Draws all poses, with one indexed write for all lines and two for all keypoints.
+
+        Args:
+          frame: [H, W, C] uint8 array, possibly with padded rows.
+          keypoints: [N, 17, 2] (x, y) in frame pixels.
+          keypoint_scores: [N, 17] scores.
+        """
+        keypoints = np.asarray(keypoints, dtype=np.float32)
+        visible = ((np.asarray(keypoint_scores) >= self.threshold) &
+                   np.isfinite(keypoints).all(axis=2))
+        # All lines of all people, [L, 2] (y, x) endpoints.
+        a, b = self._edges[:, 0], self._edges[:, 1]
+        drawn = visible[:, a] & visible[:, b]
+        starts = keypoints[:, a][drawn][:, ::-1]
+        ends = keypoints[:, b][drawn][:, ::-1]
+        # One sample per pixel of length.
+        counts = np.ceil(np.abs(ends - starts).max(axis=1, initial=0)).astype(np.int64) + 1
+        line = np.repeat(np.arange(len(counts)), counts)
+        step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        t = (step / np.maximum(counts - 1, 1)[line])[:, np.newaxis]
+        points = np.rint(starts[line] + (ends[line] - starts[line]) * t).astype(np.int32)
+        minor = np.eye(2, dtype=np.int32)[1 - np.abs(ends - starts).argmax(axis=1)][line]
+        self._write(frame, points[:, np.newaxis] + self._pen[:, np.newaxis] * minor[:, np.newaxis],
+                    self.color)
+
+        centers = np.rint(keypoints[visible][:, ::-1]).astype(np.int32)[:, np.newaxis]
+        scores = np.asarray(keypoint_scores, dtype=np.float32)[visible]
+        self._blend(frame, centers + self._fill, scores)
+        self._write(frame, centers + self._outline, self.color)
+
+    def draw_text(self, frame, x, y, text):
+        """Draws white text with a black shadow, top left corner at (x, y)."""
+        mask = self._text_cache.get(text)
+        if mask is None:
+            if len(self._text_cache) > 64:
+                self._text_cache.clear()
+            _, _, right, bottom = self._font.getbbox(text)
+            image = Image.new('L', (right + 1, bottom + 1))
+            ImageDraw.Draw(image).text((0, 0), text, fill=255, font=self._font)
+            mask = self._text_cache[text] = np.argwhere(np.asarray(image) > 127).astype(np.int32)
+        origin = np.array([y, x], dtype=np.int32)
+        self._write(frame, mask + origin + 1, 0)
+        self._write(frame, mask + origin, 255)
+
+    def _pixels(self, frame, pixels):
+        """Returns the flat channel indices of [..., 2] (y, x) pixels inside the frame.
+
+        Also returns which of the pixels, flattened, are inside.
+        """
+        pixels = pixels.reshape(-1, 2)
+        # Negative coordinates wrap around to large unsigned ones.
+        inside = ((pixels[:, 0].view(np.uint32) < frame.shape[0]) &
+                  (pixels[:, 1].view(np.uint32) < frame.shape[1]))
+        pixels = pixels[inside]
+        base = pixels[:, 0] * frame.strides[0] + pixels[:, 1] * frame.strides[1]
+        return base[:, np.newaxis] + self.channels, inside
+
+    def _write(self, frame, pixels, color):
+        index, _ = self._pixels(frame, pixels)
+        _flat(frame)[index] = color
+
+    def _blend(self, frame, pixels, scores):
+        """Blends point_color over [N, K, 2] pixels with N alphas."""
+        index, inside = self._pixels(frame, pixels)
+        alpha = np.repeat(scores, pixels.shape[1])[inside, np.newaxis]
+        flat = _flat(frame)
+        flat[index] = (flat[index] * (1 - alpha) + self.point_color * alpha + 0.5).astype(
+            np.uint8)
+
+
+def _flat(frame):
+    """Returns a 1D view of the bytes of a frame with padded rows."""
+    assert frame.dtype == np.uint8 and frame.strides[2] == 1
+    size = (frame.shape[0] - 1) * frame.strides[0] + frame.shape[1] * frame.strides[1]
+    return np.lib.stride_tricks.as_strided(frame, shape=(size,), strides=(1,))
+
+
+def to_svg(overlay, src_size, threshold=0.2, color='yellow'):
+    """Returns the SVG document of an Overlay, for rsvgoverlay."""
+    dwg = svgwrite.Drawing('', size=src_size)
+    if overlay.text:
+        for (x, y), fill in (((11, 21), 'black'), ((10, 20), 'white')):
+            dwg.add(dwg.text(overlay.text, insert=(x, y), fill=fill, font_size=16,
+                             style='font-family:sans-serif'))
+    for keypoints, scores in zip(overlay.keypoints, overlay.keypoint_scores):
+        visible = scores >= threshold
+        for a, b in EDGES:
+            if visible[a] and visible[b]:
+                dwg.add(dwg.line(start=tuple(int(v) for v in keypoints[a]),
+                                 end=tuple(int(v) for v in keypoints[b]),
+                                 stroke=color, stroke_width=2))
+        for (x, y), score in zip(keypoints[visible], scores[visible]):
+            dwg.add(dwg.circle(center=(int(x), int(y)), r=5, fill='cyan',
+                               fill_opacity=float(score), stroke=color))
+    return dwg.tostring()
+
+
+def _rsvg_renderer():
+    """Returns a function rendering SVG over a frame like rsvgoverlay, or None."""
+    try:
+        import cairo
+        import gi
+        gi.require_version('Rsvg', '2.0')
+        from gi.repository import Rsvg
+    except (ImportError, ValueError):
+        return None
+
+    def render(frame, svg):
+        # rsvgoverlay parses the document, draws it on a transparent ARGB
+        # surface of the frame size and blends the surface over the frame.
+        height, width = frame.shape[:2]
+        handle = Rsvg.Handle.new_from_data(svg.encode())
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        handle.render_cairo(cairo.Context(surface))
+        argb = np.ndarray((height, width, 4), np.uint8, surface.get_data())
+        alpha = argb[..., 3:] / 255
+        frame[...] = (frame * (1 - alpha) + argb[..., 2::-1]).astype(np.uint8)
+    return render
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    # Imported here, keypoint_crops is only needed for the synthetic people.
+    from keypoint_crops import random_people
+
+    rsvg = _rsvg_renderer()
+    if not rsvg:
+        print('Rsvg not found, the SVG column only includes building the document.')
+    rng = np.random.RandomState(0)
+    drawer = PoseDrawer()
+    print('%10s %6s %10s %10s %10s' % ('frame', 'people', 'direct ms', 'svg ms', 'speedup'))
+    for frame_size in ((640, 480), (1280, 720)):
+        frame = rng.randint(0, 256, (frame_size[1], frame_size[0], 3), dtype=np.uint8)
+        for people in (1, 5, 10):
+            keypoints, scores = random_people(people, frame_size, rng)
+            overlay = Overlay(keypoints, scores, 'PoseNet: 12.3ms (81.30 fps) Nposes %d' % people)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                drawer.draw(frame, overlay)
+            direct = (time.perf_counter() - start) / args.repeat * 1000
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                svg = to_svg(overlay, frame_size)
+                if rsvg:
+                    rsvg(frame, svg)
+            svg_ms = (time.perf_counter() - start) / args.repeat * 1000
+            print('%10s %6d %10.2f %10.2f %9.1fx' % ('%dx%d' % frame_size, people, direct, svg_ms,
+                                                    svg_ms / direct))
+
+
+if __name__ == '__main__':
+    main()
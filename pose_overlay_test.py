@@ -0,0 +1,82 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+import pose_overlay
+from pose_engine import KeypointType
+
+
+def arm(scores=(1.0, 1.0)):
+    """One pose with only a left elbow at (10, 20) and wrist at (40, 20)."""
+    keypoints = np.zeros((1, 17, 2), dtype=np.float32)
+    keypoint_scores = np.zeros((1, 17), dtype=np.float32)
+    keypoints[0, KeypointType.LEFT_ELBOW] = (10, 20)
+    keypoints[0, KeypointType.LEFT_WRIST] = (40, 20)
+    keypoint_scores[0, [KeypointType.LEFT_ELBOW, KeypointType.LEFT_WRIST]] = scores
+    return keypoints, keypoint_scores
+
+
+class PoseOverlayTest(unittest.TestCase):
+
+    def test_line_and_keypoints(self):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        pose_overlay.PoseDrawer().draw_poses(frame, *arm())
+        yellow = (frame == pose_overlay.YELLOW).all(axis=2)
+        # The line is two pixels wide between the keypoints.
+        self.assertTrue(yellow[20, 16:35].all())
+        self.assertTrue(yellow[19, 16:35].all() or yellow[21, 16:35].all())
+        self.assertFalse(yellow[:15].any())
+        # Keypoints are cyan inside a yellow outline.
+        np.testing.assert_array_equal(frame[20, 10], pose_overlay.CYAN)
+        self.assertTrue(yellow[20, 5] and yellow[15, 10])
+
+    def test_threshold_and_blending(self):
+        frame = np.full((48, 64, 3), 100, dtype=np.uint8)
+        pose_overlay.PoseDrawer().draw_poses(frame, *arm(scores=(0.5, 0.1)))
+        # No line to a hidden wrist, and the elbow is half transparent.
+        self.assertTrue((frame[:, 30:] == 100).all())
+        np.testing.assert_array_equal(frame[20, 10], (50, 178, 178))
+
+    def test_padded_bgrx_frame(self):
+        buffer = np.zeros((48, 300), dtype=np.uint8)  # 64 * 4 bytes of pixels, then padding.
+        frame = np.ndarray((48, 64, 4), np.uint8, buffer, strides=(300, 4, 1))
+        drawer = pose_overlay.PoseDrawer(channels=pose_overlay.CHANNELS['BGRx'])
+        # Off the frame, partly and completely.
+        keypoints, keypoint_scores = arm()
+        keypoints = np.concatenate([keypoints, keypoints + 60, keypoints + 1000])
+        drawer.draw_poses(frame, keypoints, np.repeat(keypoint_scores, 3, axis=0))
+        np.testing.assert_array_equal(frame[20, 10], (255, 255, 0, 0))
+        self.assertFalse(buffer[:, 256:].any())
+        self.assertEqual(frame[..., 3].max(), 0)
+
+    def test_text(self):
+        frame = np.full((40, 200, 3), 100, dtype=np.uint8)
+        drawer = pose_overlay.PoseDrawer()
+        drawer.draw(frame, pose_overlay.Overlay(np.zeros((0, 17, 2)), np.zeros((0, 17)), 'Hi'))
+        self.assertTrue((frame == 255).all(axis=2).any())
+        self.assertTrue((frame == 0).all(axis=2).any())
+        self.assertTrue((frame[:10] == 100).all())
+
+    def test_to_svg(self):
+        svg = pose_overlay.to_svg(pose_overlay.Overlay(*arm(), 'status'), (64, 48))
+        self.assertEqual(svg.count('<line'), 1)
+        self.assertEqual(svg.count('<circle'), 2)
+        self.assertIn('status', svg)
+
+
+if __name__ == '__main__':
+    unittest.main()
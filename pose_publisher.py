@@ -0,0 +1,468 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Publishes poses to other processes over a local socket.
+
+Every frame is sent as one length-prefixed binary message:
+
+  header: version (u8), frame number (u32), timestamp (f64), poses (u16)
+  per pose: track id (u32), pose score (u8), flags (u8), keypoint mask (u32),
+    one score (u8) per keypoint in the mask, then (x, y) per keypoint in the
+    mask, either absolute (i16 each) or, if the DELTA flag is set, relative
+    to the last position sent for the same track (i8 each).
+
+Coordinates are quantized to 1/16 pixel, from -2048 to 2047 pixels so that
+people partly outside the frame keep their keypoints, and scores to 1/255.
+Only keypoints scoring at least the threshold are in the mask. Deltas are
+used when every keypoint in the mask was sent for the track before and moved
+less than 8 pixels.
+
+Every subscriber has its own sender thread and a short buffer of frames.
+When a subscriber falls behind, its oldest frames are dropped, so publish()
+never blocks the render loop. Since deltas are encoded per subscriber
+against what that subscriber actually received, dropped frames never
+corrupt the deltas.
+"""
+
+import argparse
+import collections
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from pose_engine import KEYPOINT_QUANTIZATION, SCORE_QUANTIZATION, poses_to_arrays
+from pose_tracker import PoseTracker
+
+VERSION = 2
+NUM_KEYPOINTS = 17
+DELTA = 0x01
+
+_LENGTH = struct.Struct('<I')
+_HEADER = struct.Struct('<BIdH')
+_POSE = struct.Struct('<IBBI')
+_BITS = 1 << np.arange(NUM_KEYPOINTS, dtype=np.int64)
+
+Frame = collections.namedtuple(
+    'Frame', ['number', 'timestamp', 'track_ids', 'keypoints', 'keypoint_scores', 'pose_scores'])
+Frame.__doc__ = """Poses of one frame.
+
+  number: Frame number, counting every published frame.
+  timestamp: Publisher time.monotonic() of the frame.
+  track_ids: [N] int64 track ids.
+  keypoints: [N, 17, 2] float32 (x, y), NaN for keypoints not sent.
+  keypoint_scores: [N, 17] float32 scores, 0 for keypoints not sent.
+  pose_scores: [N] float32 pose scores.
+"""
+
+
+def parse_address(address):
+    """Returns a socket address: (host, port) for 'host:port', else a Unix path."""
+    if isinstance(address, tuple):
+        return address
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+def _socket_family(address):
+    return socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+
+
+def quantize(keypoints, keypoint_scores, pose_scores):
+    """Quantizes float pose arrays to the wire format resolution.
+
+    Returns:
+      (keypoints, keypoint_scores, pose_scores) as int32, uint8 and uint8.
+    """
+    keypoint_scale = KEYPOINT_QUANTIZATION[0]
+    score_scale = SCORE_QUANTIZATION[0]
+    keypoints = np.nan_to_num(np.asarray(keypoints, dtype=np.float32) / keypoint_scale)
+    return (np.clip(np.round(keypoints), -0x8000, 0x7fff).astype(np.int32),
+            np.clip(np.round(np.asarray(keypoint_scores) / score_scale), 0, 255).astype(np.uint8),
+            np.clip(np.round(np.asarray(pose_scores) / score_scale), 0, 255).astype(np.uint8))
+
+
+def encode_frame(number, timestamp, track_ids, keypoints, keypoint_scores, pose_scores,
+                 state, min_score=0):
+    """Encodes one frame of quantized poses.
+
+    Args:
+      number: Frame number.
+      timestamp: Frame time in seconds.
+      track_ids: [N] track ids.
+      keypoints, keypoint_scores, pose_scores: Quantized arrays, see quantize.
+      state: Dict of track id to (positions, known) as last sent to the
+        receiver, replaced by the state after this frame.
+      min_score: Quantized keypoint scores below this are not sent.
+
+    Returns:
+      The message, without length prefix.
+    """
+    parts = [_HEADER.pack(VERSION, number & 0xffffffff, timestamp, len(track_ids))]
+    new_state = {}
+    for i, track_id in enumerate(track_ids):
+        visible = keypoint_scores[i] >= min_score
+        positions = keypoints[i][visible]
+        flags = 0
+        previous = state.get(int(track_id))
+        if previous is not None and previous[1][visible].all():
+            delta = positions - previous[0][visible]
+            if delta.size == 0 or np.abs(delta).max() <= 127:
+                flags = DELTA
+        parts.append(_POSE.pack(int(track_id) & 0xffffffff, int(pose_scores[i]), flags,
+                                int(_BITS[visible].sum())))
+        parts.append(keypoint_scores[i][visible].tobytes())
+        if flags & DELTA:
+            parts.append(delta.astype(np.int8).tobytes())
+        else:
+            parts.append(positions.astype('<i2').tobytes())
+        if previous is None:
+            previous = (np.zeros((NUM_KEYPOINTS, 2), dtype=np.int32),
+                        np.zeros(NUM_KEYPOINTS, dtype=bool))
+        updated = previous[0].copy()
+        updated[visible] = positions
+        new_state[int(track_id)] = (updated, previous[1] | visible)
+    state.clear()
+    state.update(new_state)
+    return b''.join(parts)
+
+
+def decode_frame(data, state):
+    """Decodes a message of encode_frame.
+
+    Args:
+      data: The message, without length prefix.
+      state: Dict kept by the receiver across frames, updated in place.
+
+    Returns:
+      Frame.
+
+    Raises:
+      ValueError: If the message is malformed or refers to an unknown track.
+    """
+    version, number, timestamp, count = _HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError('Unsupported message version {}.'.format(version))
+    offset = _HEADER.size
+    track_ids = np.zeros(count, dtype=np.int64)
+    keypoints = np.full((count, NUM_KEYPOINTS, 2), np.nan, dtype=np.float32)
+    keypoint_scores = np.zeros((count, NUM_KEYPOINTS), dtype=np.float32)
+    pose_scores = np.zeros(count, dtype=np.float32)
+    new_state = {}
+    for i in range(count):
+        track_id, pose_score, flags, mask = _POSE.unpack_from(data, offset)
+        offset += _POSE.size
+        visible = (mask & _BITS) != 0
+        num_visible = int(visible.sum())
+        scores = np.frombuffer(data, dtype=np.uint8, count=num_visible, offset=offset)
+        offset += num_visible
+        if flags & DELTA:
+            if track_id not in state:
+                raise ValueError('Delta for unknown track {}.'.format(track_id))
+            delta = np.frombuffer(data, dtype=np.int8, count=2 * num_visible, offset=offset)
+            offset += 2 * num_visible
+            positions = state[track_id][visible] + delta.reshape(-1, 2)
+        else:
+            positions = np.frombuffer(data, dtype='<i2', count=2 * num_visible, offset=offset)
+            offset += 4 * num_visible
+            positions = positions.reshape(-1, 2).astype(np.int32)
+        updated = state.get(track_id, np.zeros((NUM_KEYPOINTS, 2), dtype=np.int32)).copy()
+        updated[visible] = positions
+        new_state[track_id] = updated
+
+        track_ids[i] = track_id
+        pose_scores[i] = pose_score * SCORE_QUANTIZATION[0]
+        keypoint_scores[i, visible] = scores * SCORE_QUANTIZATION[0]
+        keypoints[i, visible] = positions * KEYPOINT_QUANTIZATION[0]
+    if offset != len(data):
+        raise ValueError('Message has {} trailing bytes.'.format(len(data) - offset))
+    state.clear()
+    state.update(new_state)
+    return Frame(number, timestamp, track_ids, keypoints, keypoint_scores, pose_scores)
+
+
+class _Subscriber:
+
+    def __init__(self, connection, max_pending):
+        self.connection = connection
+        self.frames = collections.deque(maxlen=max_pending)
+        self.condition = threading.Condition()
+        self.state = {}
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+
+
+class PosePublisher:
+    """Sends poses to any number of subscribers over a local socket."""
+
+    def __init__(self, address, max_pending=4, threshold=0.2, tracker=None, send_buffer=2048):
+        """Creates a publisher listening on address.
+
+        Args:
+          address: Unix socket path, or (host, port) / 'host:port' for TCP.
+          max_pending: Frames buffered per subscriber before the oldest are
+            dropped.
+          threshold: Keypoints scoring below this are not sent.
+          tracker: PoseTracker assigning track ids, a new one by default.
+          send_buffer: Socket send buffer size in bytes. Frames in the
+            kernel buffer can't be dropped any more, so a small buffer keeps
+            slow subscribers from lagging behind.
+        """
+        self.address = parse_address(address)
+        self.max_pending = max_pending
+        self.send_buffer = send_buffer
+        self.min_score = int(np.ceil(threshold / SCORE_QUANTIZATION[0]))
+        self.tracker = tracker or PoseTracker(threshold)
+        self.frame_number = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.unlink(self.address)
+        self._server = socket.socket(_socket_family(self.address), socket.SOCK_STREAM)
+        if isinstance(self.address, tuple):
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(self.address)
+        self._server.listen()
+        if isinstance(self.address, tuple):
+            self.address = self._server.getsockname()
+        self._accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._accept_thread.start()
+
+    @property
+    def num_subscribers(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stats(self):
+        """Returns a list of (frames sent, frames dropped) per subscriber."""
+        with self._lock:
+            return [(s.sent, s.dropped) for s in self._subscribers]
+
+    def publish(self, poses, timestamp=None):
+        """Same as publish_arrays but takes a list of Pose."""
+        self.publish_arrays(*poses_to_arrays(poses), timestamp=timestamp)
+
+    def publish_arrays(self, keypoints, keypoint_scores, pose_scores, timestamp=None):
+        """Queues the poses of a frame for every subscriber, never blocking.
+
+        Args:
+          keypoints: [N, 17, 2] keypoints, e.g. in source image coordinates.
+          keypoint_scores: [N, 17] keypoint scores.
+          pose_scores: [N] pose scores.
+          timestamp: Frame time, defaults to time.monotonic().
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        track_ids = self.tracker.update(keypoints, keypoint_scores)
+        frame = (self.frame_number, timestamp, track_ids) + quantize(
+            keypoints, keypoint_scores, pose_scores)
+        self.frame_number += 1
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            with subscriber.condition:
+                if len(subscriber.frames) == subscriber.frames.maxlen:
+                    subscriber.dropped += 1
+                subscriber.frames.append(frame)
+                subscriber.condition.notify()
+
+    def close(self):
+        """Disconnects all subscribers and stops listening."""
+        self._closed = True
+        try:
+            # Wakes up accept().
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            self._remove(subscriber)
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                break
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+            subscriber = _Subscriber(connection, self.max_pending)
+            with self._lock:
+                self._subscribers.append(subscriber)
+            threading.Thread(target=self._send_loop, args=(subscriber,), daemon=True).start()
+
+    def _send_loop(self, subscriber):
+        while True:
+            with subscriber.condition:
+                while not subscriber.frames and not subscriber.closed:
+                    subscriber.condition.wait()
+                if subscriber.closed:
+                    break
+                frame = subscriber.frames.popleft()
+            message = encode_frame(*frame, state=subscriber.state, min_score=self.min_score)
+            try:
+                subscriber.connection.sendall(_LENGTH.pack(len(message)) + message)
+            except OSError:
+                break
+            subscriber.sent += 1
+        self._remove(subscriber)
+
+    def _remove(self, subscriber):
+        with subscriber.condition:
+            subscriber.closed = True
+            subscriber.condition.notify()
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+        subscriber.connection.close()
+
+
+class PoseSubscriber:
+    """Receives the frames of a PosePublisher."""
+
+    def __init__(self, address, timeout=None):
+        """Connects to a publisher.
+
+        Args:
+          address: Address the publisher listens on.
+          timeout: Seconds receive may wait for a frame, None to wait forever.
+        """
+        address = parse_address(address)
+        self._socket = socket.socket(_socket_family(address), socket.SOCK_STREAM)
+        self._socket.connect(address)
+        self._socket.settimeout(timeout)
+        self._file = self._socket.makefile('rb')
+        self._state = {}
+
+    def receive(self):
+        """Returns the next Frame, None once the publisher is gone."""
+        prefix = self._file.read(_LENGTH.size)
+        if len(prefix) < _LENGTH.size:
+            return None
+        (length,) = _LENGTH.unpack(prefix)
+        data = self._file.read(length)
+        if len(data) < length:
+            return None
+        return decode_frame(data, self._state)
+
+    def __iter__(self):
+        while True:
+            frame = self.receive()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+def moving_poses(num_poses, num_frames, seed=0):
+    """Yields (keypoints, keypoint_scores, pose_scores) of people walking about."""
+    from pose_index import random_poses
+    rng = np.random.default_rng(seed)
+    keypoints, keypoint_scores = random_poses(num_poses, seed)
+    pose_scores = rng.uniform(0.3, 1.0, num_poses).astype(np.float32)
+    velocity = rng.normal(0.0, 2.0, (num_poses, 1, 2)).astype(np.float32)
+    for _ in range(num_frames):
+        keypoints = keypoints + velocity + rng.normal(0.0, 0.5, keypoints.shape).astype(np.float32)
+        yield np.clip(keypoints, 0, 2000), keypoint_scores, pose_scores
+
+
+def benchmark(address, num_subscribers, num_poses, num_frames, rate, slow_subscriber):
+    publisher = PosePublisher(address)
+    latencies = [[] for _ in range(num_subscribers)]
+    sizes = []
+
+    def receive(index, delay):
+        subscriber = PoseSubscriber(publisher.address)
+        for frame in subscriber:
+            latencies[index].append(time.monotonic() - frame.timestamp)
+            if delay:
+                time.sleep(delay)
+        subscriber.close()
+
+    threads = [threading.Thread(target=receive, args=(i, 0.0)) for i in range(num_subscribers)]
+    if slow_subscriber:
+        latencies.append([])
+        threads.append(threading.Thread(target=receive, args=(num_subscribers, 0.05)))
+    for thread in threads:
+        thread.start()
+    while publisher.num_subscribers < len(threads):
+        time.sleep(0.01)
+
+    publish_times = []
+    state = {}
+    start = time.monotonic()
+    for i, (keypoints, keypoint_scores, pose_scores) in enumerate(
+            moving_poses(num_poses, num_frames)):
+        publish_start = time.monotonic()
+        publisher.publish_arrays(keypoints, keypoint_scores, pose_scores)
+        publish_times.append(time.monotonic() - publish_start)
+        track_ids = np.arange(num_poses)
+        sizes.append(len(encode_frame(i, 0.0, track_ids, *quantize(keypoints, keypoint_scores,
+                                                                   pose_scores),
+                                      state=state, min_score=publisher.min_score)))
+        if rate:
+            time.sleep(max(0.0, start + (i + 1) / rate - time.monotonic()))
+    elapsed = time.monotonic() - start
+    time.sleep(0.2)
+    stats = publisher.stats()
+    publisher.close()
+    for thread in threads:
+        thread.join()
+
+    raw_size = num_poses * (NUM_KEYPOINTS * 3 + 1) * 4
+    print('%d frames of %d poses in %.2f s (%.0f frames/s), publish %.1f us per frame' % (
+        num_frames, num_poses, elapsed, num_frames / elapsed, np.mean(publish_times) * 1e6))
+    print('Message size: %.0f bytes on average, %d bytes as float32 arrays' % (
+        np.mean(sizes), raw_size))
+    for i, (received, (sent, dropped)) in enumerate(zip(latencies, stats)):
+        name = 'slow subscriber' if slow_subscriber and i == num_subscribers else 'subscriber %d' % i
+        print('%s: %d received, %d dropped, latency p50 %.2f ms, p99 %.2f ms' % (
+            name, len(received), dropped, np.percentile(received, 50) * 1000,
+            np.percentile(received, 99) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--address', help='Unix socket path or host:port, '
+                        'defaults to a Unix socket in a temporary directory.')
+    parser.add_argument('--subscribers', type=int, default=4, help='Number of subscribers.')
+    parser.add_argument('--poses', type=int, default=10, help='Poses per frame.')
+    parser.add_argument('--frames', type=int, default=2000, help='Frames to publish.')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Frames per second, 0 to publish as fast as possible.')
+    parser.add_argument('--slow_subscriber', action='store_true',
+                        help='Add a subscriber that takes 50 ms per frame.')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        address = args.address or os.path.join(directory, 'poses.sock')
+        benchmark(address, args.subscribers, args.poses, args.frames, args.rate,
+                  args.slow_subscriber)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+import pose_publisher
+from pose_publisher import PosePublisher, PoseSubscriber
+
+
+def assert_frame_close(frame, keypoints, keypoint_scores, pose_scores, threshold=0.2):
+    visible = np.round(keypoint_scores * 255) >= np.ceil(threshold * 255)
+    np.testing.assert_allclose(frame.keypoints[visible], keypoints[visible], atol=1.0 / 32)
+    np.testing.assert_allclose(frame.keypoint_scores[visible], keypoint_scores[visible],
+                               atol=1.0 / 510)
+    np.testing.assert_allclose(frame.pose_scores, pose_scores, atol=1.0 / 510)
+    assert np.isnan(frame.keypoints[~visible]).all()
+
+
+class EncodingTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        sender_state = {}
+        receiver_state = {}
+        sizes = []
+        min_score = int(np.ceil(0.2 * 255))
+        for number, arrays in enumerate(pose_publisher.moving_poses(5, 20, seed=1)):
+            keypoints, keypoint_scores, pose_scores = arrays
+            if number >= 10:
+                # A big jump can't be sent as delta.
+                keypoints = keypoints + 100
+            track_ids = np.arange(5) + (number >= 15)  # A new person appears.
+            message = pose_publisher.encode_frame(
+                number, 1.5 * number, track_ids,
+                *pose_publisher.quantize(keypoints, keypoint_scores, pose_scores),
+                state=sender_state, min_score=min_score)
+            sizes.append(len(message))
+            frame = pose_publisher.decode_frame(message, receiver_state)
+            self.assertEqual(frame.number, number)
+            self.assertEqual(frame.timestamp, 1.5 * number)
+            np.testing.assert_array_equal(frame.track_ids, track_ids)
+            assert_frame_close(frame, keypoints, keypoint_scores, pose_scores)
+        # Deltas are smaller than absolute positions.
+        self.assertLess(sizes[1], sizes[0])
+        self.assertGreater(sizes[10], sizes[9])
+        self.assertLess(sizes[11], sizes[10])
+
+    def test_negative_coordinates(self):
+        keypoints, keypoint_scores, pose_scores = next(pose_publisher.moving_poses(2, 1, seed=2))
+        keypoint_scores = np.ones_like(keypoint_scores)
+        # Partly left of and above the frame, as inference_to_source returns.
+        keypoints = keypoints - keypoints.mean(axis=(0, 1)) - 20
+        self.assertLess(keypoints.min(), 0)
+        sender_state, receiver_state = {}, {}
+        for number, offset in enumerate((0, 3)):
+            message = pose_publisher.encode_frame(
+                number, 0.0, [0, 1],
+                *pose_publisher.quantize(keypoints - offset, keypoint_scores, pose_scores),
+                state=sender_state)
+            frame = pose_publisher.decode_frame(message, receiver_state)
+            assert_frame_close(frame, keypoints - offset, keypoint_scores, pose_scores)
+
+    def test_unknown_track_delta(self):
+        state = {}
+        arrays = next(pose_publisher.moving_poses(2, 1))
+        quantized = pose_publisher.quantize(*arrays)
+        pose_publisher.encode_frame(0, 0.0, [0, 1], *quantized, state=state)
+        message = pose_publisher.encode_frame(1, 0.0, [0, 1], *quantized, state=state)
+        with self.assertRaises(ValueError):
+            pose_publisher.decode_frame(message, {})
+
+    def test_parse_address(self):
+        self.assertEqual(pose_publisher.parse_address('localhost:5000'), ('localhost', 5000))
+        self.assertEqual(pose_publisher.parse_address(':5000'), ('127.0.0.1', 5000))
+        self.assertEqual(pose_publisher.parse_address('/tmp/poses.sock'), '/tmp/poses.sock')
+
+
+class PublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.publisher = PosePublisher(os.path.join(self.directory.name, 'poses.sock'))
+
+    def tearDown(self):
+        self.publisher.close()
+        self.directory.cleanup()
+
+    def wait_for_subscribers(self, count):
+        deadline = time.monotonic() + 5
+        while self.publisher.num_subscribers < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.publisher.num_subscribers, count)
+
+    def test_subscribers_receive_all_frames(self):
+        subscribers = [PoseSubscriber(self.publisher.address, timeout=5) for _ in range(3)]
+        self.wait_for_subscribers(3)
+        frames = list(pose_publisher.moving_poses(4, 3))
+        for arrays in frames:
+            self.publisher.publish_arrays(*arrays)
+            for subscriber in subscribers:
+                frame = subscriber.receive()
+                assert_frame_close(frame, *arrays)
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def test_slow_subscriber_drops_oldest(self):
+        subscriber = PoseSubscriber(self.publisher.address, timeout=5)
+        self.wait_for_subscribers(1)
+        frames = list(pose_publisher.moving_poses(10, 500))
+        start = time.monotonic()
+        for arrays in frames:
+            self.publisher.publish_arrays(*arrays)
+        # Publishing never waits for the subscriber.
+        self.assertLess(time.monotonic() - start, 5.0)
+        time.sleep(0.2)
+        (sent, dropped), = self.publisher.stats()
+        self.assertGreater(dropped, 0)
+        # Whatever arrives decodes, deltas included, and the newest frame arrives.
+        number = -1
+        while number < len(frames) - 1:
+            frame = subscriber.receive()
+            self.assertGreater(frame.number, number)
+            number = frame.number
+            assert_frame_close(frame, *frames[number])
+        subscriber.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Assigns stable ids to poses across frames."""
+
+import numpy as np
+
+
+def pose_centers(keypoints, keypoint_scores, threshold=0.2):
+    """Returns the [N, 2] centroid of the visible keypoints of every pose.
+
+    Poses without any visible keypoint get a NaN center.
+    """
+    mask = keypoint_scores > threshold
+    count = mask.sum(axis=1)
+    total = (keypoints * mask[..., np.newaxis]).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / count[:, np.newaxis]
+
+
+class PoseTracker:
+    """Greedy nearest-center tracker.
+
+    Every pose gets the id of the closest unclaimed track from the previous
+    frames, closest pairs first, or a new id if none is within max_distance.
+    Tracks that go unmatched for more than max_age frames are forgotten.
+    """
+
+    def __init__(self, threshold=0.2, max_distance=np.inf, max_age=0):
+        """Creates a tracker.
+
+        Args:
+          threshold: Keypoints scoring below this don't count towards the center.
+          max_distance: Furthest a pose may move between frames, in pixels.
+          max_age: Number of frames a track survives without a matching pose.
+        """
+        self.threshold = threshold
+        self.max_distance = max_distance
+        self.max_age = max_age
+        self.next_pose_id = 0
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._centers = np.zeros((0, 2), dtype=np.float32)
+        self._ages = np.zeros(0, dtype=np.int64)
+
+    @property
+    def track_ids(self):
+        """Ids of all tracks currently alive."""
+        return self._ids.copy()
+
+    def update(self, keypoints, keypoint_scores):
+        """Assigns track ids to the poses of a new frame.
+
+        Args:
+          keypoints: [N, 17, D] array of keypoint positions, D is 2 or 3.
+          keypoint_scores: [N, 17] array of keypoint scores.
+
+        Returns:
+          [N] int64 array of track ids.
+        """
+        centers = pose_centers(keypoints, keypoint_scores, self.threshold)
+        ids = np.full(len(centers), -1, dtype=np.int64)
+        matched = np.zeros(len(self._ids), dtype=bool)
+
+        if len(centers) and len(self._ids):
+            d2 = ((centers[:, np.newaxis] - self._centers[np.newaxis]) ** 2).sum(axis=2)
+            d2 = np.where(np.isnan(d2), np.inf, d2)
+            order = np.argsort(d2, axis=None, kind='stable')
+            limit = self.max_distance ** 2
+            for flat in order:
+                pose, track = divmod(int(flat), len(self._ids))
+                if not np.isfinite(d2[pose, track]) or d2[pose, track] > limit:
+                    break
+                if ids[pose] < 0 and not matched[track]:
+                    ids[pose] = self._ids[track]
+                    matched[track] = True
+                    if matched.all() or (ids >= 0).all():
+                        break
+
+        new = ids < 0
+        ids[new] = np.arange(self.next_pose_id, self.next_pose_id + new.sum())
+        self.next_pose_id += int(new.sum())
+
+        ages = self._ages[~matched] + 1
+        keep = ages <= self.max_age
+        unmatched = ~matched
+        self._ids = np.concatenate([ids, self._ids[unmatched][keep]])
+        # Keypoints may be 2D or, e.g. triangulated, 3D.
+        self._centers = np.concatenate([
+            np.nan_to_num(centers, nan=np.inf),
+            self._centers[unmatched][keep].reshape(-1, centers.shape[1])]).astype(np.float32)
+        self._ages = np.concatenate([np.zeros(len(ids), dtype=np.int64), ages[keep]])
+        return ids
@@ -0,0 +1,66 @@
+# Lint as: python3
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from pose_tracker import PoseTracker
+
+
+def make_poses(centers):
+    keypoints = np.zeros((len(centers), 17, 2), dtype=np.float32)
+    keypoints += np.asarray(centers, dtype=np.float32).reshape(-1, 1, 2)
+    return keypoints, np.ones((len(centers), 17), dtype=np.float32)
+
+
+class PoseTrackerTest(unittest.TestCase):
+
+    def test_ids_follow_nearest_pose(self):
+        tracker = PoseTracker()
+        ids = tracker.update(*make_poses([(10, 10), (100, 100)]))
+        np.testing.assert_array_equal(ids, [0, 1])
+        ids = tracker.update(*make_poses([(95, 105), (12, 9), (300, 300)]))
+        np.testing.assert_array_equal(ids, [1, 0, 2])
+
+    def test_max_distance_and_age(self):
+        tracker = PoseTracker(max_distance=20, max_age=1)
+        tracker.update(*make_poses([(10, 10)]))
+        np.testing.assert_array_equal(tracker.update(*make_poses([(100, 100)])), [1])
+        # Track 0 survives one missed frame, then is forgotten.
+        np.testing.assert_array_equal(tracker.update(*make_poses([(15, 10)])), [0])
+        tracker.update(*make_poses([]))
+        tracker.update(*make_poses([]))
+        np.testing.assert_array_equal(tracker.update(*make_poses([(15, 10)])), [2])
+
+    def test_invisible_pose_gets_new_id(self):
+        tracker = PoseTracker()
+        tracker.update(*make_poses([(10, 10)]))
+        keypoints, scores = make_poses([(10, 10)])
+        scores[:] = 0
+        np.testing.assert_array_equal(tracker.update(keypoints, scores), [1])
+
+    def test_3d_keypoints(self):
+        tracker = PoseTracker(max_distance=0.5, max_age=1)
+        keypoints = np.zeros((2, 17, 3))
+        keypoints[1] += (2, 0, 1)
+        np.testing.assert_array_equal(tracker.update(keypoints, np.ones((2, 17))), [0, 1])
+        tracker.update(keypoints[:1], np.ones((1, 17)))
+        np.testing.assert_array_equal(tracker.update(keypoints[::-1] + 0.1, np.ones((2, 17))),
+                                      [1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
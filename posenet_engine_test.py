@@ -14,7 +14,9 @@
 # limitations under the License.
 
 
-from pose_engine import PoseEngine, KeypointType
+from pose_engine import (PoseEngine, KeypointType, ParsedOutput, QuantizedPoses, input_array,
+                         parse_poses, poses_to_arrays)
+from synthetic_engine import SyntheticPoseEngine
 from PIL import Image
 from PIL import ImageDraw
 
@@ -22,6 +24,7 @@ import numpy as np
 import os
 import sys
 import unittest
+from unittest import mock
 import test_utils
 
 test_image = os.path.join(os.getcwd(), 'test_data/test_couple.jpg')
@@ -55,6 +58,94 @@ class PoseEngineAccuracyTest(unittest.TestCase):
                     keypoint_idx += 1
                 pose_idx += 1
 
+    def test_quantized_output_matches(self):
+        image = Image.open(test_image).convert('RGB')
+        for model_path, model_name in test_utils.generate_models():
+            for mirror in (False, True):
+                engine = PoseEngine(model_path, mirror=mirror)
+                poses, _ = engine.DetectPosesInImage(image)
+                quantized_poses, _ = engine.ParseOutputQuantized()
+                keypoints, keypoint_scores, pose_scores = poses_to_arrays(poses)
+                quantized = quantized_poses.dequantize()
+                # Within half a quantization step.
+                np.testing.assert_allclose(quantized[0], keypoints, atol=1.0 / 32)
+                np.testing.assert_allclose(quantized[1], keypoint_scores, atol=1.0 / 510)
+                np.testing.assert_allclose(quantized[2], pose_scores, atol=1.0 / 510)
+                self.assertEqual(len(quantized_poses.filter(0.5)),
+                                 int((pose_scores >= 0.5).sum()))
+
+
+class ParsePosesTest(unittest.TestCase):
+
+    def test_mirror_flips_x(self):
+        # Decoder keypoints are (y, x).
+        keypoints = np.zeros((1, len(KeypointType), 2), dtype=np.float32)
+        keypoints[0, :, 0] = 100
+        keypoints[0, :, 1] = 30
+        scores = np.ones((1, len(KeypointType)), dtype=np.float32)
+        for mirror, x in ((False, 30), (True, 611)):
+            pose, = parse_poses(keypoints, scores, [1.0], 1, mirror, 641)
+            self.assertEqual(tuple(pose.keypoints[KeypointType.NOSE].point), (x, 100))
+
+
+class QuantizedPosesTest(unittest.TestCase):
+
+    def test_separate_pose_score_quantization(self):
+        keypoints = np.zeros((3, len(KeypointType), 2), dtype=np.int16)
+        keypoint_scores = np.full((3, len(KeypointType)), 128, dtype=np.uint8)
+        # Pose scores 0.2, 0.5 and 0.8 in a format other than keypoint scores.
+        pose_scores = np.array([60, 90, 120], dtype=np.uint8)
+        poses = QuantizedPoses(keypoints, keypoint_scores, pose_scores, (1.0 / 16, 0),
+                               (1.0 / 255, 0), (0.01, 40))
+        np.testing.assert_allclose(poses.dequantize()[1], 128 / 255)
+        np.testing.assert_allclose(poses.dequantize()[2], [0.2, 0.5, 0.8], rtol=1e-6)
+        kept = poses.filter(0.5)
+        np.testing.assert_array_equal(kept.pose_scores, [90, 120])
+        self.assertEqual(kept.pose_score_quantization, (0.01, 40))
+        self.assertTrue(poses.keypoint_mask(0.5).all())
+
+
+class InputArrayTest(unittest.TestCase):
+
+    def test_bytes_and_arrays(self):
+        pixels = np.arange(24, dtype=np.uint8)
+        np.testing.assert_array_equal(input_array(pixels.tobytes()), pixels)
+        np.testing.assert_array_equal(input_array(pixels.reshape(2, 4, 3)), pixels)
+
+    def test_gst_buffer(self):
+        frame = np.arange(2 * 4 * 3, dtype=np.uint8).reshape(2, 12)
+        # Rows padded to 16 bytes, after 8 bytes of other data.
+        padded = np.zeros((2, 16), dtype=np.uint8)
+        padded[:, :12] = frame
+        buffer = test_utils.FakeGstBuffer(bytes(8) + padded.tobytes(), 4, 2, 16, offset=8)
+        with mock.patch.dict(sys.modules, test_utils.fake_gst_modules()):
+            np.testing.assert_array_equal(input_array(buffer), frame.reshape(-1))
+        self.assertEqual(buffer.mapped, 0)
+
+
+class ParsedOutputTest(unittest.TestCase):
+
+    def test_parses_once(self):
+        engine = SyntheticPoseEngine(people=3)
+        engine.run_inference(None)
+
+        class ListEngine:
+            """Like PoseEngine, only parses into a list of Pose."""
+            input_size = engine.input_size
+            ParseOutput = mock.Mock(wraps=engine.ParseOutput)
+
+        parsed = ParsedOutput(ListEngine())
+        poses, _ = parsed.ParseOutput()
+        keypoints, _, pose_scores = parsed.ParseOutputArrays()
+        self.assertIs(parsed.ParseOutput()[0], poses)
+        self.assertIs(parsed.ParseOutputArrays()[0], keypoints)
+        self.assertEqual(ListEngine.ParseOutput.call_count, 1)
+        np.testing.assert_allclose(pose_scores, [pose.score for pose in poses])
+        self.assertEqual(parsed.input_size, engine.input_size)
+        # Engines with ParseOutputArrays skip the list of Pose.
+        parsed = ParsedOutput(engine)
+        self.assertIs(parsed.ParseOutputArrays(), engine.ParseOutputArrays())
+
 
 def test_main():
     unittest.main()
@@ -0,0 +1,321 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Event-triggered recording of the encoded camera stream.
+
+gstreamer.run_pipeline(..., recorder=recorder) adds an H.264 encoding branch
+whose access units are passed to EventRecorder.add_frame. While nothing
+happens, the recorder only keeps the last pre_roll seconds of frames in
+memory, trimmed a whole group of pictures at a time so that it always starts
+with a keyframe. When the poses passed to update trigger, the pre-roll and
+all following frames are written to a new segment until the trigger has been
+off for post_roll seconds.
+
+A trigger is a person scoring at least min_score, or, given an EventStage,
+any of its rules (or of `rules`) being active. Segments are H.264 byte
+streams, playable as is or remuxed with `ffmpeg -i segment.h264 -c copy
+segment.mp4`. Every frame carries the latest poses in source image
+coordinates as JSON in an SEI user data message, read back with
+read_pose_metadata. Files are written by a background thread.
+"""
+
+import argparse
+import collections
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+import numpy as np
+
+from pose_engine import inference_to_source, poses_to_arrays
+
+# SEI user_data_unregistered UUID marking pose metadata.
+POSE_METADATA_UUID = bytes.fromhex('8d2a6f1c5b4e47a39c1e2f7b6a5d4c31')
+START_CODE = b'\x00\x00\x00\x01'
+SEI_NAL_TYPE = 6
+USER_DATA_UNREGISTERED = 5
+
+Segment = collections.namedtuple('Segment', ['path', 'frames', 'bytes'])
+
+
+def _escape(rbsp):
+    """Inserts emulation prevention bytes into a NAL unit payload."""
+    return re.sub(b'\x00\x00(?=[\x00-\x03])', b'\x00\x00\x03', rbsp)
+
+
+def _unescape(payload):
+    return re.sub(b'\x00\x00\x03(?=[\x00-\x03])', b'\x00\x00', payload)
+
+
+def pose_sei(metadata):
+    """Returns an SEI NAL unit, with start code, carrying JSON metadata."""
+    payload = POSE_METADATA_UUID + json.dumps(metadata, separators=(',', ':')).encode()
+    size = len(payload)
+    header = bytes([USER_DATA_UNREGISTERED]) + b'\xff' * (size // 255) + bytes([size % 255])
+    return START_CODE + bytes([SEI_NAL_TYPE]) + _escape(header + payload + b'\x80')
+
+
+def insert_sei(access_unit, sei):
+    """Inserts an SEI NAL unit before the first slice of an access unit."""
+    for match in re.finditer(b'\x00\x00\x01', access_unit):
+        position = match.start()
+        if position + 3 < len(access_unit) and 1 <= access_unit[position + 3] & 0x1f <= 5:
+            if position and access_unit[position - 1] == 0:
+                position -= 1
+            return access_unit[:position] + sei + access_unit[position:]
+    return sei + access_unit
+
+
+def read_pose_metadata(data):
+    """Returns the pose metadata of every frame of an H.264 byte stream, in order."""
+    metadata = []
+    units = re.split(b'\x00\x00\x01', data)
+    for unit in units[1:]:
+        if not unit or unit[0] & 0x1f != SEI_NAL_TYPE:
+            continue
+        payload = _unescape(unit[1:].rstrip(b'\x00'))
+        payload_type, i = payload[0], 1
+        size = 0
+        while payload[i] == 0xff:
+            size += 255
+            i += 1
+        size += payload[i]
+        body = payload[i + 1:i + 1 + size]
+        if payload_type == USER_DATA_UNREGISTERED and body[:16] == POSE_METADATA_UUID:
+            metadata.append(json.loads(body[16:].decode()))
+    return metadata
+
+
+class EventRecorder:
+    """Keeps a pre-roll of encoded frames and records while poses trigger."""
+
+    def __init__(self, directory, pre_roll=5.0, post_roll=3.0, min_score=0.5, stage=None,
+                 rules=None, clock=time.monotonic):
+        """Creates a recorder and starts its writer thread.
+
+        Args:
+          directory: Directory for segments, created if missing.
+          pre_roll: Seconds of video kept from before the trigger.
+          post_roll: Seconds the trigger must be off to end a segment.
+          min_score: Pose score of a person that triggers, without stage.
+          stage: Optional pose_events.EventStage whose active rules trigger.
+          rules: Names of the stage rules that trigger, all if None.
+          clock: Time source for frames and poses.
+        """
+        self.directory = directory
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.min_score = min_score
+        self.stage = stage
+        self.rules = set(rules) if rules is not None else None
+        self.clock = clock
+        self.segments = []
+        self.bytes_in = 0
+        self.bytes_written = 0
+        self._buffer = collections.deque()  # (time, data, keyframe, sei)
+        self._active = set()
+        self._triggered = False
+        self._last_trigger = None
+        self._sei = pose_sei({'poses': []})
+        self._recording = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    @property
+    def recording(self):
+        return self._recording
+
+    def update(self, poses, src_size=None, inference_box=None, timestamp=None):
+        """Same as update_arrays but takes a list of Pose."""
+        keypoints, keypoint_scores, pose_scores = poses_to_arrays(poses)
+        return self.update_arrays(keypoints, keypoint_scores, pose_scores, src_size,
+                                  inference_box, timestamp)
+
+    def update_arrays(self, keypoints, keypoint_scores, pose_scores, src_size=None,
+                      inference_box=None, timestamp=None):
+        """Updates the trigger with a frame's poses.
+
+        Args:
+          keypoints: [N, 17, 2] keypoints.
+          keypoint_scores: [N, 17] keypoint scores.
+          pose_scores: [N] pose scores.
+          src_size: Source image size, with inference_box to store the poses
+            in source image coordinates.
+          inference_box: Source image box inside the inference tensor.
+          timestamp: Time of the poses, defaults to clock().
+
+        Returns:
+          Whether the poses trigger recording.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        if self.stage:
+            for event in self.stage.update_arrays(keypoints, keypoint_scores, timestamp):
+                if self.rules is None or event.rule in self.rules:
+                    key = (event.rule, event.track_id)
+                    if event.kind == 'start':
+                        self._active.add(key)
+                    else:
+                        self._active.discard(key)
+            triggered = bool(self._active)
+        else:
+            triggered = bool((np.asarray(pose_scores) >= self.min_score).any())
+        if src_size and inference_box:
+            keypoints = inference_to_source(keypoints, src_size, inference_box)
+        sei = pose_sei({'time': round(time.time(), 3), 'triggered': triggered, 'poses': [
+            {'score': round(float(score), 3),
+             'keypoints': np.round(np.concatenate(
+                 [pose_keypoints, scores[:, np.newaxis]], axis=1), 2).tolist()}
+            for pose_keypoints, scores, score in zip(keypoints, keypoint_scores, pose_scores)]})
+        with self._lock:
+            self._sei = sei
+            self._triggered = triggered
+            if triggered:
+                self._last_trigger = timestamp
+        return triggered
+
+    def add_frame(self, data, keyframe, timestamp=None):
+        """Adds an encoded access unit (H.264 byte stream, one frame).
+
+        Args:
+          data: Bytes of the access unit.
+          keyframe: Whether the frame can be decoded on its own.
+          timestamp: Time of the frame, defaults to clock().
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        with self._lock:
+            self.bytes_in += len(data)
+            sei = self._sei
+            triggered = self._triggered or (self._last_trigger is not None and
+                                            timestamp - self._last_trigger < self.post_roll)
+            if self._recording and not triggered:
+                self._recording = False
+                self._queue.put(('close', None))
+            if not self._recording and triggered:
+                # Start with the pre-roll, from its first keyframe.
+                while self._buffer and not self._buffer[0][2]:
+                    self._buffer.popleft()
+                if self._buffer or keyframe:
+                    self._recording = True
+                    path = os.path.join(self.directory, 'segment_%d.h264' % int(time.time() * 1000))
+                    self._queue.put(('open', path))
+                    while self._buffer:
+                        _, buffered, _, buffered_sei = self._buffer.popleft()
+                        self._write(insert_sei(buffered, buffered_sei))
+            if self._recording:
+                self._write(insert_sei(data, sei))
+            else:
+                self._buffer.append((timestamp, data, keyframe, sei))
+                self._trim(timestamp)
+
+    def _trim(self, timestamp):
+        # Drop whole groups of pictures while the next one covers the pre-roll.
+        keyframes = [t for t, _, keyframe, _ in self._buffer if keyframe]
+        start = timestamp - self.pre_roll
+        next_keyframes = [t for t in keyframes[1:] if t <= start]
+        if next_keyframes:
+            cut = next_keyframes[-1]
+            while self._buffer[0][0] < cut or not self._buffer[0][2]:
+                self._buffer.popleft()
+        elif not keyframes:
+            while self._buffer and self._buffer[0][0] < start:
+                self._buffer.popleft()
+
+    def _write(self, data):
+        self.bytes_written += len(data)
+        self._queue.put(('write', data))
+
+    def _write_loop(self):
+        f = None
+        segment = None
+        while True:
+            command, value = self._queue.get()
+            if command in ('open', 'close', 'stop') and f:
+                f.close()
+                self.segments.append(segment)
+                f = None
+            if command == 'open':
+                f = open(value, 'wb')
+                segment = Segment(value, 0, 0)
+            elif command == 'write' and f:
+                f.write(value)
+                segment = segment._replace(frames=segment.frames + 1,
+                                           bytes=segment.bytes + len(value))
+            elif command == 'stop':
+                break
+
+    def stats(self):
+        """Returns (bytes in, bytes written, fraction of disk writes saved)."""
+        saved = 1 - self.bytes_written / self.bytes_in if self.bytes_in else 0.0
+        return self.bytes_in, self.bytes_written, saved
+
+    def close(self):
+        """Ends the current segment and stops the writer thread."""
+        with self._lock:
+            self._recording = False
+            self._queue.put(('stop', None))
+        self._thread.join()
+
+
+def _synthetic_access_unit(keyframe, size):
+    nal_type = 5 if keyframe else 1
+    return START_CODE + bytes([0x60 | nal_type]) + os.urandom(size)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--directory', default='/tmp/recordings', help='Segment directory.')
+    parser.add_argument('--hours', type=float, default=1.0, help='Simulated time.')
+    parser.add_argument('--occupancy', type=float, default=0.1,
+                        help='Fraction of time people are present.')
+    parser.add_argument('--visit_s', type=float, default=30, help='Mean visit length.')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--gop', type=int, default=30, help='Frames per keyframe.')
+    parser.add_argument('--kbps', type=int, default=2000, help='Encoded bit rate.')
+    args = parser.parse_args()
+
+    # Simulated clock, poses every frame and people present in random visits.
+    now = [0.0]
+    recorder = EventRecorder(args.directory, clock=lambda: now[0])
+    rng = np.random.RandomState(0)
+    frame_bytes = args.kbps * 1000 // 8 // args.fps
+    present = False
+    start = time.monotonic()
+    for frame in range(int(args.hours * 3600 * args.fps)):
+        now[0] = frame / args.fps
+        mean_s = args.visit_s if present else args.visit_s * (1 / args.occupancy - 1)
+        if rng.random_sample() < 1 / (mean_s * args.fps):
+            present = not present
+        pose_scores = np.array([0.8]) if present else np.zeros(0)
+        recorder.update_arrays(np.zeros((len(pose_scores), 17, 2)),
+                               np.ones((len(pose_scores), 17)), pose_scores)
+        keyframe = frame % args.gop == 0
+        recorder.add_frame(_synthetic_access_unit(keyframe, frame_bytes * (4 if keyframe else 1)),
+                           keyframe)
+    recorder.close()
+    bytes_in, bytes_written, saved = recorder.stats()
+    print('%.1f simulated hours in %.1f s: %d segments, %.0f MB of %.0f MB written, '
+          '%.1f%% of disk writes saved' % (
+              args.hours, time.monotonic() - start, len(recorder.segments),
+              bytes_written / 1e6, bytes_in / 1e6, saved * 100))
+
+
+if __name__ == '__main__':
+    main()
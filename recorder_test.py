@@ -0,0 +1,108 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import recorder
+from pose_engine import KeypointType
+from pose_events import EventStage, KeypointAbove
+
+FPS = 10
+GOP = 10
+
+
+def access_unit(frame):
+    """Returns a fake access unit with an SPS before keyframe slices."""
+    if frame % GOP == 0:
+        return recorder.START_CODE + b'\x67\x42\x80\x1e' + b'\x00\x00\x01\x65' + bytes([frame % 256])
+    return b'\x00\x00\x01\x41' + bytes([frame % 256]) * 8
+
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.now = 0.0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_frames(self, rec, present, frames):
+        """Feeds frames with one confident person on the frames in `present`."""
+        for frame in frames:
+            self.now = frame / FPS
+            scores = np.array([0.9]) if frame in present else np.zeros(0)
+            keypoints = np.full((len(scores), 17, 2), 10.0)
+            rec.update_arrays(keypoints, np.ones((len(scores), 17)), scores)
+            rec.add_frame(access_unit(frame), frame % GOP == 0)
+
+    def make_recorder(self, **kwargs):
+        return recorder.EventRecorder(self.directory, pre_roll=1.5, post_roll=1.0,
+                                      clock=lambda: self.now, **kwargs)
+
+    def test_sei_round_trip(self):
+        metadata = {'poses': [{'score': 0.5, 'keypoints': [[0, 0, 0]] * 17}], 'text': '\x00' * 5}
+        sei = recorder.pose_sei(metadata)
+        self.assertNotIn(b'\x00\x00\x00', sei[4:])
+        data = recorder.insert_sei(access_unit(0), sei) + access_unit(1)
+        self.assertEqual(recorder.read_pose_metadata(data), [metadata])
+        # Inserted after the SPS, right before the slice.
+        self.assertTrue(data.startswith(recorder.START_CODE + b'\x67\x42\x80\x1e' + sei))
+
+    def test_pre_and_post_roll(self):
+        rec = self.make_recorder()
+        present = set(range(50, 60))
+        self.run_frames(rec, present, range(100))
+        self.assertFalse(rec.recording)
+        rec.close()
+        self.assertEqual(len(rec.segments), 1)
+        segment = rec.segments[0]
+        with open(segment.path, 'rb') as f:
+            data = f.read()
+        # At least 1.5 s of pre-roll, from a keyframe: frames 30 to 68.
+        self.assertEqual(segment.frames, 39)
+        self.assertTrue(data.startswith(recorder.START_CODE + b'\x67'))
+        metadata = recorder.read_pose_metadata(data)
+        self.assertEqual(len(metadata), 39)
+        self.assertEqual([len(m['poses']) for m in metadata[19:21]], [0, 1])
+        self.assertEqual(metadata[20]['poses'][0]['keypoints'][0], [10.0, 10.0, 1.0])
+        bytes_in, bytes_written, _ = rec.stats()
+        self.assertEqual(bytes_in, sum(len(access_unit(frame)) for frame in range(100)))
+        self.assertEqual(bytes_written, len(data))
+
+    def test_gaps_shorter_than_post_roll(self):
+        rec = self.make_recorder()
+        present = set(range(20, 30)) | set(range(35, 40)) | set(range(100, 105))
+        self.run_frames(rec, present, range(150))
+        rec.close()
+        self.assertEqual(len(rec.segments), 2)
+
+    def test_event_trigger(self):
+        stage = EventStage([KeypointAbove('hand_up', KeypointType.RIGHT_WRIST, KeypointType.NOSE,
+                                          margin=5)])
+        rec = self.make_recorder(stage=stage)
+        keypoints = np.full((1, 17, 2), 50.0)
+        scores = np.ones((1, 17))
+        self.assertFalse(rec.update_arrays(keypoints, scores, np.array([0.9])))
+        keypoints[0, KeypointType.RIGHT_WRIST, 1] = 10
+        self.assertTrue(rec.update_arrays(keypoints, scores, np.array([0.9])))
+        rec.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,314 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Skips inference on frames where nothing changed.
+
+A camera watching an empty corridor sends the same picture for hours. The
+SceneGate reduces every frame to a small luma thumbnail, sampled from a few
+pixels per cell rather than read in full, and compares it to the thumbnail
+of the last frame that was inferred:
+
+  threshold: Mean absolute luma difference over the watched part of the
+    thumbnail that counts as a change, e.g. lights or the camera moving.
+  block_threshold: Mean absolute difference within any one block of
+    block_size cells that counts as a change, so that one small person
+    entering a wide view is not averaged away. None to disable.
+  mask: Optional boolean array with one entry per block, False for blocks
+    to ignore, like a window onto a busy street or a monitor.
+
+Frames that are not a change reuse the poses of the last inferred frame.
+Comparing against the last inferred frame rather than the previous one means
+slow drifts add up until they trigger, and refresh_interval forces an
+inference every so often regardless.
+
+    gate = scene_gate.SceneGate()
+    if gate.should_infer(frame):
+        engine.run_inference(frame)
+    poses, _ = engine.ParseOutput()  # Last inferred poses either way.
+
+gstreamer.run_pipeline(..., scene_gate=gate) gates the camera pipeline the
+same way; main() measures on footage how many inferences a gate skips and
+the latency and energy that saves.
+"""
+
+import argparse
+import collections
+import os
+import time
+
+import numpy as np
+
+# BT.601 luma weights in 1/256, as used by JPEG.
+LUMA_WEIGHTS = np.array([77, 150, 29], dtype=np.float32) / 256
+
+GateStats = collections.namedtuple('GateStats', ['frames', 'inferred', 'skipped', 'refreshes',
+                                                 'gate_ms'])
+GateStats.__doc__ = """Counts of a SceneGate.
+
+  frames: Frames checked.
+  inferred: Frames that needed inference, including refreshes.
+  skipped: Frames that reused the last poses.
+  refreshes: Inferences forced by refresh_interval alone.
+  gate_ms: Mean time of one check in milliseconds.
+"""
+
+
+class _Sampler:
+    """Indices of the pixels sampled for a thumbnail of one frame size."""
+
+    def __init__(self, frame_size, size, samples):
+        width, height = frame_size
+        columns, rows = size
+        # samples x samples pixels at the centers of the sub-cells of every cell.
+        self.ys = ((np.arange(rows * samples) + 0.5) * height / (rows * samples)).astype(int)
+        self.xs = ((np.arange(columns * samples) + 0.5) * width / (columns * samples)).astype(int)
+        self.shape = (rows, samples, columns, samples)
+
+
+_samplers = {}
+
+
+def luma_thumbnail(frame, size=(32, 24), samples=2):
+    """Returns the mean luma of a grid of cells of an RGB frame.
+
+    Args:
+      frame: uint8 array [height, width, 3 or more], any strides.
+      size: (columns, rows) of the thumbnail.
+      samples: Pixels sampled per cell in each direction, averaging out
+        sensor noise. Only size * samples pixels are read.
+
+    Returns:
+      float32 array [rows, columns].
+    """
+    key = (frame.shape[1], frame.shape[0], tuple(size), samples)
+    sampler = _samplers.get(key)
+    if sampler is None:
+        sampler = _samplers[key] = _Sampler(key[:2], size, samples)
+    pixels = frame[sampler.ys[:, None], sampler.xs, :3]
+    return (pixels @ LUMA_WEIGHTS).reshape(sampler.shape).mean(axis=(1, 3))
+
+
+class SceneGate:
+    """Decides whether a frame differs enough from the last inferred one."""
+
+    def __init__(self, threshold=4.0, block_threshold=12.0, block_size=4, mask=None,
+                 refresh_interval=10.0, size=(32, 24), samples=2, clock=time.monotonic):
+        """Creates a gate; the first frame is always inferred.
+
+        Args:
+          threshold: Mean absolute luma difference, 0 to 255, over the
+            watched thumbnail that triggers inference.
+          block_threshold: Mean absolute luma difference within one block
+            that triggers inference, None to only use threshold.
+          block_size: Thumbnail cells per block side; size must be a
+            multiple of it.
+          mask: Optional boolean array [rows / block_size, columns /
+            block_size], False for blocks whose changes are ignored.
+          refresh_interval: Seconds after which a frame is inferred
+            regardless, None to never force one.
+          size: (columns, rows) of the luma thumbnail.
+          samples: Pixels sampled per cell in each direction.
+          clock: Time source for refresh_interval.
+        """
+        columns, rows = size
+        if columns % block_size or rows % block_size:
+            raise ValueError('Thumbnail size %s is not a multiple of block_size %d.' % (
+                size, block_size))
+        blocks = (rows // block_size, columns // block_size)
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            if mask.shape != blocks:
+                raise ValueError('Mask of shape %s, expected %s blocks.' % (mask.shape, blocks))
+            if not mask.any():
+                raise ValueError('Mask ignores every block.')
+        self.threshold = threshold
+        self.block_threshold = block_threshold
+        self.block_size = block_size
+        self.mask = mask
+        self.refresh_interval = refresh_interval
+        self.size = tuple(size)
+        self.samples = samples
+        self.clock = clock
+        self.reference = None
+        self.last_inference = None
+        self.frames = 0
+        self.inferred = 0
+        self.refreshes = 0
+        self.gate_time = 0.0
+
+    def reset(self):
+        """Forgets the reference, the next frame is inferred."""
+        self.reference = None
+
+    def block_differences(self, thumbnail):
+        """Returns the mean absolute difference of every block to the reference."""
+        rows, columns = thumbnail.shape
+        difference = np.abs(thumbnail - self.reference)
+        return difference.reshape(rows // self.block_size, self.block_size,
+                                  columns // self.block_size, self.block_size).mean(axis=(1, 3))
+
+    def changed(self, thumbnail):
+        """Whether a thumbnail differs enough from the reference."""
+        if self.reference is None or self.reference.shape != thumbnail.shape:
+            return True
+        # All blocks have the same number of cells, so the mean over the
+        # watched blocks is the mean over the watched cells.
+        blocks = self.block_differences(thumbnail)
+        if self.mask is not None:
+            blocks = blocks[self.mask]
+        if blocks.mean() > self.threshold:
+            return True
+        return self.block_threshold is not None and blocks.max() > self.block_threshold
+
+    def should_infer(self, frame):
+        """Checks a frame and returns whether to run inference on it.
+
+        Args:
+          frame: uint8 array [height, width, 3 or more] of RGB pixels.
+
+        Returns:
+          True if the frame must be inferred; it then becomes the reference.
+          False if the poses of the last inferred frame still hold.
+        """
+        start = time.monotonic()
+        now = self.clock()
+        thumbnail = luma_thumbnail(frame, self.size, self.samples)
+        infer = self.changed(thumbnail)
+        if not infer and self.refresh_interval is not None and (
+                now - self.last_inference >= self.refresh_interval):
+            infer = True
+            self.refreshes += 1
+        if infer:
+            self.reference = thumbnail
+            self.last_inference = now
+            self.inferred += 1
+        self.frames += 1
+        self.gate_time += time.monotonic() - start
+        return infer
+
+    def stats(self):
+        """Returns GateStats."""
+        return GateStats(self.frames, self.inferred, self.frames - self.inferred, self.refreshes,
+                         self.gate_time * 1000 / max(self.frames, 1))
+
+
+def synthetic_footage(frames, size=(640, 480), occupancy=0.2, visit_s=8.0, fps=30, seed=0):
+    """Yields frames of a corridor with sensor noise, drifting light and visitors.
+
+    Visits start at random with the given occupancy; a visitor is a dark
+    figure walking across the corridor.
+    """
+    rng = np.random.RandomState(seed)
+    width, height = size
+    background = np.tile(np.linspace(60, 180, width, dtype=np.float32), (height, 1))
+    background[height * 2 // 3:] *= 0.6  # Floor.
+    # Cycling through a few noise frames is as good as new noise every frame.
+    noise = rng.normal(0, 2, (8, height, width)).astype(np.float32)
+    walk_s = None
+    for index in range(frames):
+        if walk_s is None and rng.random_sample() < occupancy / ((1 - occupancy) * visit_s * fps):
+            walk_s = 0.0
+        light = 1 + 0.05 * np.sin(index / (fps * 60))  # Slow drift over minutes.
+        frame = background * light + noise[index % len(noise)]
+        if walk_s is not None:
+            x = int(walk_s / visit_s * (width + 80)) - 80
+            frame[height // 4:height * 5 // 6, max(x, 0):max(x + 60, 0)] = 30
+            walk_s += 1 / fps
+            if walk_s > visit_s:
+                walk_s = None
+        yield np.repeat(np.clip(frame, 0, 255).astype(np.uint8)[..., None], 3, axis=2)
+
+
+def read_footage(path, size=(640, 480)):
+    """Yields RGB frames of a directory of images or a video file.
+
+    Videos, including recorder.py segments, are decoded with GStreamer.
+    """
+    if os.path.isdir(path):
+        from PIL import Image
+        for name in sorted(os.listdir(path)):
+            with Image.open(os.path.join(path, name)) as image:
+                yield np.asarray(image.convert('RGB').resize(size, Image.NEAREST))
+        return
+
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    Gst.init(None)
+    pipeline = Gst.parse_launch(
+        'filesrc location="%s" ! decodebin ! videoconvert ! videoscale ! '
+        'video/x-raw,format=RGB,width=%d,height=%d ! appsink name=sink sync=false' % (
+            (path,) + tuple(size)))
+    sink = pipeline.get_by_name('sink')
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        while True:
+            sample = sink.emit('pull-sample')
+            if not sample:
+                break
+            buffer = sample.get_buffer()
+            data = buffer.extract_dup(0, buffer.get_size())
+            # Rows are padded to 4 bytes.
+            stride = len(data) // size[1]
+            yield np.ndarray((size[1], size[0], 3), np.uint8, data, strides=(stride, 3, 1))
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--footage', help='Video file or directory of images; synthetic '
+                        'corridor footage if not given.')
+    parser.add_argument('--frames', type=int, default=9000, help='Synthetic frames.')
+    parser.add_argument('--occupancy', type=float, default=0.2,
+                        help='Fraction of synthetic frames with a visitor.')
+    parser.add_argument('--fps', type=float, default=30, help='Frame rate of the footage.')
+    parser.add_argument('--threshold', type=float, default=4.0)
+    parser.add_argument('--block_threshold', type=float, default=12.0)
+    parser.add_argument('--refresh_interval', type=float, default=10.0)
+    parser.add_argument('--inference_ms', type=float, default=15.0,
+                        help='Time of one inference, e.g. from posenet_inference_callback_ms.')
+    parser.add_argument('--inference_watts', type=float, default=2.0,
+                        help='Power drawn by the accelerator while inferring.')
+    args = parser.parse_args()
+
+    if args.footage:
+        footage = read_footage(args.footage)
+    else:
+        footage = synthetic_footage(args.frames, occupancy=args.occupancy, fps=args.fps)
+    # Footage time, not wall time, drives refreshes.
+    now = [0.0]
+    gate = SceneGate(args.threshold, args.block_threshold,
+                     refresh_interval=args.refresh_interval, clock=lambda: now[0])
+    for index, frame in enumerate(footage):
+        now[0] = index / args.fps
+        gate.should_infer(frame)
+
+    stats = gate.stats()
+    if not stats.frames:
+        raise SystemExit('No frames in %s.' % args.footage)
+    seconds = stats.frames / args.fps
+    ungated_ms = args.inference_ms
+    gated_ms = stats.gate_ms + args.inference_ms * stats.inferred / stats.frames
+    print('%d frames (%.0f s): %d inferred (%d refreshes), %d skipped, %.1f%%' % (
+        stats.frames, seconds, stats.inferred, stats.refreshes, stats.skipped,
+        100 * stats.skipped / stats.frames))
+    print('Gate: %.3f ms per frame. Mean compute per frame: %.2f ms gated, %.2f ms ungated' % (
+        stats.gate_ms, gated_ms, ungated_ms))
+    saved_j = stats.skipped * args.inference_ms / 1000 * args.inference_watts
+    print('Accelerator energy saved: %.1f J, %.2f W on average at %.0f W while inferring' % (
+        saved_j, saved_j / seconds, args.inference_watts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+import scene_gate
+from scene_gate import SceneGate
+
+
+def corridor(seed=0):
+    """A 640x480 gradient with sensor noise."""
+    rng = np.random.RandomState(seed)
+    frame = np.tile(np.linspace(60, 180, 640), (480, 1)) + rng.normal(0, 2, (480, 640))
+    return np.repeat(np.clip(frame, 0, 255).astype(np.uint8)[..., None], 3, axis=2)
+
+
+class SceneGateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.gate = SceneGate(refresh_interval=5, clock=lambda: self.now)
+
+    def test_thumbnail(self):
+        frame = np.zeros((480, 640, 3), dtype=np.uint8)
+        frame[:, 320:] = (255, 0, 0)
+        thumbnail = scene_gate.luma_thumbnail(frame)
+        self.assertEqual(thumbnail.shape, (24, 32))
+        np.testing.assert_allclose(thumbnail[:, :16], 0)
+        np.testing.assert_allclose(thumbnail[:, 16:], 77 / 256 * 255)
+        # Strided views, like padded GStreamer buffers, give the same result.
+        padded = np.zeros((480, 644, 3), dtype=np.uint8)
+        padded[:, :640] = frame
+        np.testing.assert_array_equal(scene_gate.luma_thumbnail(padded[:, :640]), thumbnail)
+
+    def test_noise_is_not_a_change(self):
+        self.assertTrue(self.gate.should_infer(corridor(0)))
+        for seed in range(1, 4):
+            self.assertFalse(self.gate.should_infer(corridor(seed)))
+        self.assertEqual(self.gate.stats()[:4], (4, 1, 3, 0))
+
+    def test_small_person_triggers_a_block(self):
+        self.gate.should_infer(corridor(0))
+        frame = corridor(1)
+        frame[200:320, 300:340] = 20  # 1.5% of the frame.
+        self.assertTrue(self.gate.should_infer(frame))
+        # The gate compares to the last inferred frame, now with the person.
+        self.assertFalse(self.gate.should_infer(frame))
+        self.assertTrue(self.gate.should_infer(corridor(2)))
+
+        without_blocks = SceneGate(block_threshold=None, refresh_interval=None)
+        without_blocks.should_infer(corridor(0))
+        self.assertFalse(without_blocks.should_infer(frame))
+
+    def test_lighting_change(self):
+        self.gate.should_infer(corridor(0))
+        self.assertTrue(self.gate.should_infer((corridor(1) * 0.9).astype(np.uint8)))
+
+    def test_mask(self):
+        mask = np.ones((6, 8), dtype=bool)
+        mask[:, 4:] = False  # Ignore the right half.
+        gate = SceneGate(mask=mask, refresh_interval=None)
+        gate.should_infer(corridor(0))
+        frame = corridor(1)
+        frame[:, 400:] = 255
+        self.assertFalse(gate.should_infer(frame))
+        frame[200:320, 100:140] = 255
+        self.assertTrue(gate.should_infer(frame))
+        with self.assertRaises(ValueError):
+            SceneGate(mask=np.ones((4, 4)))
+        with self.assertRaises(ValueError):
+            SceneGate(mask=np.zeros((6, 8)))
+        with self.assertRaises(ValueError):
+            SceneGate(size=(30, 24))
+
+    def test_refresh_and_reset(self):
+        frame = corridor(0)
+        self.assertTrue(self.gate.should_infer(frame))
+        self.now = 4.9
+        self.assertFalse(self.gate.should_infer(frame))
+        self.now = 5.0
+        self.assertTrue(self.gate.should_infer(frame))
+        self.assertFalse(self.gate.should_infer(frame))
+        self.gate.reset()
+        self.assertTrue(self.gate.should_infer(frame))
+        stats = self.gate.stats()
+        self.assertEqual((stats.inferred, stats.skipped, stats.refreshes), (3, 2, 1))
+
+    def test_synthetic_footage(self):
+        gate = SceneGate(refresh_interval=None)
+        frames = list(scene_gate.synthetic_footage(300, size=(160, 120), occupancy=0.99,
+                                                   visit_s=2))
+        for frame in frames:
+            gate.should_infer(frame)
+        stats = gate.stats()
+        # People walking through most of the time, a static corridor otherwise.
+        self.assertGreater(stats.inferred, 20)
+        self.assertGreater(stats.skipped, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Running many pose engines in worker processes with shared models.
+
+TF-Lite memory maps a model file read-only when the interpreter is created
+from a path, so worker processes loading the same model share its pages
+through the page cache. Passing model_content instead would give every
+worker a private copy, since the Python binding only accepts bytes.
+
+What's left per worker is the interpreter arena, which can't be shared. To
+keep cold start cheap, run_workers maps the models once in the parent and
+faults all pages in before forking, so workers create their engines without
+touching the disk. Files that are not TF-Lite models at all, like an empty
+file or an error page saved by a failed download, fail there before any
+worker starts. Only the flatbuffer header is checked: building an
+interpreter would load the Edge TPU delegate in the parent, so a truncated
+or corrupt model still fails in the workers, when they create their engines.
+memory_footprint reports RSS, PSS and USS (memory only this process uses)
+to see how many workers fit on a board.
+"""
+
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+
+import numpy as np
+
+import model_profiles
+from pose_engine import PoseEngine
+
+TFLITE_IDENTIFIER = b'TFL3'
+
+
+def memory_footprint(pid='self'):
+    """Returns the memory use of a process.
+
+    Args:
+      pid: Process id, the calling process by default.
+
+    Returns:
+      Dict with 'rss', 'pss', 'uss' and 'shared' in kB. USS is the memory
+      freed if the process exits, PSS adds its share of shared pages.
+    """
+    fields = {}
+    path = '/proc/%s/smaps_rollup' % pid
+    if not os.path.exists(path):
+        path = '/proc/%s/smaps' % pid
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0][:-1]] = fields.get(parts[0][:-1], 0) + int(parts[1])
+    return {'rss': fields.get('Rss', 0),
+            'pss': fields.get('Pss', 0),
+            'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+            'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)}
+
+
+class MappedModel:
+    """Read-only memory map of a TF-Lite model file with a valid header."""
+
+    def __init__(self, path):
+        """Maps a model and checks its flatbuffer header.
+
+        Raises:
+          ValueError: If the file has no TF-Lite identifier or its root
+            offset points past the end. The rest of the model is not checked.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if (len(self.buffer) < 8 or self.buffer[4:8] != TFLITE_IDENTIFIER or
+                struct.unpack_from('<I', self.buffer)[0] >= len(self.buffer)):
+            self.close()
+            raise ValueError('{} is not a TF-Lite model.'.format(path))
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            self.buffer.madvise(mmap.MADV_WILLNEED)
+
+    @property
+    def size(self):
+        return len(self.buffer)
+
+    def fault_in(self):
+        """Reads one byte of every page, loading the file into the page cache."""
+        return bytes(memoryview(self.buffer)[::mmap.PAGESIZE])
+
+    def close(self):
+        self.buffer.close()
+
+
+def preload_models(model_paths):
+    """Maps, checks and faults in models, returns a dict of path to MappedModel."""
+    models = {}
+    for path in model_paths:
+        if path not in models:
+            models[path] = MappedModel(path)
+            models[path].fault_in()
+    return models
+
+
+def run_workers(worker, model_paths, num_workers, args=()):
+    """Preloads models, then forks worker processes.
+
+    The parent must not have opened an Edge TPU, forked workers would share
+    its handle.
+
+    Args:
+      worker: Function called in every worker as worker(index, model_paths,
+        *args), e.g. to create a PoseEngine per path.
+      model_paths: Models the workers use.
+      num_workers: Number of workers.
+      args: Extra arguments for worker.
+
+    Returns:
+      (processes, models): the started multiprocessing.Process objects and
+      the MappedModel dict, to be kept until the workers have loaded.
+    """
+    models = preload_models(model_paths)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=worker, args=(i, list(model_paths)) + tuple(args))
+                 for i in range(num_workers)]
+    for process in processes:
+        process.start()
+    return processes, models
+
+
+def _benchmark_worker(index, model_paths, results, inferences, devices):
+    start = time.monotonic()
+    device = devices[index % len(devices)] if devices else None
+    engine = PoseEngine(model_paths[0], device=device)
+    load_time = time.monotonic() - start
+    shape = engine.get_input_tensor_shape()
+    input_data = np.random.randint(0, 256, np.prod(shape), dtype=np.uint8)
+    times = [engine.run_inference(input_data) for _ in range(inferences)]
+    results.put((index, load_time, float(np.median(times)), memory_footprint()))
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model', help='.tflite model path, defaults to the 641x481 '
+                        'Edge TPU model.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of worker processes.')
+    parser.add_argument('--inferences', type=int, default=10,
+                        help='Inferences per worker before measuring memory.')
+    parser.add_argument('--devices', default='',
+                        help='Comma separated Edge TPUs to spread workers over, e.g. usb:0,usb:1.')
+    args = parser.parse_args()
+    model = args.model or model_profiles.closest_profile((640, 480)).model_path
+    devices = [d for d in args.devices.split(',') if d]
+
+    start = time.monotonic()
+    results = multiprocessing.get_context('fork').Queue()
+    processes, models = run_workers(_benchmark_worker, [model], args.workers,
+                                    (results, args.inferences, devices))
+    reports = sorted(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    print('%s (%d kB), %d workers started and measured in %.2f s' % (
+        model, models[model].size // 1024, args.workers, time.monotonic() - start))
+    print('%-8s %8s %8s %9s %9s %9s %9s' % (
+        'worker', 'load ms', 'inf ms', 'RSS kB', 'PSS kB', 'USS kB', 'shared kB'))
+    for index, load_time, inference_ms, memory in reports:
+        print('%-8d %8.1f %8.1f %9d %9d %9d %9d' % (
+            index, load_time * 1000, inference_ms, memory['rss'], memory['pss'],
+            memory['uss'], memory['shared']))
+    parent = memory_footprint()
+    mean_uss = np.mean([memory['uss'] for _, _, _, memory in reports])
+    print('parent: RSS %d kB, USS %d kB' % (parent['rss'], parent['uss']))
+    with open('/proc/meminfo') as f:
+        available = next(int(line.split()[1]) for line in f if line.startswith('MemAvailable'))
+    print('%d kB available, room for about %d more workers of %.0f kB USS' % (
+        available, available // mean_uss, mean_uss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+import shared_models
+
+model = 'models/mobilenet/posenet_mobilenet_v1_075_353_481_quant_decoder.tflite'
+
+
+def _worker(index, model_paths, results):
+    from pose_engine import PoseEngine
+    engine = PoseEngine(model_paths[0])
+    results.put((index, list(engine.get_input_tensor_shape()),
+                 shared_models.memory_footprint()['uss']))
+
+
+class SharedModelsTest(unittest.TestCase):
+
+    def test_memory_footprint(self):
+        memory = shared_models.memory_footprint()
+        self.assertGreater(memory['rss'], 0)
+        self.assertLessEqual(memory['uss'], memory['pss'])
+        self.assertLessEqual(memory['pss'], memory['rss'])
+
+    def test_mapped_model(self):
+        mapped = shared_models.MappedModel(model)
+        self.assertEqual(mapped.size, os.path.getsize(model))
+        self.assertEqual(len(mapped.fault_in()), -(-mapped.size // shared_models.mmap.PAGESIZE))
+        mapped.close()
+
+    def test_rejects_invalid_model(self):
+        with tempfile.NamedTemporaryFile(suffix='.tflite') as f:
+            f.write(b'not a model at all')
+            f.flush()
+            with self.assertRaises(ValueError):
+                shared_models.MappedModel(f.name)
+
+    def test_run_workers(self):
+        results = multiprocessing.get_context('fork').Queue()
+        processes, models = shared_models.run_workers(_worker, [model, model], 2, (results,))
+        reports = sorted(results.get(timeout=60) for _ in processes)
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(list(models), [model])
+        self.assertEqual([r[0] for r in reports], [0, 1])
+        for _, shape, uss in reports:
+            self.assertEqual(shape, [1, 353, 481, 3])
+            self.assertGreater(uss, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""PoseNet with the backbone and the decoder run as separate stages.
+
+The fused *_quant_decoder models run the MobileNet backbone and the PoseNet
+decoder custom op in one blocking invoke. SplitPoseEngine runs the component
+models from models/*/components instead, the backbone (*_quant.tflite) and the
+decoder (*_decoder.tflite), in two interpreters. run_pipelined overlaps them:
+while the decoder works on frame k on its own thread, the backbone already
+runs frame k + 1, with a bounded queue of dequantized feature maps in between.
+"""
+
+import argparse
+import collections
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from pose_engine import PoseEngine, input_array, make_interpreter, parse_poses
+
+COMPONENTS_DIR = os.path.join('models', 'mobilenet', 'components')
+
+StageTimes = collections.namedtuple(
+    'StageTimes', ['backbone_ms', 'transfer_ms', 'decoder_ms', 'parse_ms'])
+StageTimes.__doc__ = """Time spent on one frame in every stage.
+
+  backbone_ms: Backbone invoke.
+  transfer_ms: Dequantizing the backbone outputs into decoder inputs.
+  decoder_ms: Decoder invoke.
+  parse_ms: Converting decoder outputs into poses.
+"""
+
+
+def component_paths(height, width, components_dir=COMPONENTS_DIR):
+    """Returns (backbone_path, decoder_path) of a mobilenet input size."""
+    prefix = os.path.join(components_dir, 'posenet_mobilenet_v1_075_%d_%d' % (height, width))
+    return prefix + '_quant.tflite', prefix + '_decoder.tflite'
+
+
+class SplitPoseEngine:
+    """Pose engine running the backbone and the decoder as separate stages."""
+
+    def __init__(self, backbone_path, decoder_path, mirror=False, max_pending=2):
+        """Creates a SplitPoseEngine.
+
+        Args:
+          backbone_path: String, path to the backbone TF-Lite model.
+          decoder_path: String, path to the decoder TF-Lite model.
+          mirror: Flip keypoints horizontally.
+          max_pending: Frames allowed between the stages in run_pipelined.
+
+        Raises:
+          ValueError: If the backbone outputs don't match the decoder inputs.
+        """
+        self._backbone = make_interpreter(backbone_path, decoder=False)
+        self._backbone.allocate_tensors()
+        self._decoder = make_interpreter(decoder_path)
+        self._decoder.allocate_tensors()
+        self._mirror = mirror
+        self._max_pending = max_pending
+
+        input_details = self._backbone.get_input_details()[0]
+        _, self._input_height, self._input_width, _ = input_details['shape']
+        self._input_index = input_details['index']
+        self._input_dtype = input_details['dtype']
+
+        # Backbone outputs are matched to decoder inputs by name.
+        decoder_inputs = {d['name']: d for d in self._decoder.get_input_details()}
+        self._links = []
+        for output in self._backbone.get_output_details():
+            decoder_input = decoder_inputs.get(output['name'])
+            if decoder_input is None or list(decoder_input['shape']) != list(output['shape']):
+                raise ValueError('Backbone output {} {} has no matching decoder input.'.format(
+                    output['name'], output['shape']))
+            scale, zero_point = output['quantization']
+            self._links.append((output['index'], decoder_input['index'], scale, zero_point))
+        self._decoder_outputs = [d['index'] for d in self._decoder.get_output_details()]
+
+        self._poses = []
+        self._inf_time = 0
+        self.stage_times = None
+
+    def get_input_tensor_shape(self):
+        """Returns input tensor shape."""
+        return self._backbone.get_input_details()[0]['shape']
+
+    def _run_backbone(self, input_data):
+        """Runs the backbone, returns dequantized feature maps and timings."""
+        start = time.monotonic()
+        input_data = input_array(input_data)
+        if input_data.dtype != self._input_dtype:
+            input_data = input_data.view(self._input_dtype)
+        self._backbone.set_tensor(self._input_index, input_data.reshape(self.get_input_tensor_shape()))
+        self._backbone.invoke()
+        backbone_done = time.monotonic()
+        features = []
+        for output_index, _, scale, zero_point in self._links:
+            tensor = self._backbone.get_tensor(output_index)
+            if scale:
+                tensor = (tensor.astype(np.float32) - zero_point) * np.float32(scale)
+            features.append(tensor)
+        transfer_done = time.monotonic()
+        return features, (backbone_done - start, transfer_done - backbone_done)
+
+    def _run_decoder(self, features):
+        """Runs the decoder, returns poses and timings."""
+        start = time.monotonic()
+        for (_, input_index, _, _), tensor in zip(self._links, features):
+            self._decoder.set_tensor(input_index, tensor)
+        self._decoder.invoke()
+        decoder_done = time.monotonic()
+        keypoints, keypoint_scores, pose_scores, num_poses = (
+            np.squeeze(self._decoder.get_tensor(i)) for i in self._decoder_outputs)
+        poses = parse_poses(keypoints, keypoint_scores, pose_scores, num_poses,
+                            self._mirror, self._input_width)
+        return poses, (decoder_done - start, time.monotonic() - decoder_done)
+
+    @staticmethod
+    def _stage_times(backbone_times, decoder_times):
+        return StageTimes(*(1000 * t for t in backbone_times + decoder_times))
+
+    def run_inference(self, input_data):
+        """Runs both stages on one frame and returns inference time in ms.
+
+        Args:
+          input_data: Flat buffer with the model input, as for PoseEngine.
+        """
+        features, backbone_times = self._run_backbone(input_data)
+        self._poses, decoder_times = self._run_decoder(features)
+        self.stage_times = self._stage_times(backbone_times, decoder_times)
+        self._inf_time = sum(backbone_times + decoder_times[:1])
+        return self._inf_time * 1000
+
+    def ParseOutput(self):
+        """Returns the poses of the last run_inference and the inference time."""
+        return self._poses, self._inf_time
+
+    def DetectPosesInImage(self, img):
+        """Detects poses in a PIL image, see PoseEngine.DetectPosesInImage."""
+        resized_image = img.resize((self._input_width, self._input_height), Image.NEAREST)
+        self.run_inference(np.asarray(resized_image).flatten())
+        return self.ParseOutput()
+
+    def run_pipelined(self, inputs):
+        """Runs the stages overlapped over a stream of frames.
+
+        The backbone runs on the calling thread and the decoder on a worker
+        thread. When the decoder falls behind by max_pending frames the
+        backbone waits. An exception in the decoder is raised here, after
+        the results of the frames before it.
+
+        Args:
+          inputs: Iterable of flat input buffers.
+
+        Yields:
+          (poses, stage_times) for every input, in order.
+        """
+        features_queue = queue.Queue(maxsize=self._max_pending)
+        results = queue.Queue()
+
+        def decode_loop():
+            try:
+                while True:
+                    item = features_queue.get()
+                    if item is None:
+                        break
+                    features, backbone_times = item
+                    poses, decoder_times = self._run_decoder(features)
+                    results.put((poses, self._stage_times(backbone_times, decoder_times)))
+            except Exception as e:
+                # Raised in the caller when it reaches this frame.
+                results.put(e)
+
+        def put(item):
+            # A dead worker never drains the queue, don't wait for it.
+            while worker.is_alive():
+                try:
+                    features_queue.put(item, timeout=0.05)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get():
+            result = results.get()
+            if isinstance(result, BaseException):
+                raise result
+            return result
+
+        worker = threading.Thread(target=decode_loop)
+        worker.start()
+        pending = 0
+        try:
+            for input_data in inputs:
+                if not put(self._run_backbone(input_data)):
+                    break
+                pending += 1
+                while not results.empty():
+                    pending -= 1
+                    yield get()
+        finally:
+            put(None)
+            worker.join()
+        for _ in range(pending):
+            yield get()
+
+
+def benchmark(height, width, frames, fused_model=None, backbone=None):
+    """Compares fused, split sequential and split pipelined throughput."""
+    default_backbone, decoder = component_paths(height, width)
+    backbone = backbone or default_backbone
+    fused_model = fused_model or os.path.join(
+        'models', 'mobilenet', 'posenet_mobilenet_v1_075_%d_%d_quant_decoder.tflite' % (height, width))
+    image = Image.open(os.path.join('test_data', 'test_couple.jpg')).convert('RGB')
+    input_data = np.asarray(image.resize((width, height), Image.NEAREST)).flatten()
+    inputs = [input_data] * frames
+
+    fused = PoseEngine(fused_model)
+    fused.run_inference(input_data)
+    start = time.monotonic()
+    for frame in inputs:
+        fused.run_inference(frame)
+        fused.ParseOutput()
+    fused_fps = frames / (time.monotonic() - start)
+
+    split = SplitPoseEngine(backbone, decoder)
+    split.run_inference(input_data)
+    totals = np.zeros(4)
+    start = time.monotonic()
+    for frame in inputs:
+        split.run_inference(frame)
+        split.ParseOutput()
+        totals += split.stage_times
+    sequential_fps = frames / (time.monotonic() - start)
+
+    start = time.monotonic()
+    for _ in split.run_pipelined(inputs):
+        pass
+    pipelined_fps = frames / (time.monotonic() - start)
+
+    print('%dx%d: fused %.1f fps, split %.1f fps, split pipelined %.1f fps' %
+          (width, height, fused_fps, sequential_fps, pipelined_fps))
+    print('  per frame: %s' % ', '.join('%s %.2f' % (name, t / frames) for name, t
+                                        in zip(StageTimes._fields, totals)))
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--frames', type=int, default=200, help='Frames per measurement.')
+    parser.add_argument('--fused_model', help='Fused model to compare against, '
+                        'defaults to the CPU model of the same size.')
+    parser.add_argument('--backbone', help='Backbone model, for example one compiled '
+                        'for the Edge TPU. Defaults to the CPU component model.')
+    parser.add_argument('--res', default='all',
+                        choices=['all', '353x481', '481x641', '721x1281'],
+                        help='Model input size.')
+    args = parser.parse_args()
+    sizes = ((353, 481), (481, 641), (721, 1281))
+    for height, width in sizes:
+        if args.res in ('all', '%dx%d' % (height, width)):
+            benchmark(height, width, args.frames, args.fused_model, args.backbone)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import unittest
+
+import numpy as np
+from PIL import Image
+
+from pose_engine import PoseEngine, poses_to_arrays
+from split_pose_engine import SplitPoseEngine, component_paths
+
+test_image = os.path.join(os.getcwd(), 'test_data/test_couple.jpg')
+fused_model = 'models/mobilenet/posenet_mobilenet_v1_075_353_481_quant_decoder.tflite'
+
+
+class SplitPoseEngineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.image = Image.open(test_image).convert('RGB')
+        cls.engine = SplitPoseEngine(*component_paths(353, 481))
+
+    def test_matches_fused_model(self):
+        poses, _ = self.engine.DetectPosesInImage(self.image)
+        fused_poses, _ = PoseEngine(fused_model).DetectPosesInImage(self.image)
+        self.assertGreater(len(fused_poses), 0)
+        # The fused model decodes at most 10 poses, the decoder component 20.
+        keypoints, keypoint_scores, pose_scores = poses_to_arrays(poses[:len(fused_poses)])
+        expected = poses_to_arrays(fused_poses)
+        # The fused model feeds the decoder differently, so only most
+        # keypoints agree closely.
+        distances = np.linalg.norm(keypoints - expected[0], axis=-1)
+        self.assertLess(np.median(distances), 1.0)
+        self.assertLess(np.median(np.abs(keypoint_scores - expected[1])), 0.01)
+        np.testing.assert_allclose(pose_scores, expected[2], atol=0.1)
+
+    def test_pipelined_matches_sequential(self):
+        inputs = []
+        expected = []
+        for image in (self.image, self.image.transpose(Image.FLIP_LEFT_RIGHT),
+                      self.image.crop((0, 0, 400, 300))):
+            image = image.resize((481, 353), Image.NEAREST)
+            inputs.append(np.asarray(image).flatten())
+            self.engine.run_inference(inputs[-1])
+            expected.append(self.engine.ParseOutput()[0])
+        results = list(self.engine.run_pipelined(inputs))
+        self.assertEqual(len(results), len(inputs))
+        for (poses, stage_times), expected_poses in zip(results, expected):
+            self.assertEqual(len(poses), len(expected_poses))
+            for array, expected_array in zip(poses_to_arrays(poses),
+                                             poses_to_arrays(expected_poses)):
+                np.testing.assert_array_equal(array, expected_array)
+            self.assertTrue(all(t >= 0 for t in stage_times))
+
+    def test_mismatched_components(self):
+        backbone, _ = component_paths(353, 481)
+        _, decoder = component_paths(481, 641)
+        with self.assertRaises(ValueError):
+            SplitPoseEngine(backbone, decoder)
+
+
+class FailingDecoderEngine(SplitPoseEngine):
+    """Stands in for the interpreters, the decoder fails on one frame."""
+
+    def __init__(self, fail_at, max_pending=2):
+        self._max_pending = max_pending
+        self._fail_at = fail_at
+
+    def _run_backbone(self, input_data):
+        return input_data, (0.0, 0.0)
+
+    def _run_decoder(self, features):
+        if features == self._fail_at:
+            raise RuntimeError('decoder failed on %d' % features)
+        return [features], (0.0, 0.0)
+
+
+class RunPipelinedErrorTest(unittest.TestCase):
+
+    def test_decoder_error_is_raised(self):
+        threads = set(threading.enumerate())
+        for fail_at in (0, 3):
+            engine = FailingDecoderEngine(fail_at)
+            results = []
+            with self.assertRaisesRegex(RuntimeError, 'decoder failed on %d' % fail_at):
+                for poses, _ in engine.run_pipelined(range(50)):
+                    results.append(poses[0])
+            self.assertEqual(results, list(range(fail_at)))
+            # The decoder thread is joined.
+            self.assertEqual(set(threading.enumerate()) - threads, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,14 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import itertools
-import svgwrite
+import argparse
+import collections
+import queue
+import threading
 import time
 
 import numpy as np
-import fluidsynth
+import svgwrite
 
-import pose_camera
+from pose_engine import KeypointType, poses_to_arrays
+from pose_tracker import PoseTracker
 
 OCTAVE = 12
 FIFTH = 7
@@ -44,6 +47,10 @@ VOICE_OOHS = 54
 
 CHANNELS = (OVERDRIVEN_GUITAR, ELECTRIC_BASS_FINGER, VOICE_OOHS)
 
+# Delay between a frame's poses and its notes. Playing every frame's notes
+# at a fixed delay turns render time jitter into a constant latency.
+LOOKAHEAD = 0.03
+
 
 class Identity:
     def __init__(self, color, base_note, instrument, extent=2*OCTAVE):
@@ -60,96 +67,195 @@ IDENTITIES = (
 )
 
 
-class Pose:
-    def __init__(self, pose, threshold):
-        self.pose = pose
-        self.id = None
-        self.keypoints = {label: k for label, k in pose.keypoints.items()
-                          if k.score > threshold}
-        self.center = (np.mean([k.point for k in self.keypoints.values()], axis=0)
-                       if self.keypoints else None)
-
-    def quadrance(self, other):
-        d = self.center - other.center
-        return d.dot(d)
-
-
-class PoseTracker:
-    def __init__(self):
-        self.prev_poses = []
-        self.next_pose_id = 0
-
-    def assign_pose_ids(self, poses):
-        """copy nearest pose ids from previous frame to current frame"""
-        all_pairs = sorted(itertools.product(poses, self.prev_poses),
-                           key=lambda pair: pair[0].quadrance(pair[1]))
-        used_ids = set()
-        for pose, prev_pose in all_pairs:
-            if pose.id is None and prev_pose.id not in used_ids:
-                pose.id = prev_pose.id
-                used_ids.add(pose.id)
-
-        for pose in poses:
-            if pose.id is None:
-                pose.id = self.next_pose_id
-                self.next_pose_id += 1
-
-        self.prev_poses = poses
-
-
-def main():
-    pose_tracker = PoseTracker()
+def wrist_notes(keypoints, keypoint_scores, track_ids, inference_box, threshold=0.2):
+    """Returns a dict of (channel, note) to velocity for a frame.
+
+    Every person with both wrists visible plays one note on the instrument of
+    their identity: the higher the right wrist, the higher the pitch, and the
+    higher the left wrist, the louder.
+
+    Args:
+      keypoints: [N, 17, 2] keypoints in inference tensor coordinates.
+      keypoint_scores: [N, 17] keypoint scores.
+      track_ids: [N] track ids, which pick the identity.
+      inference_box: Source image box inside the inference tensor.
+      threshold: Wrists scoring below this are ignored.
+    """
+    _, box_y, _, box_h = inference_box
+    notes = {}
+    for pose_keypoints, scores, track_id in zip(keypoints, keypoint_scores, track_ids):
+        if (scores[KeypointType.LEFT_WRIST] < threshold or
+                scores[KeypointType.RIGHT_WRIST] < threshold):
+            continue
+        identity = IDENTITIES[track_id % len(IDENTITIES)]
+        left = 1 - (pose_keypoints[KeypointType.LEFT_WRIST][1] - box_y) / box_h
+        right = 1 - (pose_keypoints[KeypointType.RIGHT_WRIST][1] - box_y) / box_h
+        velocity = int(np.clip(left, 0, 1) * 100)
+        i = min(int(np.clip(right, 0, 1) * identity.extent), identity.extent - 1)
+        note = (identity.base_note
+                + OCTAVE * (i // len(SCALE))
+                + SCALE[i % len(SCALE)])
+        notes[(identity.channel, note)] = velocity
+    return notes
+
+
+class StubSynth:
+    """Synth backend that records note events instead of playing them."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.events = []
+
+    def noteon(self, channel, note, velocity):
+        self.events.append((self.clock(), 'noteon', channel, note, velocity))
+
+    def noteoff(self, channel, note):
+        self.events.append((self.clock(), 'noteoff', channel, note))
+
+
+def fluidsynth_synth(driver='alsa', soundfont='/usr/share/sounds/sf2/FluidR3_GM.sf2'):
+    """Returns a started FluidSynth synth with CHANNELS programmed."""
+    import fluidsynth
     synth = fluidsynth.Synth()
-
-    synth.start('alsa')
-    soundfont_id = synth.sfload('/usr/share/sounds/sf2/FluidR3_GM.sf2')
+    synth.start(driver)
+    soundfont_id = synth.sfload(soundfont)
     for channel, instrument in enumerate(CHANNELS):
         synth.program_select(channel, soundfont_id, 0, instrument)
+    return synth
+
+
+class NoteScheduler:
+    """Turns tracked poses into notes on a dedicated audio thread.
+
+    The render callback only queues each frame's wrists with the frame time.
+    The audio thread computes the notes, and at frame time + lookahead plays
+    the changes from the previous frame in one batch, note offs first.
+    Frames that can't be played in time are played late and counted. If the
+    audio thread falls behind by more than max_pending frames, the oldest
+    frames are dropped; notes are a state, so the next frame's changes
+    still bring the synth up to date.
+    """
+
+    def __init__(self, synth, lookahead=LOOKAHEAD, max_pending=8, threshold=0.2,
+                 clock=time.monotonic):
+        """Creates a scheduler and starts its thread.
+
+        Args:
+          synth: Backend with noteon(channel, note, velocity) and
+            noteoff(channel, note), e.g. a fluidsynth.Synth or StubSynth.
+          lookahead: Seconds between a frame's time and its notes.
+          max_pending: Frames allowed to wait for the audio thread.
+          threshold: Wrists scoring below this are ignored.
+          clock: Time source, must match the frame timestamps.
+        """
+        self.synth = synth
+        self.lookahead = lookahead
+        self.threshold = threshold
+        self.clock = clock
+        self.notes = {}
+        self.latencies = collections.deque(maxlen=1000)
+        self.frames = 0
+        self.late = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, keypoints, keypoint_scores, track_ids, inference_box, timestamp=None):
+        """Queues a frame, never blocking. See wrist_notes for the arguments."""
+        if timestamp is None:
+            timestamp = self.clock()
+        item = (timestamp, keypoints, keypoint_scores, track_ids, inference_box)
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def stats(self):
+        """Returns (median, 99th percentile) pose to note latency in ms."""
+        if not self.latencies:
+            return 0.0, 0.0
+        return tuple(float(v) * 1000 for v in np.percentile(self.latencies, [50, 99]))
+
+    def close(self):
+        """Plays queued frames, silences all notes and stops the thread."""
+        self._queue.put(None)
+        self._thread.join()
+        for note in self.notes:
+            self.synth.noteoff(*note)
+        self.notes = {}
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            timestamp, keypoints, keypoint_scores, track_ids, inference_box = item
+            notes = wrist_notes(keypoints, keypoint_scores, track_ids, inference_box,
+                                self.threshold)
+            delay = timestamp + self.lookahead - self.clock()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.late += 1
+            for note in self.notes:
+                if note not in notes:
+                    self.synth.noteoff(*note)
+            for note, velocity in notes.items():
+                if note not in self.notes:
+                    self.synth.noteon(*note, velocity)
+            self.notes = notes
+            self.frames += 1
+            self.latencies.append(self.clock() - timestamp)
 
-    prev_notes = set()
+
+def main():
+    # Imported here so the note scheduling above works without GStreamer.
+    import pose_camera
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--stub_synth', action='store_true',
+                        help='Record notes instead of playing them, e.g. without a sound card.')
+    args, _ = parser.parse_known_args()
+    synth = StubSynth() if args.stub_synth else fluidsynth_synth()
+    scheduler = NoteScheduler(synth)
+    pose_tracker = PoseTracker()
 
     def run_inference(engine, input_tensor):
         return engine.run_inference(input_tensor)
 
     def render_overlay(engine, output, src_size, inference_box):
-        nonlocal prev_notes
+        timestamp = time.monotonic()
         svg_canvas = svgwrite.Drawing('', size=src_size)
         outputs, inference_time = engine.ParseOutput()
 
-        poses = [pose for pose in (Pose(pose, 0.2) for pose in outputs)
-                 if pose.keypoints]
-        pose_tracker.assign_pose_ids(poses)
-
-        velocities = {}
-        for pose in poses:
-            left = pose.keypoints.get('left wrist')
-            right = pose.keypoints.get('right wrist')
-            if not (left and right): continue
-
-            identity = IDENTITIES[pose.id % len(IDENTITIES)]
-            left = 1 - left.point[0] / engine.image_height
-            right = 1 - right.point[0] / engine.image_height
-            velocity = int(left * 100)
-            i = int(right * identity.extent)
-            note = (identity.base_note
-                    + OCTAVE * (i // len(SCALE))
-                    + SCALE[i % len(SCALE)])
-            velocities[(identity.channel, note)] = velocity
-
-        for note in prev_notes:
-            if note not in velocities: synth.noteoff(*note)
-        for note, velocity in velocities.items():
-            if note not in prev_notes:
-                synth.noteon(*note, velocity)
-        prev_notes = velocities.keys()
-
-        for i, pose in enumerate(poses):
-            identity = IDENTITIES[pose.id % len(IDENTITIES)]
+        keypoints, keypoint_scores, _ = poses_to_arrays(outputs)
+        visible = (keypoint_scores > 0.2).any(axis=1)
+        outputs = [pose for pose, v in zip(outputs, visible) if v]
+        track_ids = pose_tracker.update(keypoints[visible], keypoint_scores[visible])
+        scheduler.submit(keypoints[visible], keypoint_scores[visible], track_ids,
+                         inference_box, timestamp)
+
+        for pose, track_id in zip(outputs, track_ids):
+            identity = IDENTITIES[track_id % len(IDENTITIES)]
             pose_camera.draw_pose(svg_canvas, pose, src_size, inference_box, color=identity.color)
+        median, p99 = scheduler.stats()
+        pose_camera.shadow_text(svg_canvas, 10, 20, 'Pose to note: %.1f ms (p99 %.1f ms)' % (
+            median, p99))
 
         return (svg_canvas.tostring(), False)
 
-    pose_camera.run(run_inference, render_overlay)
+    try:
+        pose_camera.run(run_inference, render_overlay, parents=[parser])
+    finally:
+        scheduler.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,92 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import numpy as np
+
+import synthesizer
+from pose_engine import KeypointType
+
+BOX = (0, 0, 640, 480)
+
+
+def wrists(heights):
+    """Returns pose arrays with both wrists of every pose at (left, right) heights."""
+    keypoints = np.zeros((len(heights), 17, 2), dtype=np.float32)
+    keypoint_scores = np.zeros((len(heights), 17), dtype=np.float32)
+    for i, (left, right) in enumerate(heights):
+        keypoints[i, KeypointType.LEFT_WRIST] = (100, 480 * (1 - left))
+        keypoints[i, KeypointType.RIGHT_WRIST] = (200, 480 * (1 - right))
+        keypoint_scores[i, [KeypointType.LEFT_WRIST, KeypointType.RIGHT_WRIST]] = 0.9
+    return keypoints, keypoint_scores
+
+
+class WristNotesTest(unittest.TestCase):
+
+    def test_pitch_and_velocity(self):
+        keypoints, keypoint_scores = wrists([(0.5, 0.0), (1.0, 0.99)])
+        notes = synthesizer.wrist_notes(keypoints, keypoint_scores, [0, 1], BOX)
+        guitar, bass = synthesizer.IDENTITIES[:2]
+        self.assertEqual(notes, {
+            (guitar.channel, guitar.base_note + synthesizer.SCALE[0]): 50,
+            (bass.channel, bass.base_note + 4 * synthesizer.OCTAVE + synthesizer.SCALE[3]): 100,
+        })
+
+    def test_hidden_wrist(self):
+        keypoints, keypoint_scores = wrists([(0.5, 0.5)])
+        keypoint_scores[0, KeypointType.RIGHT_WRIST] = 0.1
+        self.assertEqual(synthesizer.wrist_notes(keypoints, keypoint_scores, [0], BOX), {})
+
+
+class NoteSchedulerTest(unittest.TestCase):
+
+    def test_batches_changes_at_lookahead(self):
+        synth = synthesizer.StubSynth()
+        scheduler = synthesizer.NoteScheduler(synth, lookahead=0.05)
+        start = time.monotonic()
+        for heights in ([(0.5, 0.0)], [(0.5, 0.0)], [(0.8, 0.5)], []):
+            keypoints, keypoint_scores = wrists(heights)
+            scheduler.submit(keypoints, keypoint_scores, np.zeros(len(heights), dtype=int), BOX)
+        scheduler.close()
+
+        kinds = [event[1:] for event in synth.events]
+        channel = synthesizer.IDENTITIES[0].channel
+        first = synthesizer.IDENTITIES[0].base_note + synthesizer.SCALE[0]
+        second = synthesizer.IDENTITIES[0].base_note + synthesizer.OCTAVE * 2 + synthesizer.SCALE[2]
+        self.assertEqual(kinds, [('noteon', channel, first, 50),
+                                 ('noteoff', channel, first),
+                                 ('noteon', channel, second, 80),
+                                 ('noteoff', channel, second)])
+        self.assertGreaterEqual(synth.events[0][0] - start, 0.05)
+        self.assertEqual(scheduler.frames, 4)
+        median, _ = scheduler.stats()
+        self.assertGreaterEqual(median, 50)
+
+    def test_submit_never_blocks(self):
+        synth = synthesizer.StubSynth()
+        scheduler = synthesizer.NoteScheduler(synth, lookahead=0.2, max_pending=2)
+        keypoints, keypoint_scores = wrists([(0.5, 0.5)])
+        start = time.monotonic()
+        for _ in range(100):
+            scheduler.submit(keypoints, keypoint_scores, [0], BOX)
+        self.assertLess(time.monotonic() - start, 0.1)
+        scheduler.close()
+        self.assertGreater(scheduler.dropped, 0)
+        self.assertEqual(len(synth.events), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
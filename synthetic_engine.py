@@ -0,0 +1,232 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A stand-in for PoseEngine that makes up moving people.
+
+SyntheticPoseEngine has the surface of PoseEngine (get_input_tensor_shape,
+run_inference, ParseOutput, ParseOutputQuantized, DetectPosesInImage) but
+needs no model, delegate or Edge TPU, so tracking, drawing and the other
+stages downstream of the engine can be tested and load tested anywhere.
+Input pixels are ignored. Every run_inference advances a simulation by one
+frame of 1 / frame_rate seconds:
+
+  * people walk across the frame with a swinging gait, at random speeds
+    that drift over time, and turn around at the edges;
+  * now and then a person is partly occluded for a while, legs, upper body
+    or one side, and those keypoints score low;
+  * keypoint scores and positions are noisy, keypoints outside the frame
+    score 0, and poses come out sorted by score like from the decoder.
+
+The same seed gives the same poses, independent of wall time.
+
+    engine = synthetic_engine.SyntheticPoseEngine(people=20, seed=1)
+    engine.run_inference(None)
+    poses, inference_time = engine.ParseOutput()
+
+load_benchmark.py drives the pose_camera callbacks with it.
+"""
+
+import time
+
+import numpy as np
+
+from pose_engine import (KEYPOINT_QUANTIZATION, SCORE_QUANTIZATION, STANDING_POSE,
+                         KeypointType, QuantizedPoses, arrays_to_poses)
+
+# Keypoints hidden together by an occluder.
+OCCLUSIONS = (
+    [KeypointType.LEFT_KNEE, KeypointType.RIGHT_KNEE,
+     KeypointType.LEFT_ANKLE, KeypointType.RIGHT_ANKLE],
+    [KeypointType.NOSE, KeypointType.LEFT_EYE, KeypointType.RIGHT_EYE,
+     KeypointType.LEFT_EAR, KeypointType.RIGHT_EAR,
+     KeypointType.LEFT_SHOULDER, KeypointType.RIGHT_SHOULDER],
+    [KeypointType.LEFT_EAR, KeypointType.LEFT_SHOULDER, KeypointType.LEFT_ELBOW,
+     KeypointType.LEFT_WRIST, KeypointType.LEFT_HIP, KeypointType.LEFT_KNEE,
+     KeypointType.LEFT_ANKLE],
+    [KeypointType.RIGHT_EAR, KeypointType.RIGHT_SHOULDER, KeypointType.RIGHT_ELBOW,
+     KeypointType.RIGHT_WRIST, KeypointType.RIGHT_HIP, KeypointType.RIGHT_KNEE,
+     KeypointType.RIGHT_ANKLE],
+)
+
+# Horizontal swing of limbs over a stride, relative to the person's height;
+# arms swing against the leg on the same side.
+SWING = np.zeros(len(KeypointType), dtype=np.float32)
+SWING[[KeypointType.LEFT_ELBOW, KeypointType.RIGHT_KNEE]] = 0.04
+SWING[[KeypointType.LEFT_WRIST, KeypointType.RIGHT_ANKLE]] = 0.08
+SWING[[KeypointType.RIGHT_ELBOW, KeypointType.LEFT_KNEE]] = -0.04
+SWING[[KeypointType.RIGHT_WRIST, KeypointType.LEFT_ANKLE]] = -0.08
+
+
+class SyntheticPoseEngine:
+    """Pose engine returning simulated people instead of running a model.
+
+    Attributes:
+      person_ids: Index of the simulated person of every pose of the last
+        frame, the ground truth for tracking.
+    """
+
+    def __init__(self, input_size=(641, 481), people=5, frame_rate=30.0, speed=0.15,
+                 occlusion=0.1, occlusion_s=1.0, score_noise=0.05, keypoint_noise=1.0,
+                 inference_ms=0.0, sleep=False, mirror=False, max_poses=None, seed=0):
+        """Creates the people of the simulation.
+
+        Args:
+          input_size: (width, height) of the simulated model input.
+          people: Number of people.
+          frame_rate: Simulated frames per second, run_inference advances
+            the simulation by 1 / frame_rate seconds.
+          speed: Mean walking speed in frame widths per second.
+          occlusion: Fraction of the time a person is partly occluded.
+          occlusion_s: Mean length of an occlusion in seconds.
+          score_noise: Standard deviation of keypoint scores.
+          keypoint_noise: Standard deviation of keypoint positions in pixels.
+          inference_ms: Inference time reported by run_inference.
+          sleep: Whether run_inference sleeps for inference_ms, to simulate
+            the accelerator's latency.
+          mirror: Flip keypoints horizontally, like PoseEngine.
+          max_poses: Most poses returned, the highest scoring ones; all if None.
+          seed: Random seed.
+        """
+        self.input_size = tuple(int(x) for x in input_size)
+        self.people = people
+        self.frame_rate = frame_rate
+        self.speed = speed
+        self.occlusion = occlusion
+        self.occlusion_s = occlusion_s
+        self.score_noise = score_noise
+        self.keypoint_noise = keypoint_noise
+        self.inference_ms = inference_ms
+        self.sleep = sleep
+        self.mirror = mirror
+        self.max_poses = max_poses
+        self.frames = 0
+        self._rng = np.random.RandomState(seed)
+
+        width, height = self.input_size
+        rng = self._rng
+        self.heights = rng.uniform(0.3, 0.7, people).astype(np.float32) * height
+        # Position of the nose.
+        self.positions = np.stack([rng.uniform(0, width, people),
+                                   rng.uniform(0.05, 0.95, people) * (height - self.heights)],
+                                  axis=1).astype(np.float32)
+        directions = rng.choice([-1, 1], people)
+        self.velocities = np.stack([directions * rng.uniform(0.5, 1.5, people) * speed * width,
+                                    rng.normal(0, 0.02 * height, people)],
+                                   axis=1).astype(np.float32)
+        self.phases = rng.uniform(0, 2 * np.pi, people)
+        self.occluded = np.full(people, -1)  # Index into OCCLUSIONS, -1 for none.
+        self._arrays = self._empty()
+        self.person_ids = np.zeros(0, dtype=np.int64)
+        self._inf_time = 0.0
+
+    def _empty(self):
+        return (np.zeros((0, len(KeypointType), 2), dtype=np.float32),
+                np.zeros((0, len(KeypointType)), dtype=np.float32),
+                np.zeros(0, dtype=np.float32))
+
+    def get_input_tensor_shape(self):
+        """Returns the input shape of the simulated model, [1, height, width, 3]."""
+        return np.array([1, self.input_size[1], self.input_size[0], 3])
+
+    def _step(self):
+        """Moves everybody one frame ahead."""
+        rng = self._rng
+        width, height = self.input_size
+        dt = 1 / self.frame_rate
+        # Speed drifts and people turn around at the edges.
+        self.velocities += rng.normal(0, 0.2 * self.speed * width * dt,
+                                      self.velocities.shape).astype(np.float32)
+        self.positions += self.velocities * dt
+        low = np.stack([np.zeros(self.people), np.zeros(self.people)], axis=1)
+        high = np.stack([np.full(self.people, width), height - self.heights], axis=1)
+        outside = (self.positions < low) | (self.positions > high)
+        self.velocities[outside] *= -1
+        self.positions = np.clip(self.positions, low, high).astype(np.float32)
+        # Strides are about as long as a person is tall.
+        self.phases += np.pi * np.abs(self.velocities[:, 0]) / self.heights * dt
+
+        if self.occlusion:
+            mean_frames = self.occlusion_s * self.frame_rate
+            start = (self.occluded < 0) & (rng.random_sample(self.people) < (
+                self.occlusion / ((1 - self.occlusion) * mean_frames)))
+            end = (self.occluded >= 0) & (rng.random_sample(self.people) < 1 / mean_frames)
+            self.occluded[end] = -1
+            self.occluded[start] = rng.randint(len(OCCLUSIONS), size=start.sum())
+
+    def _observe(self):
+        """Returns noisy poses of the current state, sorted by score."""
+        rng = self._rng
+        width, height = self.input_size
+        template = np.repeat(STANDING_POSE[np.newaxis], self.people, axis=0)
+        template[..., 0] += SWING * np.sin(self.phases)[:, np.newaxis]
+        keypoints = self.positions[:, np.newaxis] + template * self.heights[:, np.newaxis,
+                                                                              np.newaxis]
+        keypoints += rng.normal(0, self.keypoint_noise, keypoints.shape)
+
+        keypoint_scores = np.clip(rng.normal(0.9, self.score_noise, keypoints.shape[:2]), 0, 1)
+        for person in np.flatnonzero(self.occluded >= 0):
+            hidden = OCCLUSIONS[self.occluded[person]]
+            keypoint_scores[person, hidden] = rng.uniform(0, 0.1, len(hidden))
+        inside = ((keypoints >= 0) & (keypoints < (width, height))).all(axis=2)
+        keypoint_scores[~inside] = 0
+        if self.mirror:
+            keypoints[..., 0] = width - keypoints[..., 0]
+
+        pose_scores = keypoint_scores.mean(axis=1)
+        order = np.argsort(-pose_scores, kind='stable')[:self.max_poses]
+        self.person_ids = order
+        return (keypoints[order].astype(np.float32), keypoint_scores[order].astype(np.float32),
+                pose_scores[order].astype(np.float32))
+
+    def run_inference(self, input_data):
+        """Advances the simulation by one frame and returns the inference time in ms.
+
+        Args:
+          input_data: Ignored, the frame the poses would come from.
+        """
+        start = time.monotonic()
+        if self.frames:
+            self._step()
+        self.frames += 1
+        self._arrays = self._observe()
+        if self.sleep and self.inference_ms:
+            time.sleep(max(self.inference_ms / 1000 - (time.monotonic() - start), 0))
+        self._inf_time = self.inference_ms / 1000 or time.monotonic() - start
+        return self._inf_time * 1000
+
+    def DetectPosesInImage(self, img):
+        """Runs one frame of the simulation, ignoring the image."""
+        self.run_inference(None)
+        return self.ParseOutput()
+
+    def ParseOutputArrays(self):
+        """Returns the poses of the last frame in the format of poses_to_arrays."""
+        return self._arrays
+
+    def ParseOutput(self):
+        """Returns the poses of the last frame as a list of Pose and the inference time."""
+        return arrays_to_poses(*self._arrays), self._inf_time
+
+    def ParseOutputQuantized(self):
+        """Returns the poses of the last frame as QuantizedPoses and the inference time."""
+        keypoints, keypoint_scores, pose_scores = self._arrays
+
+        def quantize(values, quantization, dtype):
+            scale, zero_point = quantization
+            info = np.iinfo(dtype)
+            return np.clip(np.round(values / scale) + zero_point, info.min, info.max).astype(dtype)
+        return QuantizedPoses(quantize(keypoints, KEYPOINT_QUANTIZATION, np.int16),
+                              quantize(keypoint_scores, SCORE_QUANTIZATION, np.uint8),
+                              quantize(pose_scores, SCORE_QUANTIZATION, np.uint8),
+                              KEYPOINT_QUANTIZATION, SCORE_QUANTIZATION,
+                              SCORE_QUANTIZATION), self._inf_time
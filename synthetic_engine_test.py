@@ -0,0 +1,109 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from pose_engine import KeypointType, Pose, poses_to_arrays
+from pose_tracker import PoseTracker
+from synthetic_engine import SyntheticPoseEngine
+
+
+def run_frames(engine, frames):
+    arrays = []
+    for _ in range(frames):
+        engine.run_inference(None)
+        arrays.append(engine.ParseOutputArrays())
+    return arrays
+
+
+class SyntheticPoseEngineTest(unittest.TestCase):
+
+    def test_engine_surface(self):
+        engine = SyntheticPoseEngine((481, 353), people=3, inference_ms=12)
+        np.testing.assert_array_equal(engine.get_input_tensor_shape(), [1, 353, 481, 3])
+        self.assertEqual(engine.run_inference(np.zeros(481 * 353 * 3, np.uint8)), 12)
+        poses, inference_time = engine.ParseOutput()
+        self.assertEqual(len(poses), 3)
+        self.assertIsInstance(poses[0], Pose)
+        self.assertEqual(set(poses[0].keypoints), set(KeypointType))
+        self.assertAlmostEqual(inference_time, 0.012)
+        # Sorted by score, like the decoder output.
+        scores = [pose.score for pose in poses]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        quantized, _ = engine.ParseOutputQuantized()
+        for dequantized, expected in zip(quantized.dequantize(), poses_to_arrays(poses)):
+            np.testing.assert_allclose(dequantized, expected, atol=1 / 16)
+
+    def test_deterministic(self):
+        first = run_frames(SyntheticPoseEngine(people=10, seed=3), 20)
+        second = run_frames(SyntheticPoseEngine(people=10, seed=3), 20)
+        other = run_frames(SyntheticPoseEngine(people=10, seed=4), 20)
+        for a, b in zip(first, second):
+            for x, y in zip(a, b):
+                np.testing.assert_array_equal(x, y)
+        self.assertFalse(np.allclose(first[-1][0], other[-1][0]))
+
+    def test_people_move_smoothly_and_stay_tracked(self):
+        engine = SyntheticPoseEngine(people=8, occlusion=0, seed=1)
+        tracker = PoseTracker(max_distance=40)
+        previous = None
+        identities = {}
+        for _ in range(90):
+            engine.run_inference(None)
+            keypoints, keypoint_scores, _ = engine.ParseOutputArrays()
+            self.assertEqual(len(keypoints), 8)
+            by_person = np.empty_like(keypoints)
+            by_person[engine.person_ids] = keypoints
+            if previous is not None:
+                steps = np.linalg.norm(by_person[:, KeypointType.NOSE] -
+                                       previous[:, KeypointType.NOSE], axis=1)
+                # About 0.15 frame widths per second at 30 fps, plus noise.
+                self.assertLess(steps.max(), 15)
+            previous = by_person
+            for person, track_id in zip(engine.person_ids,
+                                        tracker.update(keypoints, keypoint_scores)):
+                identities.setdefault(person, set()).add(track_id)
+        moved = np.linalg.norm(engine.velocities, axis=1)
+        self.assertTrue((moved > 0).all())
+        # Mostly one track per person; crossings may swap a few.
+        self.assertLessEqual(np.mean([len(ids) for ids in identities.values()]), 1.5)
+
+    def test_occlusion_and_noise(self):
+        engine = SyntheticPoseEngine(people=50, occlusion=0.5, score_noise=0, seed=2)
+        frames = run_frames(engine, 60)
+        scores = np.concatenate([keypoint_scores for _, keypoint_scores, _ in frames])
+        hidden = scores < 0.2
+        self.assertGreater(hidden.any(axis=1).mean(), 0.3)
+        # Visible keypoints score exactly 0.9 without noise.
+        np.testing.assert_allclose(scores[scores >= 0.2], 0.9)
+        clean = run_frames(SyntheticPoseEngine(people=50, occlusion=0, seed=2), 60)
+        inside = np.concatenate([keypoint_scores for _, keypoint_scores, _ in clean])
+        self.assertLess((inside < 0.2).mean(), 0.1)  # Only keypoints off the frame.
+
+    def test_mirror_and_max_poses(self):
+        plain = SyntheticPoseEngine(people=4, seed=5)
+        mirrored = SyntheticPoseEngine(people=4, mirror=True, max_poses=2, seed=5)
+        plain.run_inference(None)
+        mirrored.run_inference(None)
+        keypoints = plain.ParseOutputArrays()[0]
+        mirrored_keypoints = mirrored.ParseOutputArrays()[0]
+        self.assertEqual(len(mirrored_keypoints), 2)
+        np.testing.assert_allclose(mirrored_keypoints[..., 0], 641 - keypoints[:2, :, 0],
+                                   rtol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
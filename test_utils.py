@@ -14,15 +14,19 @@
 # limitations under the License.
 """Utilities for visualizing posenet results."""
 
-from pose_engine import PoseEngine, Pose, Keypoint, Point
+from pose_engine import PoseEngine, Pose, Keypoint, Point, oks_matrix, poses_to_arrays
 from PIL import Image
 from PIL import ImageDraw
 
 import argparse
+import collections
 import csv
+import model_profiles
 import numpy as np
 import os
 import sys
+import time
+import types
 
 PROJECT_SOURCE_DIR = os.getcwd()
 sys.path.append(PROJECT_SOURCE_DIR)
@@ -48,6 +52,38 @@ def get_random_inputs(input_shape):
     return np.random.random(input_shape).astype(np.uint8)
 
 
+class FakeGstBuffer:
+    """Stands in for a Gst.Buffer with a video meta in tests without GStreamer.
+
+    Install fake_gst_modules() in sys.modules for pose_engine.input_array to
+    map it.
+    """
+
+    def __init__(self, data, width, height, stride, offset=0):
+        self.data = bytes(data)
+        self.meta = types.SimpleNamespace(width=width, height=height, n_planes=1,
+                                          stride=[stride], offset=[offset])
+        self.mapped = 0
+
+    def map(self, flags):
+        self.mapped += 1
+        return True, types.SimpleNamespace(data=self.data)
+
+    def unmap(self, mapinfo):
+        self.mapped -= 1
+
+
+def fake_gst_modules():
+    """Returns sys.modules entries for gi.repository with FakeGstBuffer support."""
+    repository = types.ModuleType('gi.repository')
+    repository.Gst = types.SimpleNamespace(MapFlags=types.SimpleNamespace(READ=1))
+    repository.GstVideo = types.SimpleNamespace(
+        buffer_get_video_meta=lambda buffer: buffer.meta)
+    gi = types.ModuleType('gi')
+    gi.repository = repository
+    return {'gi': gi, 'gi.repository': repository}
+
+
 def write_to_csv(model_name, poses):
     """Write results of posenet model to a corresponding csv file.
     Args:
@@ -140,6 +176,92 @@ def parse_reference_results(model_name):
     return pose_scores, keypoints
 
 
+def reference_arrays(model_name):
+    """Returns the reference results of a model as arrays, like poses_to_arrays."""
+    csv_file_name = os.path.join(
+        TEST_DATA_DIR, model_name.split('.')[0] + '_reference.csv')
+    keypoints = collections.defaultdict(list)
+    keypoint_scores = collections.defaultdict(list)
+    pose_scores = {}
+    with open(csv_file_name, 'r') as csv_file:
+        for row in csv.DictReader(csv_file):
+            pose_id = int(row['pose_id'])
+            pose_scores[pose_id] = float(row['pose_score'])
+            keypoints[pose_id].append((float(row['keypoint_x']), float(row['keypoint_y'])))
+            keypoint_scores[pose_id].append(float(row['keypoint_score']))
+    ids = sorted(pose_scores)
+    return (np.array([keypoints[i] for i in ids], dtype=np.float32).reshape(-1, 17, 2),
+            np.array([keypoint_scores[i] for i in ids], dtype=np.float32).reshape(-1, 17),
+            np.array([pose_scores[i] for i in ids], dtype=np.float32))
+
+
+def mean_oks(keypoints, keypoint_scores, truth, truth_scores, threshold=0.2):
+    """Mean object keypoint similarity of the best matching pose per true pose.
+
+    All keypoints must be in the same (image) coordinates.
+    """
+    if not len(truth):
+        return float('nan')
+    if not len(keypoints):
+        return 0.0
+    # Every detected keypoint counts, visibility is up to the ground truth.
+    oks = oks_matrix(keypoints, np.ones(keypoints.shape[:2]), truth, truth_scores, threshold)
+    return float(oks.max(axis=0).mean())
+
+
+def profile_table(repeat=20, ground_truth='posenet_resnet_50_928_672_16_quant_cpu_decoder',
+                  pose_threshold=0.5):
+    """Prints latency and accuracy of every model profile.
+
+    Models found under MODEL_DIR are run on the test image; for the others,
+    or if a model can't be loaded on this host, the reference results in
+    TEST_DATA_DIR stand in and latency is left empty. There is no labeled
+    data in this repo, so accuracy is the mean OKS against the reference
+    results of the ground_truth model, scaled to test image coordinates.
+    """
+    image = Image.open(TEST_IMAGE).convert('RGB')
+
+    def to_image(keypoints, profile):
+        return keypoints * (np.array(image.size, dtype=np.float32) /
+                            np.array(profile.input_size, dtype=np.float32))
+
+    truth_profile = model_profiles.get_profile(ground_truth)
+    truth, truth_scores, truth_pose_scores = reference_arrays(ground_truth)
+    confident = truth_pose_scores >= pose_threshold
+    truth = to_image(truth[confident], truth_profile)
+    truth_scores = truth_scores[confident]
+
+    print('%-56s %-8s %10s %4s %8s %9s %6s %6s' % (
+        'model', 'device', 'input', 'os', 'source', 'ms', 'fps', 'oks'))
+    for profile in model_profiles.PROFILES.values():
+        latency = ''
+        fps = ''
+        model_path = os.path.join(PROJECT_SOURCE_DIR, profile.model_path)
+        engine = None
+        if os.path.exists(model_path):
+            try:
+                engine = PoseEngine(model_path, profile=profile)
+            except (OSError, ValueError) as e:
+                # E.g. an Edge TPU model on a host without Edge TPU.
+                print('Could not load %s: %s' % (profile.name, e), file=sys.stderr)
+        if engine:
+            source = 'model'
+            poses, _ = engine.DetectPosesInImage(image)
+            times = [engine.DetectPosesInImage(image)[1] for _ in range(repeat)]
+            latency = '%.1f' % (np.median(times) * 1000)
+            fps = '%.1f' % (1 / np.median(times))
+            keypoints, keypoint_scores, pose_scores = poses_to_arrays(poses)
+        else:
+            source = 'ref'
+            keypoints, keypoint_scores, pose_scores = reference_arrays(profile.name)
+        confident = pose_scores >= pose_threshold
+        oks = mean_oks(to_image(keypoints[confident], profile), keypoint_scores[confident],
+                       truth, truth_scores)
+        print('%-56s %-8s %10s %4d %8s %9s %6s %6.3f' % (
+            profile.name, 'edgetpu' if profile.edgetpu else 'cpu',
+            '%dx%d' % profile.input_size, profile.output_stride, source, latency, fps, oks))
+
+
 def generate_results(write_csv=False, visualize_model_results=False, visualize_reference_results=False):
     """Generates results form a model (both from reference results or from new inference).
     Args:
@@ -161,6 +283,28 @@ def generate_results(write_csv=False, visualize_model_results=False, visualize_r
                 model_name, image, input_shape)
 
 
+def benchmark_parse_output(repeat=1000):
+    """Compares ParseOutput and ParseOutputQuantized time and memory per frame."""
+    image = Image.open(TEST_IMAGE).convert('RGB')
+    for model_path, model_name in generate_models():
+        engine = PoseEngine(model_path)
+        poses, _ = engine.DetectPosesInImage(image)
+        keypoints, keypoint_scores, pose_scores = poses_to_arrays(poses)
+        float_bytes = keypoints.nbytes + keypoint_scores.nbytes + pose_scores.nbytes
+        quantized_bytes = engine.ParseOutputQuantized()[0].nbytes
+        start = time.monotonic()
+        for _ in range(repeat):
+            engine.ParseOutput()
+        float_time = (time.monotonic() - start) / repeat
+        start = time.monotonic()
+        for _ in range(repeat):
+            engine.ParseOutputQuantized()
+        quantized_time = (time.monotonic() - start) / repeat
+        print('%s: %d poses, ParseOutput %.1f us, ParseOutputQuantized %.1f us, '
+              'arrays %d vs %d bytes' % (model_name, len(poses), float_time * 1e6,
+                                         quantized_time * 1e6, float_bytes, quantized_bytes))
+
+
 def test_utils_main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--write_csv', default=False,
@@ -169,7 +313,17 @@ def test_utils_main():
                         action='store_true', default=False, help='Visualize new model results.')
     parser.add_argument('--visualize_reference_results',
                         action='store_true', default=False, help='Visualize old reference result from csv.')
+    parser.add_argument('--benchmark_parse', action='store_true', default=False,
+                        help='Compare float and quantized output parsing.')
+    parser.add_argument('--profile_table', action='store_true', default=False,
+                        help='Print speed and accuracy of all model profiles.')
     args = parser.parse_args()
+    if args.benchmark_parse:
+        benchmark_parse_output()
+        return
+    if args.profile_table:
+        profile_table()
+        return
     generate_results(args.write_csv, args.visualize_model_results,
                      args.visualize_reference_results)
 
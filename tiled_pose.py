@@ -0,0 +1,282 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tiled pose detection for frames larger than the model input.
+
+Downscaling a 4K or panoramic frame to the model input makes distant people
+too small to detect. TiledPoseEngine instead cuts the frame into overlapping
+tiles of the model input size, runs them on a pool of engines (one per Edge
+TPU, or several CPU interpreters) and maps the keypoints back to frame
+coordinates. People on a seam are seen by more than one tile; duplicates are
+merged by non-maximum suppression on object keypoint similarity (OKS), and the
+kept pose takes over every keypoint the duplicate saw with a higher score, so
+people cut in half by a tile border come out whole.
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import os
+import queue
+import time
+
+import numpy as np
+from PIL import Image
+
+import model_profiles
+from pose_engine import PoseEngine, arrays_to_poses, input_array, oks_matrix, poses_to_arrays
+
+
+def tile_boxes(frame_size, tile_size, overlap=0.2):
+    """Returns (x, y, width, height) tiles covering a frame.
+
+    Tiles overlap by at least `overlap` of the tile size and are spread
+    evenly, the first and last touching the frame borders. Frames smaller
+    than a tile along an axis get a single, cropped tile along that axis.
+
+    Args:
+      frame_size: (width, height) of the frame.
+      tile_size: (width, height) of a tile, usually the model input size.
+      overlap: Minimum overlap of neighbouring tiles, as a fraction of the
+        tile size.
+    """
+    def starts(length, tile):
+        if length <= tile:
+            return [0]
+        step = max(int(tile * (1 - overlap)), 1)
+        count = -(-(length - tile) // step) + 1
+        return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+    width, height = tile_size
+    return [(x, y, min(width, frame_size[0]), min(height, frame_size[1]))
+            for y in starts(frame_size[1], height) for x in starts(frame_size[0], width)]
+
+
+def merge_poses(keypoints, keypoint_scores, pose_scores, oks_threshold=0.5, threshold=0.2):
+    """Merges duplicate detections of the same person.
+
+    Poses are visited by descending score; a pose whose OKS with an already
+    kept pose exceeds oks_threshold is dropped, and the kept pose takes over
+    each of its keypoints that scored higher.
+
+    Args:
+      keypoints: [N, 17, 2] keypoints in frame coordinates.
+      keypoint_scores: [N, 17] keypoint scores.
+      pose_scores: [N] pose scores.
+      oks_threshold: OKS above which two poses are the same person.
+      threshold: Keypoints scoring below this are ignored for OKS.
+
+    Returns:
+      (keypoints, keypoint_scores, pose_scores) of the merged poses, by
+      descending score.
+    """
+    order = np.argsort(-pose_scores, kind='stable')
+    keypoints = keypoints[order].copy()
+    keypoint_scores = keypoint_scores[order].copy()
+    pose_scores = pose_scores[order]
+    oks = oks_matrix(keypoints, keypoint_scores, keypoints, keypoint_scores, threshold)
+    oks = np.maximum(oks, oks.T)
+
+    kept = []
+    for i in range(len(pose_scores)):
+        duplicate_of = next((k for k in kept if oks[i, k] > oks_threshold), None)
+        if duplicate_of is None:
+            kept.append(i)
+            continue
+        better = keypoint_scores[i] > keypoint_scores[duplicate_of]
+        keypoints[duplicate_of, better] = keypoints[i, better]
+        keypoint_scores[duplicate_of, better] = keypoint_scores[i, better]
+    return keypoints[kept], keypoint_scores[kept], pose_scores[kept]
+
+
+class TiledPoseEngine:
+    """Pose engine for frames larger than the model input.
+
+    Has the interface of PoseEngine, with get_input_tensor_shape reporting
+    the frame size, so it can replace PoseEngine in the camera examples.
+    """
+
+    def __init__(self, model_path, frame_size, overlap=0.2, num_engines=1,
+                 oks_threshold=0.5, threshold=0.2):
+        """Creates a TiledPoseEngine.
+
+        Args:
+          model_path: String, path to the TF-Lite model run on every tile.
+          frame_size: (width, height) of the frames.
+          overlap: Minimum overlap of neighbouring tiles, as a fraction of the
+            tile size.
+          num_engines: Number of engines tiles are spread over. Each engine
+            has its own interpreter; Edge TPU models need one Edge TPU each.
+          oks_threshold: OKS above which detections from different tiles are
+            merged.
+          threshold: Keypoints scoring below this are ignored for merging.
+        """
+        self.engines = [PoseEngine(model_path) for _ in range(num_engines)]
+        _, tile_height, tile_width, _ = self.engines[0].get_input_tensor_shape()
+        self.tile_size = (tile_width, tile_height)
+        self.frame_size = tuple(frame_size)
+        self.tiles = tile_boxes(self.frame_size, self.tile_size, overlap)
+        self.oks_threshold = oks_threshold
+        self.threshold = threshold
+        self._idle = queue.Queue()
+        for engine in self.engines:
+            self._idle.put(engine)
+        self._executor = concurrent.futures.ThreadPoolExecutor(num_engines)
+        self._arrays = poses_to_arrays([])
+        self._inf_time = 0
+
+    def get_input_tensor_shape(self):
+        """Returns the shape of the frames, as [1, height, width, 3]."""
+        return np.array([1, self.frame_size[1], self.frame_size[0], 3])
+
+    def _run_tile(self, frame, box):
+        x, y, width, height = box
+        tile = frame[y:y + height, x:x + width]
+        if (width, height) != self.tile_size:
+            padded = np.zeros((self.tile_size[1], self.tile_size[0], 3), dtype=np.uint8)
+            padded[:height, :width] = tile
+            tile = padded
+        engine = self._idle.get()
+        try:
+            engine.run_inference(np.ascontiguousarray(tile).reshape(-1))
+            poses, _ = engine.ParseOutput()
+        finally:
+            self._idle.put(engine)
+        keypoints, keypoint_scores, pose_scores = poses_to_arrays(poses)
+        keypoints += np.array([x, y], dtype=np.float32)
+        return keypoints, keypoint_scores, pose_scores
+
+    def run_inference(self, input_data):
+        """Runs all tiles of a frame and returns the total time in ms.
+
+        Args:
+          input_data: Flat uint8 RGB buffer of a frame of frame_size, as
+            bytes, array or the Gst.Buffer of the camera pipeline.
+        """
+        start = time.monotonic()
+        frame = input_array(input_data).reshape(
+            self.frame_size[1], self.frame_size[0], 3)
+        results = list(self._executor.map(functools.partial(self._run_tile, frame), self.tiles))
+        self._arrays = merge_poses(*(np.concatenate(r) for r in zip(*results)),
+                                   oks_threshold=self.oks_threshold, threshold=self.threshold)
+        self._inf_time = time.monotonic() - start
+        return self._inf_time * 1000
+
+    def ParseOutputArrays(self):
+        """Returns the merged poses in the format of poses_to_arrays."""
+        return self._arrays
+
+    def ParseOutput(self):
+        """Returns the merged poses as a list of Pose and the inference time."""
+        return arrays_to_poses(*self._arrays), self._inf_time
+
+    def DetectPosesInImage(self, img):
+        """Detects poses in a PIL image, resized to frame_size if needed."""
+        if img.size != self.frame_size:
+            img = img.resize(self.frame_size, Image.NEAREST)
+        self.run_inference(np.asarray(img.convert('RGB')).reshape(-1))
+        return self.ParseOutput()
+
+    def close(self):
+        """Stops the worker threads."""
+        self._executor.shutdown()
+
+
+def make_scene(image, frame_size, copies_per_row):
+    """Tiles scaled copies of an image over a frame.
+
+    Returns:
+      (scene, placements) where scene is a PIL image and placements is a list
+      of (x, y, scale) of every copy.
+    """
+    scale = frame_size[0] / copies_per_row / image.width
+    copy = image.resize((int(image.width * scale), int(image.height * scale)), Image.BILINEAR)
+    scene = Image.new('RGB', frame_size, (128, 128, 128))
+    placements = []
+    for y in range(0, frame_size[1] - copy.height + 1, copy.height):
+        for x in range(0, frame_size[0] - copy.width + 1, copy.width):
+            scene.paste(copy, (x, y))
+            placements.append((x, y, scale))
+    return scene, placements
+
+
+def recall(keypoints, truth, truth_scores, oks_threshold=0.5, threshold=0.2):
+    """Fraction of true poses matched by a detection with OKS >= oks_threshold."""
+    if not len(truth):
+        return float('nan')
+    if not len(keypoints):
+        return 0.0
+    scores = np.ones(keypoints.shape[:2], dtype=np.float32)
+    oks = oks_matrix(keypoints, scores, truth, truth_scores, threshold)
+    return float((oks.max(axis=0) >= oks_threshold).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model', help='.tflite model path, defaults to the 641x481 '
+                        'Edge TPU model.')
+    parser.add_argument('--frame_size', default='3840x2160', help='Frame size, WxH.')
+    parser.add_argument('--copies_per_row', type=int, default=8,
+                        help='Copies of the test image per row of the synthetic scene.')
+    parser.add_argument('--overlap', type=float, default=0.2, help='Tile overlap.')
+    parser.add_argument('--num_engines', type=int, default=1, help='Engines to spread tiles over.')
+    parser.add_argument('--pose_threshold', type=float, default=0.3,
+                        help='Minimum score of detected poses.')
+    parser.add_argument('--frames', type=int, default=3, help='Frames to time.')
+    args = parser.parse_args()
+
+    model = args.model or model_profiles.closest_profile((640, 480)).model_path
+    frame_size = tuple(int(v) for v in args.frame_size.split('x'))
+    image = Image.open(os.path.join('test_data', 'test_couple.jpg')).convert('RGB')
+
+    # Poses of the full size test image, mapped into every copy, are the truth.
+    engine = PoseEngine(model)
+    poses, _ = engine.DetectPosesInImage(image)
+    keypoints, keypoint_scores, pose_scores = poses_to_arrays(poses)
+    confident = pose_scores >= 0.5
+    _, input_height, input_width, _ = engine.get_input_tensor_shape()
+    reference = keypoints[confident] * np.array(
+        [image.width / input_width, image.height / input_height], dtype=np.float32)
+    reference_scores = keypoint_scores[confident]
+    scene, placements = make_scene(image, frame_size, args.copies_per_row)
+    truth = np.concatenate([reference * scale + np.array([x, y], dtype=np.float32)
+                            for x, y, scale in placements])
+    truth_scores = np.concatenate([reference_scores] * len(placements))
+    print('Scene %dx%d with %d people, %s' % (frame_size[0], frame_size[1], len(truth), model))
+
+    # Baseline: the whole frame downscaled to the model input.
+    start = time.monotonic()
+    for _ in range(args.frames):
+        poses, _ = engine.DetectPosesInImage(scene)
+    baseline_time = (time.monotonic() - start) / args.frames
+    keypoints, _, pose_scores = poses_to_arrays(poses)
+    keypoints = keypoints[pose_scores >= args.pose_threshold] * np.array(
+        [frame_size[0] / input_width, frame_size[1] / input_height], dtype=np.float32)
+    print('Downscaled: %.1f ms per frame, %d poses, recall %.2f' % (
+        baseline_time * 1000, len(keypoints), recall(keypoints, truth, truth_scores)))
+
+    tiled = TiledPoseEngine(model, frame_size, args.overlap, args.num_engines)
+    start = time.monotonic()
+    for _ in range(args.frames):
+        tiled.DetectPosesInImage(scene)
+    tiled_time = (time.monotonic() - start) / args.frames
+    keypoints, _, pose_scores = tiled.ParseOutputArrays()
+    keypoints = keypoints[pose_scores >= args.pose_threshold]
+    print('Tiled: %d tiles, %.1f ms per frame, %.1f tiles/s, %d poses, recall %.2f' % (
+        len(tiled.tiles), tiled_time * 1000, len(tiled.tiles) / tiled_time, len(keypoints),
+        recall(keypoints, truth, truth_scores)))
+    tiled.close()
+
+
+if __name__ == '__main__':
+    main()
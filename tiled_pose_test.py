@@ -0,0 +1,121 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+import test_utils
+import tiled_pose
+from pose_index import random_poses
+
+test_image = os.path.join(os.getcwd(), 'test_data/test_couple.jpg')
+model = 'models/mobilenet/posenet_mobilenet_v1_075_353_481_quant_decoder.tflite'
+
+
+class TileBoxesTest(unittest.TestCase):
+
+    def test_covers_frame_with_overlap(self):
+        tiles = tiled_pose.tile_boxes((3840, 2160), (641, 481), overlap=0.2)
+        xs = sorted(set(t[0] for t in tiles))
+        ys = sorted(set(t[1] for t in tiles))
+        self.assertEqual(len(tiles), len(xs) * len(ys))
+        self.assertEqual((xs[0], ys[0]), (0, 0))
+        self.assertEqual((xs[-1] + 641, ys[-1] + 481), (3840, 2160))
+        self.assertLessEqual(max(np.diff(xs)), 641 * 0.8)
+        self.assertLessEqual(max(np.diff(ys)), 481 * 0.8)
+
+    def test_small_frame(self):
+        self.assertEqual(tiled_pose.tile_boxes((400, 300), (641, 481)), [(0, 0, 400, 300)])
+        self.assertEqual(tiled_pose.tile_boxes((641, 300), (641, 481)), [(0, 0, 641, 300)])
+
+
+class MergePosesTest(unittest.TestCase):
+
+    def test_oks_matrix(self):
+        keypoints, keypoint_scores = random_poses(5, seed=1)
+        oks = tiled_pose.oks_matrix(keypoints, keypoint_scores, keypoints, keypoint_scores)
+        np.testing.assert_allclose(np.diag(oks), 1.0, atol=1e-6)
+        self.assertTrue(((oks >= 0) & (oks <= 1)).all())
+
+    def test_merges_seam_duplicates(self):
+        keypoints, keypoint_scores = random_poses(4, seed=2)
+        keypoints = keypoints + np.arange(4)[:, np.newaxis, np.newaxis] * 1000
+        pose_scores = np.array([0.9, 0.8, 0.7, 0.6], dtype=np.float32)
+        keypoint_scores = np.full_like(keypoint_scores, 0.9)
+        # The first person is on a seam: two overlapping tiles see a part of
+        # it each.
+        left = keypoint_scores[0].copy()
+        left[11:] = 0.0
+        right = keypoint_scores[0].copy()
+        right[:6] = 0.0
+        merged = tiled_pose.merge_poses(
+            np.concatenate([keypoints, keypoints[:1] + 0.5]),
+            np.concatenate([[left], keypoint_scores[1:], [right]]),
+            np.concatenate([pose_scores, [pose_scores[0]]]))
+        self.assertEqual(len(merged[2]), 4)
+        first = np.argmin(np.abs(merged[0][:, 0, 0] - keypoints[0, 0, 0]))
+        np.testing.assert_allclose(merged[1][first], 0.9)
+
+    def test_keeps_distinct_people(self):
+        keypoints, keypoint_scores = random_poses(6, seed=3)
+        keypoints = keypoints + np.arange(6)[:, np.newaxis, np.newaxis] * 1000
+        pose_scores = np.linspace(0.2, 0.9, 6, dtype=np.float32)
+        merged = tiled_pose.merge_poses(keypoints, keypoint_scores, pose_scores)
+        self.assertEqual(len(merged[2]), 6)
+        self.assertTrue((np.diff(merged[2]) <= 0).all())
+
+
+class TiledPoseEngineTest(unittest.TestCase):
+
+    def test_finds_small_people(self):
+        image = Image.open(test_image).convert('RGB')
+        scene, placements = tiled_pose.make_scene(image, (962, 353), 2)
+        self.assertEqual(len(placements), 2)
+        engine = tiled_pose.TiledPoseEngine(model, scene.size)
+        self.assertEqual(len(engine.tiles), 3)
+        poses, _ = engine.DetectPosesInImage(scene)
+        engine.close()
+        confident = [pose for pose in poses if pose.score >= 0.5]
+        self.assertEqual(len(confident), 4)
+        for placement_x, _, _ in placements:
+            self.assertEqual(sum(placement_x <= pose.keypoints[0].point.x < placement_x + 481
+                                 for pose in confident), 2)
+
+    def test_gst_buffer_input(self):
+        image = Image.open(test_image).convert('RGB')
+        scene, _ = tiled_pose.make_scene(image, (962, 353), 2)
+        engine = tiled_pose.TiledPoseEngine(model, scene.size)
+        expected, _ = engine.DetectPosesInImage(scene)
+        # Camera pipelines pass a Gst.Buffer, here with rows padded to 4 bytes.
+        rows = np.asarray(scene).reshape(353, -1)
+        stride = 962 * 3 + 2
+        padded = np.zeros((353, stride), dtype=np.uint8)
+        padded[:, :rows.shape[1]] = rows
+        buffer = test_utils.FakeGstBuffer(padded.tobytes(), 962, 353, stride)
+        with mock.patch.dict(sys.modules, test_utils.fake_gst_modules()):
+            engine.run_inference(buffer)
+        poses, _ = engine.ParseOutput()
+        engine.close()
+        self.assertEqual(len(poses), len(expected))
+        for pose, expected_pose in zip(poses, expected):
+            self.assertAlmostEqual(pose.score, expected_pose.score)
+
+
+if __name__ == '__main__':
+    unittest.main()